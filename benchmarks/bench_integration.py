@@ -0,0 +1,295 @@
+"""
+Benchmarks of the MAmotif integration stages on synthetic data.
+
+Each stage (parsing, matching, testing, correction, writing and the
+promoter/distal split) is timed separately and the timings are written as
+JSON, so that different versions can be compared::
+
+    $ python benchmarks/bench_integration.py --regions 50000 --motifs 1000 \\
+        -o bench_new.json --compare bench_old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# only the APIs of all MAmotif versions, the stages of newer APIs are
+# imported when run and reported as unavailable on older versions
+from mamotif import __version__
+from mamotif.integration import mamotif_test, run_integration
+from mamotif.io import write_mamotif_results
+from mamotif.region import load_mamotif_regions
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import generate_dataset  # noqa: E402
+
+BENCHMARK_FORMAT_VERSION = 1
+
+
+def _time(func, repeat=3):
+    """Time `func` over `repeat` runs, return the timings and last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def _summary(timings):
+    return {'min': min(timings), 'median': float(np.median(timings)),
+            'runs': timings}
+
+
+def _match(paths):
+    """Parse both files, return a function matching them (for timing)."""
+    from mamotif.io import read_manorm_values, read_motif_sites_number
+    from mamotif.region import RegionTable, match_manorm_regions
+
+    chroms, chrom_codes, starts, ends, m_values = read_manorm_values(
+        paths['manorm'])
+    manorm_regions = RegionTable(
+        motifs=[], chroms=chroms, chrom_codes=chrom_codes, starts=starts,
+        ends=ends, presence=np.empty((len(starts), 0), dtype=bool),
+        m_values=m_values)
+    motifs, chroms, chrom_codes, starts, ends, presence = \
+        read_motif_sites_number(paths['motifscan'],
+                                transform=lambda counts: counts > 0)
+
+    def match():
+        regions = RegionTable(motifs=motifs, chroms=chroms,
+                              chrom_codes=chrom_codes, starts=starts,
+                              ends=ends, presence=presence)
+        match_manorm_regions(regions, manorm_regions)
+    return match
+
+
+def _optional(stages, names, func):
+    """Run the timings of newer APIs, unavailable if they are missing."""
+    try:
+        func()
+    except ImportError as e:
+        for name in names:
+            stages[name] = {'unavailable': str(e)}
+
+
+def _bench_parse(paths, repeat, stages):
+    from mamotif.io import read_manorm_values, read_motif_sites_number
+
+    timings, _ = _time(lambda: read_manorm_values(paths['manorm']), repeat)
+    stages['read_manorm_values'] = _summary(timings)
+    timings, _ = _time(
+        lambda: read_motif_sites_number(
+            paths['motifscan'], transform=lambda counts: counts > 0),
+        repeat)
+    stages['read_motif_sites_number'] = _summary(timings)
+    timings, _ = _time(_match(paths), repeat)
+    stages['match_manorm_regions'] = _summary(timings)
+
+
+def _bench_tests(motifs, regions, results, repeat, n_jobs, tmp_dir, stages):
+    from mamotif.correction import adjust_p_values
+    from mamotif.integration import OUTPUT_FORMATS, integrate_regions
+
+    timings, _ = _time(lambda: adjust_p_values(results.t_pval), repeat)
+    stages['adjust_p_values'] = _summary(timings)
+    timings, _ = _time(
+        lambda: integrate_regions([(motifs, regions, False)], pairs=True,
+                                  n_jobs=n_jobs), repeat)
+    stages['integrate_regions[pairs]'] = _summary(timings)
+    path = os.path.join(tmp_dir, 'bench' + OUTPUT_FORMATS['xls.gz'])
+    timings, _ = _time(
+        lambda: write_mamotif_results(path, results, 'benjamin'), repeat)
+    stages['write_mamotif_results[xls.gz]'] = _summary(timings)
+
+
+def _bench_split(paths, motifs, regions, repeat, options, tmp_dir, stages):
+    from mamotif.integration import mamotif_test_grouped
+    from mamotif.promoter import PromoterIndex
+    from mamotif.stratify import Stratifier
+
+    timings, promoters = _time(
+        lambda: PromoterIndex.from_gene_file(paths['genes']), repeat)
+    stages['split:promoter_index'] = _summary(timings)
+    stratifier = Stratifier(promoters=promoters)
+    timings, subsets = _time(lambda: stratifier.subsets(regions), repeat)
+    stages['split:classify'] = _summary(timings)
+    masks = [mask for _, mask in subsets]
+    timings, _ = _time(
+        lambda: mamotif_test_grouped(motifs, regions, masks), repeat)
+    stages['split:mamotif_test'] = _summary(timings)
+    timings, _ = _time(
+        lambda: run_integration(paths['manorm'], paths['motifscan'],
+                                output_dir=tmp_dir, stratifier=stratifier,
+                                **options), repeat)
+    stages['run_integration[split]'] = _summary(timings)
+
+
+def run_benchmarks(paths, repeat=3, presence_format='dense', n_jobs=1,
+                   work_dir=None):
+    """Run the benchmarks of all stages on a dataset.
+
+    The end-to-end path (`load_mamotif_regions`, `mamotif_test`,
+    `write_mamotif_results` and `run_integration`) is timed through the APIs
+    of all MAmotif versions, the stages of newer APIs are reported as
+    unavailable on older versions.
+
+    Parameters
+    ----------
+    paths : dict
+        Paths of the dataset, see `synthetic.generate_dataset`.
+    repeat : int, optional
+        Number of runs of each stage.
+    presence_format : {'dense', 'packed', 'sparse'}, optional
+        In-memory format of the motif presence matrix.
+    n_jobs : int, optional
+        Number of processes of the motif pair and the end-to-end
+        `run_integration` stages.
+    work_dir : str, optional
+        Directory to write the outputs, a temporary directory by default.
+
+    Returns
+    -------
+    dict
+        Timings (in seconds) of each stage.
+    """
+    # only pass the options of newer versions if not the defaults
+    load_options = {}
+    options = {}
+    if presence_format != 'dense':
+        load_options = {'packed': presence_format == 'packed',
+                        'sparse_presence': presence_format == 'sparse'}
+        options['presence_format'] = presence_format
+    if n_jobs != 1:
+        options['n_jobs'] = n_jobs
+    stages = {}
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        _optional(stages, ['read_manorm_values', 'read_motif_sites_number',
+                           'match_manorm_regions'],
+                  lambda: _bench_parse(paths, repeat, stages))
+        timings, (motifs, regions) = _time(
+            lambda: load_mamotif_regions(paths['manorm'], paths['motifscan'],
+                                         **load_options), repeat)
+        stages['load_mamotif_regions'] = _summary(timings)
+
+        timings, results = _time(lambda: mamotif_test(motifs, regions),
+                                 repeat)
+        stages['mamotif_test'] = _summary(timings)
+        path = os.path.join(tmp_dir, 'bench.xls')
+        timings, _ = _time(
+            lambda: write_mamotif_results(path, results, 'benjamin'), repeat)
+        stages['write_mamotif_results[xls]'] = _summary(timings)
+        _optional(stages, ['adjust_p_values', 'integrate_regions[pairs]',
+                           'write_mamotif_results[xls.gz]'],
+                  lambda: _bench_tests(motifs, regions, results, repeat,
+                                       n_jobs, tmp_dir, stages))
+
+        timings, _ = _time(
+            lambda: run_integration(paths['manorm'], paths['motifscan'],
+                                    output_dir=tmp_dir, **options), repeat)
+        stages['run_integration'] = _summary(timings)
+        _optional(stages, ['split:promoter_index', 'split:classify',
+                           'split:mamotif_test', 'run_integration[split]'],
+                  lambda: _bench_split(paths, motifs, regions, repeat,
+                                       options, tmp_dir, stages))
+    return stages
+
+
+def environment():
+    """Return the versions and platform the benchmarks run on."""
+    return {'mamotif': __version__, 'numpy': np.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()}
+
+
+def compare(report, baseline):
+    """Format the speedup of each stage over a baseline report."""
+    lines = [f"{'stage':<36}{'baseline':>12}{'current':>12}{'speedup':>9}"]
+    for stage, timing in report['stages'].items():
+        old_timing = baseline['stages'].get(stage, {})
+        if 'min' not in timing or 'min' not in old_timing:
+            continue
+        old = old_timing['min']
+        new = timing['min']
+        lines.append(f"{stage:<36}{old:>12.6f}{new:>12.6f}"
+                     f"{old / new if new > 0 else float('inf'):>8.2f}x")
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the MAmotif integration stages on synthetic "
+                    "data.")
+    parser.add_argument("--regions", type=int, default=20000,
+                        help="Number of genomic regions. Default: 20000")
+    parser.add_argument("--motifs", type=int, default=500,
+                        help="Number of motifs. Default: 500")
+    parser.add_argument("--chroms", type=int, default=20,
+                        help="Number of chromosomes. Default: 20")
+    parser.add_argument("--density", type=float, default=0.1,
+                        help="Average fraction of regions with a motif "
+                             "present. Default: 0.1")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed of the synthetic data. Default: 0")
+    parser.add_argument("--gzip", action="store_true",
+                        help="Gzip-compress the synthetic input files.")
+    parser.add_argument("--presence-format", dest="presence_format",
+                        choices=["dense", "packed", "sparse"],
+                        default="dense",
+                        help="In-memory format of the motif presence matrix. "
+                             "Default: dense")
+    parser.add_argument("-j", "--jobs", type=int, default=1, dest="n_jobs",
+                        help="Number of processes of the motif pair tests "
+                             "and the end-to-end integration. Default: 1")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs of each stage. Default: 3")
+    parser.add_argument("--data-dir", dest="data_dir",
+                        help="Directory to keep the synthetic data, a "
+                             "temporary directory by default.")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Path of the JSON report.")
+    parser.add_argument("--compare", metavar="JSON",
+                        help="Print the speedups over a previous report.")
+    args = parser.parse_args(args)
+
+    config = {'regions': args.regions, 'motifs': args.motifs,
+              'chroms': args.chroms, 'density': args.density,
+              'seed': args.seed, 'gzip': args.gzip,
+              'presence_format': args.presence_format,
+              'n_jobs': args.n_jobs, 'repeat': args.repeat}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        paths = generate_dataset(
+            data_dir, n_regions=args.regions, n_motifs=args.motifs,
+            n_chroms=args.chroms, density=args.density, seed=args.seed,
+            compress=args.gzip)
+        stages = run_benchmarks(paths, repeat=args.repeat,
+                                presence_format=args.presence_format,
+                                n_jobs=args.n_jobs)
+    report = {'format_version': BENCHMARK_FORMAT_VERSION,
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'environment': environment(), 'config': config,
+              'stages': stages}
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+    for stage, timing in stages.items():
+        if 'min' in timing:
+            print(f"{stage:<36}{timing['min']:>12.6f} s")
+        else:
+            print(f"{stage:<36}{'unavailable':>14}")
+    if args.compare:
+        with open(args.compare) as fin:
+            print(compare(report, json.load(fin)))
+
+
+if __name__ == '__main__':
+    main()
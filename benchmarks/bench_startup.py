@@ -0,0 +1,72 @@
+"""
+Benchmarks of the start-up time of the `mamotif` command line interface.
+
+Each command is run in a fresh interpreter several times, the best time is
+reported (written as JSON with ``-o``)::
+
+    $ python benchmarks/bench_startup.py -o startup.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from mamotif import __version__
+
+COMMANDS = {
+    'version': ['-v'],
+    'help': ['-h'],
+    'integrate_help': ['integrate', '-h'],
+    'run_help': ['run', '-h'],
+}
+# modules imported by each subcommand
+IMPORTS = {
+    'integrate': 'mamotif.cli.intergrate',
+    'integrate_batch': 'mamotif.cli.integrate_batch',
+    'run': 'mamotif.cli.run',
+}
+
+
+def _best_time(args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmarks(repeat=5):
+    """Return the best start-up times (in seconds) of the commands."""
+    timings = {'python': _best_time([sys.executable, '-c', 'pass'], repeat)}
+    for name, args in COMMANDS.items():
+        timings[name] = _best_time(
+            [sys.executable, '-m', 'mamotif.cli.main'] + args, repeat)
+    for name, module in IMPORTS.items():
+        timings[f'import_{name}'] = _best_time(
+            [sys.executable, '-c', f'import {module}'], repeat)
+    return timings
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the start-up time of the mamotif CLI.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of runs of each command. Default: 5")
+    parser.add_argument("-o", "--output",
+                        help="Path of the JSON report.")
+    args = parser.parse_args(args)
+    timings = run_benchmarks(repeat=args.repeat)
+    for name, timing in timings.items():
+        print(f"{name:<24}{timing:>10.3f} s")
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump({'mamotif': __version__, 'python': sys.version,
+                       'repeat': args.repeat, 'timings': timings}, fout,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Synthetic MAnorm/MotifScan data for the MAmotif benchmarks.
+
+Writes a MAnorm ``*_MAvalues.xls`` file, the matching MotifScan
+``motif_sites_number.xls`` file and a refGene-style gene annotation file
+(for the promoter/distal split) of configurable size.
+"""
+
+import gzip
+import os
+
+import numpy as np
+
+MANORM_HEADER = ("chr\tstart\tend\tsummit\tM_value\tA_value\tP_value\t"
+                 "Peak_Group\n")
+
+# genomic spacing of the synthetic regions
+REGION_WIDTH = 1000
+MEAN_GAP = 10000
+
+
+def _open(path, compress=False):
+    if compress:
+        return gzip.open(path + '.gz', 'wt', compresslevel=1)
+    return open(path, 'w')
+
+
+def _write_rows(fout, columns):
+    """Write columns of values (lists of str) as tab-separated rows."""
+    fout.write(''.join(line + '\n' for line in map('\t'.join, zip(*columns))))
+
+
+def generate_dataset(output_dir, n_regions=20000, n_motifs=500, n_chroms=20,
+                     density=0.1, n_genes=None, effect=0.5,
+                     enriched_fraction=0.05, name='synthetic', seed=0,
+                     compress=False):
+    """Generate a synthetic MAnorm/MotifScan dataset.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory to write the files.
+    n_regions : int, optional
+        Number of genomic regions.
+    n_motifs : int, optional
+        Number of motifs.
+    n_chroms : int, optional
+        Number of chromosomes the regions are spread over.
+    density : float, optional
+        Average fraction of regions with each motif present. The density of
+        each motif is drawn around it.
+    n_genes : int, optional
+        Number of genes of the annotation file, defaults to a tenth of the
+        number of regions.
+    effect : float, optional
+        Shift of the M values of regions with an enriched motif present.
+    enriched_fraction : float, optional
+        Fraction of motifs enriched in regions with high M values.
+    name : str, optional
+        Sample name, the MAnorm file is ``{name}_MAvalues.xls``.
+    seed : int, optional
+        Random seed.
+    compress : bool, optional
+        Whether to gzip-compress the files (with a ``.gz`` suffix).
+
+    Returns
+    -------
+    dict
+        Paths of the ``manorm``, ``motifscan`` and ``genes`` files.
+    """
+    rng = np.random.RandomState(seed)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if n_genes is None:
+        n_genes = max(n_regions // 10, 1)
+
+    # regions are evenly spread over the chromosomes, sorted by coordinates
+    chrom_codes = np.sort(rng.randint(n_chroms, size=n_regions))
+    chroms = [f'chr{idx + 1}' for idx in range(n_chroms)]
+    gaps = rng.randint(REGION_WIDTH, 2 * MEAN_GAP - REGION_WIDTH,
+                       size=n_regions)
+    starts = np.cumsum(gaps)
+    # restart the coordinates on each chromosome
+    firsts = np.searchsorted(chrom_codes, chrom_codes, side='left')
+    starts = starts - starts[firsts] + gaps[firsts]
+    ends = starts + REGION_WIDTH
+
+    # motif presence and site numbers
+    densities = np.clip(rng.gamma(2.0, density / 2.0, size=n_motifs), 1e-4,
+                        0.9)
+    present = rng.random_sample((n_regions, n_motifs)) < densities
+    counts = present * (1 + rng.poisson(0.3, size=(n_regions, n_motifs)))
+
+    # M values, shifted by the enriched motifs
+    m_values = rng.normal(0, 1, size=n_regions)
+    n_enriched = int(round(n_motifs * enriched_fraction))
+    if n_enriched:
+        m_values += effect * present[:, :n_enriched].sum(axis=1)
+    a_values = rng.normal(8, 1.5, size=n_regions)
+    p_values = rng.random_sample(n_regions)
+
+    region_chroms = [chroms[code] for code in chrom_codes.tolist()]
+    region_starts = [str(start) for start in starts.tolist()]
+    region_ends = [str(end) for end in ends.tolist()]
+    summits = [str(REGION_WIDTH // 2)] * n_regions
+
+    paths = {
+        'manorm': os.path.join(output_dir, f'{name}_MAvalues.xls'),
+        'motifscan': os.path.join(output_dir, 'motif_sites_number.xls'),
+        'genes': os.path.join(output_dir, 'genes.txt')}
+    with _open(paths['manorm'], compress) as fout:
+        fout.write(MANORM_HEADER)
+        _write_rows(fout, [
+            region_chroms, region_starts, region_ends, summits,
+            [repr(value) for value in m_values.tolist()],
+            [repr(value) for value in a_values.tolist()],
+            [repr(value) for value in p_values.tolist()],
+            ['unique' if abs(value) > 1 else 'common'
+             for value in m_values.tolist()]])
+
+    motifs = [f'MA{idx + 1:04d}.1,M{idx + 1}' for idx in range(n_motifs)]
+    with _open(paths['motifscan'], compress) as fout:
+        fout.write('chr\tstart\tend\t' + '\t'.join(motifs) + '\n')
+        rows = ('\t'.join(map(str, row)) for row in counts.tolist())
+        _write_rows(fout, [region_chroms, region_starts, region_ends, rows])
+
+    # genes near the regions, so that part of them fall in promoters
+    gene_regions = rng.randint(n_regions, size=n_genes)
+    tss = starts[gene_regions] + rng.randint(
+        -MEAN_GAP, MEAN_GAP, size=n_genes)
+    tss = np.maximum(tss, 1)
+    forward = rng.random_sample(n_genes) < 0.5
+    gene_ends = tss + 20000
+    with _open(paths['genes'], compress) as fout:
+        for idx, (code, pos, end, is_forward) in enumerate(zip(
+                chrom_codes[gene_regions].tolist(), tss.tolist(),
+                gene_ends.tolist(), forward.tolist())):
+            # refGene: bin, name, chrom, strand, txStart, txEnd, ...
+            if is_forward:
+                tx_start, tx_end = pos, end
+            else:
+                tx_start, tx_end = max(pos - 20000, 0), pos
+            fout.write(f"0\tNM_{idx}\t{chroms[code]}\t"
+                       f"{'+' if is_forward else '-'}\t{tx_start}\t{tx_end}\t"
+                       f"{tx_start}\t{tx_end}\t1\t{tx_start},\t{tx_end},\t"
+                       f"0\tG{idx}\tcmpl\tcmpl\t0,\n")
+    if compress:
+        paths = {key: path + '.gz' for key, path in paths.items()}
+    return paths
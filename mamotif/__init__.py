@@ -1 +1,18 @@
+import sys
+
 __version__ = '1.1.0'
+
+# the in-memory API is imported on first use, so that the command line
+# interface starts without importing numpy/scipy
+_API = ('integrate_arrays', 'integrate_frame')
+
+
+def __getattr__(name):
+    if name in _API:
+        from mamotif import integration
+        return getattr(integration, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if sys.version_info < (3, 7):  # no module __getattr__ (PEP 562)
+    from mamotif.integration import integrate_arrays, integrate_frame  # noqa
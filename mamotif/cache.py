@@ -0,0 +1,599 @@
+"""
+mamotif.cache
+-------------
+
+Persistent on-disk cache of parsed and matched integration inputs, and of
+the per-motif statistics for incremental integration.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from scipy import sparse
+
+from mamotif.promoter import PromoterIndex
+from mamotif.region import (PackedPresence, RegionTable, SparsePresence,
+                            _stack_rows)
+from mamotif.stats import _column_blocks, dose_sums, grouped_statistics
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+META_FILE = 'meta.json'
+STALE_SECONDS = 24 * 60 * 60
+REGION_ARRAYS = ('chrom_codes', 'starts', 'ends', 'm_values')
+PRESENCE_FILE = 'presence_bits.npy'
+SITE_COUNTS_FILE = 'site_counts.npy'
+PROMOTER_FILE = 'promoters.npz'
+STATISTICS_FILE = 'statistics.npz'
+# number of per-motif statistics, see `mamotif.stats.grouped_statistics`
+N_STATISTICS = 7
+# number of per-motif dose-response sums, see `mamotif.stats.dose_sums`
+N_DOSE_SUMS = 3
+# number of regions converted per block between dense and sparse arrays
+ROW_BLOCK = 65536
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """Compute the BLAKE2b digest of the content of a file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_signature(path):
+    """Return the path, size, mtime and content digest of a file."""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'digest': file_digest(path)}
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def evict(cache_dir, max_size, keep=()):
+    """Remove least recently used entries until the cache fits `max_size`.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache directory, each entry is a sub-directory of it.
+    max_size : int
+        Maximal total size of the cache in bytes.
+    keep : iterable of str, optional
+        Names of entries that should never be evicted.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not os.path.isdir(path):
+            continue
+        if name.startswith('.'):
+            # temporary entry being written, or left over by a crashed run
+            if time.time() - os.path.getmtime(path) > STALE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        meta_path = os.path.join(path, META_FILE)
+        try:
+            last_used = os.path.getmtime(meta_path)
+        except OSError:
+            last_used = 0  # incomplete entry, evict first
+        entries.append((last_used, name, path, _dir_size(path)))
+    total = sum(entry[3] for entry in entries)
+    for _, name, path, size in sorted(entries):
+        if total <= max_size:
+            break
+        if name in keep:
+            continue
+        logger.debug(f"Evicting cache entry {path}")
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _save_counts(path, counts):
+    """Save the (dense or sparse) site numbers as a dense `.npy` file."""
+    if not sparse.issparse(counts):
+        np.save(path, counts)
+        return
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=counts.dtype,
+                                    shape=counts.shape)
+    rows = counts.tocsr()
+    for start in range(0, counts.shape[0], ROW_BLOCK):
+        out[start:start + ROW_BLOCK] = rows[start:start + ROW_BLOCK].toarray()
+    out.flush()
+
+
+class RegionCache:
+    """Cache of matched region tables, keyed by the integration inputs.
+
+    Each entry stores the region columns and the bit-packed presence matrix
+    (and the motif site numbers, if loaded) as raw `.npy` files, which are
+    memory-mapped when loaded.
+
+    Parameters
+    ----------
+    path : str
+        The cache directory.
+    max_size : int, optional
+        Maximal total size of the cache in bytes, least recently used entries
+        are evicted when it is exceeded. Unlimited if not specified.
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self._signatures = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    def _key(self, signatures):
+        text = json.dumps({'version': CACHE_VERSION, 'inputs': signatures},
+                          sort_keys=True)
+        return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+    def load(self, f_manorm, f_motifscan, packed=False, site_counts=False,
+             sparse_presence=False):
+        """Load the cached regions of the inputs.
+
+        Parameters
+        ----------
+        f_manorm : str
+            Path of the MAnorm `*_MAvalues.xls` file.
+        f_motifscan : str
+            Path of the MotifScan `motif_sites_number.xls` file.
+        packed : bool, optional
+            If True, keep the presence matrix bit-packed and memory-mapped,
+            otherwise unpack it into memory.
+        site_counts : bool, optional
+            If True, also load the motif site numbers. Entries stored without
+            them are missing.
+        sparse_presence : bool, optional
+            If True, convert the presence matrix (and the site numbers) into
+            sparse matrices, see `mamotif.region.SparsePresence`.
+
+        Returns
+        -------
+        key : str
+            The cache key of the inputs.
+        motifs : list of str or None
+            The motif names, None if the entry is missing.
+        regions : `RegionTable` or None
+            The matched regions, None if the entry is missing.
+        """
+        signatures = [file_signature(f_manorm), file_signature(f_motifscan)]
+        key = self._key(signatures)
+        self._signatures[key] = signatures
+        entry = os.path.join(self.path, key)
+        if not os.path.isdir(entry):
+            logger.debug(f"Cache miss: {key}")
+            return key, None, None
+        try:
+            with open(os.path.join(entry, META_FILE)) as fin:
+                meta = json.load(fin)
+            if meta['version'] != CACHE_VERSION or \
+                    meta['inputs'] != signatures:
+                raise ValueError("stale cache entry")
+            if site_counts and 'site_counts' not in meta['arrays']:
+                logger.debug(f"Cache miss (no site counts): {key}")
+                return key, None, None
+            arrays = {}
+            for name in REGION_ARRAYS:
+                array = np.load(os.path.join(entry, name + '.npy'),
+                                mmap_mode='r')
+                expected = meta['arrays'][name]
+                if list(array.shape) != expected['shape'] or \
+                        array.dtype.str != expected['dtype']:
+                    raise ValueError(f"corrupted array: {name}")
+                arrays[name] = array
+            presence = PackedPresence.load(
+                os.path.join(entry, PRESENCE_FILE), len(meta['motifs']))
+            if len(presence) != len(arrays['starts']):
+                raise ValueError("corrupted array: presence")
+            counts = None
+            if site_counts:
+                counts = np.load(os.path.join(entry, SITE_COUNTS_FILE),
+                                 mmap_mode='r')
+            if sparse_presence:
+                if counts is not None:
+                    counts = _stack_rows(
+                        (counts[start:start + ROW_BLOCK]
+                         for start in range(0, len(counts), ROW_BLOCK)),
+                        counts.shape)
+                    presence = SparsePresence(counts)
+                else:
+                    presence = SparsePresence.from_dense(presence)
+            elif not packed:
+                presence = presence.to_dense()
+            regions = RegionTable(motifs=meta['motifs'],
+                                  chroms=meta['chroms'], presence=presence,
+                                  site_counts=counts, **arrays)
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Removing invalid cache entry {entry}: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return key, None, None
+        os.utime(os.path.join(entry, META_FILE))  # mark as recently used
+        logger.info(f"Loaded {len(regions)} genomic regions from cache")
+        return key, regions.motifs, regions
+
+    def store(self, key, regions):
+        """Store the matched regions under the `key` returned by `load`."""
+        signatures = self._signatures[key]
+        for signature in signatures:
+            stat = os.stat(signature['path'])
+            if (stat.st_size, stat.st_mtime_ns) != (signature['size'],
+                                                    signature['mtime_ns']):
+                logger.warning(f"{signature['path']} changed during "
+                               f"integration, not cached")
+                return
+        meta = {'version': CACHE_VERSION, 'inputs': signatures,
+                'motifs': regions.motifs, 'chroms': regions.chroms,
+                'created': time.time(), 'arrays': {}}
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.path)
+        try:
+            for name in REGION_ARRAYS:
+                array = getattr(regions, name)
+                np.save(os.path.join(tmp_dir, name + '.npy'), array)
+                meta['arrays'][name] = {'shape': list(array.shape),
+                                        'dtype': array.dtype.str}
+            path = os.path.join(tmp_dir, PRESENCE_FILE)
+            if isinstance(regions.presence, PackedPresence):
+                regions.presence.save(path)
+            elif isinstance(regions.presence, SparsePresence):
+                regions.presence.to_packed(path=path)
+            else:
+                PackedPresence.from_dense(regions.presence, path=path)
+            if regions.site_counts is not None:
+                _save_counts(os.path.join(tmp_dir, SITE_COUNTS_FILE),
+                             regions.site_counts)
+                meta['arrays']['site_counts'] = {
+                    'shape': list(regions.site_counts.shape),
+                    'dtype': regions.site_counts.dtype.str}
+            # write the metadata last, an entry without it is incomplete
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as fout:
+                json.dump(meta, fout)
+            entry = os.path.join(self.path, key)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp_dir, entry)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        logger.debug(f"Cached genomic regions to {entry}")
+        if self.max_size is not None:
+            evict(self.path, self.max_size, keep=(key,))
+
+
+class PromoterCache:
+    """Cache of promoter indexes, keyed by the gene annotations and window.
+
+    Entries share the cache directory (and its size limit) with
+    `RegionCache`.
+
+    Parameters
+    ----------
+    path : str
+        The cache directory.
+    max_size : int, optional
+        Maximal total size of the cache in bytes, least recently used entries
+        are evicted when it is exceeded. Unlimited if not specified.
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def _meta(f_genes, upstream, downstream):
+        stat = os.stat(f_genes)
+        return {'version': CACHE_VERSION, 'type': 'promoters',
+                'genes': {'path': os.path.abspath(f_genes),
+                          'size': stat.st_size,
+                          'mtime_ns': stat.st_mtime_ns},
+                'upstream': upstream, 'downstream': downstream}
+
+    def _key(self, meta):
+        text = json.dumps(meta, sort_keys=True)
+        return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+    def load(self, f_genes, upstream=4000, downstream=2000):
+        """Load the promoter index of a gene annotation file.
+
+        The index is built from the gene annotations and cached if the entry
+        is missing.
+        """
+        meta = self._meta(f_genes, upstream, downstream)
+        key = self._key(meta)
+        entry = os.path.join(self.path, key)
+        if os.path.isfile(os.path.join(entry, META_FILE)):
+            try:
+                index = PromoterIndex.load(os.path.join(entry, PROMOTER_FILE))
+                os.utime(os.path.join(entry, META_FILE))
+                logger.debug(f"Loaded promoter index from cache: {key}")
+                return index
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning(f"Removing invalid cache entry {entry}: {e}")
+                shutil.rmtree(entry, ignore_errors=True)
+        index = PromoterIndex.from_gene_file(f_genes, upstream=upstream,
+                                             downstream=downstream)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.path)
+        try:
+            index.save(os.path.join(tmp_dir, PROMOTER_FILE))
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as fout:
+                json.dump(meta, fout)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp_dir, entry)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return index
+        if self.max_size is not None:
+            evict(self.path, self.max_size, keep=(key,))
+        return index
+
+
+def column_digests(presence, block_size=4096):
+    """Compute the BLAKE2b digest of each motif column of a presence matrix.
+
+    Parameters
+    ----------
+    presence : (n_regions, n_motifs) array_like of bool, `PackedPresence` or
+        `SparsePresence`
+        Motif presence indicators of each region.
+    block_size : int, optional
+        Number of motifs unpacked per block.
+
+    Returns
+    -------
+    list of bytes
+        The digest of the packed presence column of each motif.
+    """
+    column_block, _ = _column_blocks(presence)
+    n_regions, n_motifs = np.shape(presence)
+    digests = []
+    for start in range(0, n_motifs, block_size):
+        end = min(start + block_size, n_motifs)
+        # pack along regions, one contiguous row of bytes per motif
+        columns = np.ascontiguousarray(
+            np.packbits(column_block(start, end), axis=0).T)
+        digests.extend(hashlib.blake2b(row, digest_size=16).digest()
+                       for row in columns)
+    return digests
+
+
+def count_digests(site_counts, block_size=4096):
+    """Compute the BLAKE2b digest of each motif column of the site numbers.
+
+    Parameters
+    ----------
+    site_counts : (n_regions, n_motifs) array_like of int
+        The motif site numbers of each region, dense or `scipy.sparse`.
+    block_size : int, optional
+        Number of dense motif columns read per block.
+
+    Returns
+    -------
+    list of bytes
+        The digest of the nonzero rows and site numbers of each motif, the
+        same for dense and sparse site numbers.
+    """
+    n_regions, n_motifs = np.shape(site_counts)
+    digests = []
+
+    def _digest(rows, values):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.asarray(rows, dtype='<i8').tobytes())
+        digest.update(np.asarray(values, dtype='<u4').tobytes())
+        return digest.digest()
+
+    if sparse.issparse(site_counts):
+        columns = sparse.csc_matrix(site_counts)
+        if not columns.has_sorted_indices:
+            columns = columns.sorted_indices()
+        for idx in range(n_motifs):
+            span = slice(columns.indptr[idx], columns.indptr[idx + 1])
+            rows, values = columns.indices[span], columns.data[span]
+            nonzero = values != 0
+            digests.append(_digest(rows[nonzero], values[nonzero]))
+        return digests
+    for start in range(0, n_motifs, block_size):
+        end = min(start + block_size, n_motifs)
+        block = np.asarray(site_counts[:, start:end])
+        for column in block.T:
+            rows = np.flatnonzero(column)
+            digests.append(_digest(rows, column[rows]))
+    return digests
+
+
+class StatisticsCache:
+    """Cache of the per-motif statistics for incremental integration.
+
+    The target/non-target summaries of a motif (see
+    `mamotif.stats.grouped_statistics`) only depend on the M values, the
+    tested subset of regions and the presence column of the motif. Each
+    entry is keyed by the digest of the M values, the subset mask and the
+    `negative` option, and stores the statistics of each motif keyed by the
+    digest of its presence column. The sums of the dose-response regression
+    (see `mamotif.stats.dose_sums`) are cached likewise, keyed by the digest
+    of the site number column of each motif. Only new or changed motifs are
+    computed, the tests and the multiple testing correction are always run
+    over all motifs. Entries share the cache directory (and its size limit)
+    with `RegionCache`.
+
+    Parameters
+    ----------
+    path : str
+        The cache directory.
+    max_size : int, optional
+        Maximal total size of the cache in bytes, least recently used entries
+        are evicted when it is exceeded. Unlimited if not specified.
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def _key(m_values, mask, negative, dose_transform=None):
+        meta = {'version': CACHE_VERSION, 'type': 'statistics',
+                'negative': bool(negative)}
+        if dose_transform is not None:
+            meta.update(type='dose', transform=dose_transform)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps(meta).encode())
+        digest.update(np.ascontiguousarray(m_values, dtype='<f8').tobytes())
+        if mask is not None:
+            digest.update(np.packbits(np.asarray(mask, dtype=bool)).tobytes())
+        return digest.hexdigest()
+
+    def _load(self, key, n_values):
+        """Load the digests and statistics of an entry, None if missing."""
+        entry = os.path.join(self.path, key)
+        if not os.path.isfile(os.path.join(entry, META_FILE)):
+            return None
+        try:
+            with np.load(os.path.join(entry, STATISTICS_FILE)) as data:
+                digests = data['digests']
+                statistics = data['statistics']
+            if statistics.shape != (len(digests), n_values):
+                raise ValueError("corrupted statistics")
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Removing invalid cache entry {entry}: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        os.utime(os.path.join(entry, META_FILE))  # mark as recently used
+        return digests, statistics
+
+    def _store(self, key, digests, statistics):
+        entry = os.path.join(self.path, key)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.path)
+        try:
+            np.savez(os.path.join(tmp_dir, STATISTICS_FILE),
+                     digests=digests, statistics=statistics)
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as fout:
+                json.dump({'version': CACHE_VERSION, 'type': 'statistics',
+                           'motifs': len(digests), 'created': time.time()},
+                          fout)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp_dir, entry)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _cached(self, keys, digests, n_values, compute, name):
+        """Load the per-motif values of each key, compute the missing ones.
+
+        `compute` is called with the indices of the motifs missing from the
+        entry of any key, and returns the ``(n_missing, n_values)`` values of
+        each key.
+        """
+        n_motifs = len(digests)
+        cached = []
+        missing = np.zeros(n_motifs, dtype=bool)
+        for key in keys:
+            values = np.full((n_motifs, n_values), np.nan)
+            found = np.zeros(n_motifs, dtype=bool)
+            entry = self._load(key, n_values)
+            if entry is not None:
+                rows = {digest: idx for idx, digest in enumerate(entry[0])}
+                for idx, digest in enumerate(digests):
+                    row = rows.get(digest)
+                    if row is not None:
+                        values[idx] = entry[1][row]
+                        found[idx] = True
+            cached.append((entry, values, found))
+            missing |= ~found
+        indices = np.flatnonzero(missing)
+        logger.info(f"Loaded the {name} of {n_motifs - len(indices)} of "
+                    f"{n_motifs} motif(s) from cache")
+        computed = compute(indices)
+
+        results = []
+        for key, (entry, values, found), new in zip(keys, cached, computed):
+            values[indices] = new
+            # keep the cached motifs not in the current set
+            if entry is not None:
+                old = ~np.isin(entry[0], digests)
+                all_digests = np.concatenate([digests, entry[0][old]])
+                all_values = np.concatenate([values, entry[1][old]])
+            else:
+                all_digests, all_values = digests, values
+            if entry is None or not found.all():
+                self._store(key, all_digests, all_values)
+            results.append(values)
+        if self.max_size is not None:
+            evict(self.path, self.max_size, keep=keys)
+        return results
+
+    def grouped_statistics(self, presence, m_values, masks, negative=False):
+        """Cached counterpart of `mamotif.stats.grouped_statistics`.
+
+        `m_values` are the tested M values, i.e. already converted to -M if
+        `negative`. The statistics of the motifs missing from the cache
+        entries of any subset are computed at once and stored.
+        """
+        m_values = np.asarray(m_values, dtype=float)
+        digests = np.array(column_digests(presence), dtype='S16')
+        keys = [self._key(m_values, mask, negative) for mask in masks]
+        extras = []
+
+        def compute(indices):
+            if len(indices) == len(digests):
+                subset_presence = presence
+            elif isinstance(presence, (PackedPresence, SparsePresence)):
+                subset_presence = presence.take(indices)
+            else:
+                subset_presence = np.asarray(presence)[:, indices]
+            computed = grouped_statistics(subset_presence, m_values, masks)
+            extras.extend(statistics[N_STATISTICS:] for statistics in computed)
+            return [np.column_stack(statistics[:N_STATISTICS])
+                    for statistics in computed]
+
+        results = self._cached(keys, digests, N_STATISTICS, compute,
+                               'statistics')
+        return [(np.rint(values[:, 0]).astype(int), values[:, 1],
+                 values[:, 2], np.rint(values[:, 3]).astype(int),
+                 values[:, 4], values[:, 5], values[:, 6]) + tuple(extra)
+                for values, extra in zip(results, extras)]
+
+    def dose_sums(self, site_counts, m_values, masks, negative=False,
+                  transform='count'):
+        """Cached counterpart of `mamotif.stats.dose_sums`.
+
+        `m_values` are the tested M values as in `grouped_statistics`. The
+        sums of the motifs missing from the cache entries of any subset are
+        computed at once and stored.
+        """
+        m_values = np.asarray(m_values, dtype=float)
+        digests = np.array(count_digests(site_counts), dtype='S16')
+        keys = [self._key(m_values, mask, negative, dose_transform=transform)
+                for mask in masks]
+
+        def compute(indices):
+            if len(indices) == len(digests):
+                subset_counts = site_counts
+            elif sparse.issparse(site_counts):
+                subset_counts = sparse.csc_matrix(site_counts)[:, indices]
+            else:
+                subset_counts = np.asarray(site_counts)[:, indices]
+            return dose_sums(subset_counts, m_values, masks,
+                             transform=transform)
+
+        return self._cached(keys, digests, N_DOSE_SUMS, compute,
+                            'dose-response sums')
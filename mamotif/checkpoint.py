@@ -0,0 +1,147 @@
+"""
+mamotif.checkpoint
+------------------
+
+Stage manifest to resume the MAmotif workflow after a failure.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from mamotif.cache import file_digest, file_signature
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+MANIFEST_FILE = 'mamotif_run_manifest.json'
+
+
+def _file_unchanged(signature):
+    """Check whether a file still matches its recorded signature.
+
+    Files with the same size and mtime are assumed unchanged, the content is
+    only hashed if the mtime differs (e.g. a file rewritten with the same
+    content).
+    """
+    try:
+        stat = os.stat(signature['path'])
+    except OSError:
+        return False
+    if stat.st_size != signature['size']:
+        return False
+    if stat.st_mtime_ns == signature['mtime_ns']:
+        return True
+    return file_digest(signature['path']) == signature['digest']
+
+
+class RunManifest:
+    """Record the inputs, options and outputs of workflow stages.
+
+    A stage is up to date if its input files, options and output files are
+    unchanged since it last finished, so it can be skipped on a rerun. The
+    manifest is rewritten atomically after each finished stage.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON manifest.
+    force : bool, optional
+        If True, all stages are considered outdated and run again.
+    """
+
+    def __init__(self, path, force=False):
+        self.path = path
+        self.force = force
+        self.stages = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            try:
+                with open(path) as fin:
+                    manifest = json.load(fin)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    self.stages = manifest['stages']
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring the invalid stage manifest "
+                               f"{path}: {e}")
+
+    def lookup(self, name, inputs, options):
+        """Check whether a stage is up to date.
+
+        Parameters
+        ----------
+        name : str
+            The stage name.
+        inputs : list of str
+            Paths of the input files of the stage.
+        options : dict
+            The JSON-serializable options of the stage.
+
+        Returns
+        -------
+        up_to_date : bool
+            Whether the stage is up to date.
+        result
+            The recorded result of the stage if it is up to date.
+        """
+        if self.force:
+            return False, None
+        with self._lock:
+            record = self.stages.get(name)
+        if record is None:
+            return False, None
+        if record['options'] != json.loads(json.dumps(options)):
+            return False, None
+        if sorted(signature['path'] for signature in record['inputs']) != \
+                sorted(os.path.abspath(path) for path in inputs):
+            return False, None
+        for signature in record['inputs'] + record['outputs']:
+            if not _file_unchanged(signature):
+                return False, None
+        return True, record['result']
+
+    def record(self, name, inputs, options, outputs, result=None):
+        """Record a finished stage, see `lookup` for the parameters.
+
+        `outputs` are the paths of the output files and `result` is the
+        JSON-serializable result of the stage, returned by `lookup` later.
+        """
+        record = {'inputs': [file_signature(path) for path in inputs],
+                  'options': options,
+                  'outputs': [file_signature(path) for path in outputs],
+                  'result': result}
+        with self._lock:
+            self.stages[name] = record
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as fout:
+                json.dump({'version': MANIFEST_VERSION,
+                           'stages': self.stages}, fout, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def run(self, name, func, inputs, options, outputs):
+        """Run a stage unless it is up to date.
+
+        Parameters
+        ----------
+        func : callable
+            Function to run the stage, called without arguments. Its result
+            should be JSON-serializable.
+        outputs : callable
+            Function to return the paths of the output files from the result
+            of the stage.
+
+        Other parameters are the same as `lookup`.
+
+        Returns
+        -------
+        The result of `func`, or the recorded result if the stage is skipped.
+        """
+        up_to_date, result = self.lookup(name, inputs, options)
+        if up_to_date:
+            logger.info(f"Stage {name!r} is up to date, skipped (use "
+                        f"--force to run it again)")
+            return result
+        result = func()
+        self.record(name, inputs, options, outputs(result), result=result)
+        return result
@@ -0,0 +1,34 @@
+"""
+mamotif.cli.integrate_batch
+---------------------------
+
+Run the MAmotif integration for a batch of comparisons listed in a manifest.
+"""
+
+import sys
+
+from manorm.logging import setup_logger as setup_manorm_logger
+from motifscan.logging import setup_logger as setup_motifscan_logger
+
+from mamotif.integration import run_integration_batch
+from mamotif.io import read_integration_manifest
+
+
+def run(args):
+    setup_manorm_logger(args.verbose)
+    setup_motifscan_logger(args.verbose)
+    comparisons = read_integration_manifest(args.f_manifest)
+    records = run_integration_batch(
+        comparisons, genome=args.genome, split=args.split,
+        upstream=args.upstream, downstream=args.downstream,
+        correction=args.correction, tie_correction=args.tie_correction,
+        output_dir=args.output_dir, cache_dir=args.cache_dir,
+        cache_size=args.cache_size * 1024 * 1024,
+        presence_format=args.presence_format, n_jobs=args.n_jobs,
+        permutations=args.permutations, seed=args.seed, pairs=args.pairs,
+        min_support=args.min_support, incremental=args.incremental,
+        dose=args.dose, dose_transform=args.dose_transform,
+        tss_bins=args.tss_bins, annotations=args.annotations,
+        output_format=args.output_format)
+    if any(record['status'] != 'ok' for record in records):
+        sys.exit(1)
@@ -9,13 +9,27 @@ from manorm.logging import setup_logger as setup_manorm_logger
 from motifscan.logging import setup_logger as setup_motifscan_logger
 
 from mamotif.integration import run_integration
+from mamotif.profile import StageProfiler
 
 
 def run(args):
     setup_manorm_logger(args.verbose)
     setup_motifscan_logger(args.verbose)
+    profiler = StageProfiler(
+        enabled=args.profile or args.cprofile_stage is not None,
+        cprofile_stage=args.cprofile_stage)
     run_integration(
         f_manorm=args.f_manorm, f_motifscan=args.f_motifscan,
         negative=args.negative, genome=args.genome, split=args.split,
         upstream=args.upstream, downstream=args.downstream,
-        correction=args.correction, output_dir=args.output_dir)
+        correction=args.correction, tie_correction=args.tie_correction,
+        output_dir=args.output_dir, cache_dir=args.cache_dir,
+        cache_size=args.cache_size * 1024 * 1024,
+        presence_format=args.presence_format, n_jobs=args.n_jobs,
+        permutations=args.permutations, seed=args.seed, pairs=args.pairs,
+        min_support=args.min_support, incremental=args.incremental,
+        dose=args.dose, dose_transform=args.dose_transform,
+        tss_bins=args.tss_bins, annotations=args.annotations,
+        output_format=args.output_format, profiler=profiler)
+    if profiler.enabled:
+        profiler.write(args.output_dir)
@@ -6,16 +6,29 @@ Main command line interface of MAmotif.
 """
 
 import argparse
+import importlib
 import os
 from textwrap import dedent
 
-from manorm.read import READ_FORMATS
-from manorm.region import REGION_FORMATS
-
 from mamotif import __version__
-from mamotif.cli import intergrate, run
 from mamotif.logging import setup_logger
 
+# the same as `manorm.read.READ_FORMATS` and `manorm.region.REGION_FORMATS`,
+# listed here to not import MAnorm before a subcommand runs
+READ_FORMATS = ['bed', 'bedpe', 'sam', 'bam']
+REGION_FORMATS = ['bed', 'bed3-summit', 'macs', 'macs2', 'narrowpeak',
+                  'broadpeak']
+
+
+def _command(module):
+    """Return a function to run a subcommand, the module of which is only
+    imported when the subcommand runs."""
+
+    def run(args):
+        return importlib.import_module(module).run(args)
+
+    return run
+
 
 def _existed_file(path):
     """Check whether a passed argument is an existed file."""
@@ -36,6 +49,26 @@ def _pos_int(value):
     return value_int
 
 
+def _tss_bins(value):
+    """Check whether a passed argument is valid distance-to-TSS bins."""
+    from mamotif.stratify import parse_tss_bins
+    try:
+        return parse_tss_bins(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _annotation(value):
+    """Check whether a passed argument is a valid `[NAME=]FILE` annotation."""
+    from mamotif.stratify import parse_annotation
+    try:
+        name, path = parse_annotation(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    _existed_file(path)
+    return name, path
+
+
 def _add_verbose_argument(parser):
     parser.add_argument(
         "--verbose", dest="verbose", action="store_true", default=False,
@@ -58,13 +91,130 @@ def add_mamotif_arguments(parser):
         type=_pos_int, default=2000,
         help="TSS downstream distance for promoters. Default: 2000")
     parser_integrate.add_argument(
-        "--correction", dest="correction", choices=["benjamin", "bonferroni"],
+        "--tss-bins", metavar="DISTANCES", dest="tss_bins", type=_tss_bins,
+        default=None,
+        help="Also stratify genomic regions by the distance to the nearest "
+             "TSS and run separately for each bin. The bins are given by "
+             "comma-separated upper edges, e.g. `1000,5000,50000` for "
+             "0-1kb, 1-5kb, 5-50kb and >50kb. Requires the genome name.")
+    parser_integrate.add_argument(
+        "--annotation", metavar="[NAME=]FILE", dest="annotations",
+        type=_annotation, action="append", default=None,
+        help="Also run separately for the genomic regions overlapping with "
+             "the intervals of a BED annotation (e.g. enhancers or CpG "
+             "islands). NAME is used in the output file names and defaults "
+             "to the file name. Can be specified multiple times.")
+    parser_integrate.add_argument(
+        "--correction", dest="correction",
+        choices=["benjamin", "bonferroni", "yekutieli", "storey"],
         default="benjamin",
-        help="Method for multiple testing correction. Default: benjamin")
+        help="Method for multiple testing correction: Benjamini-Hochberg, "
+             "Bonferroni, Benjamini-Yekutieli or Storey q-values. "
+             "Default: benjamin")
+    parser_integrate.add_argument(
+        "--tie-correction", dest="tie_correction", action="store_true",
+        default=False,
+        help="Correct the variance of the rank-sum statistic for tied M "
+             "values.")
+    parser_integrate.add_argument(
+        "--presence-format", dest="presence_format",
+        choices=["dense", "packed", "sparse"], default="dense",
+        help="In-memory format of the motif presence matrix. `packed` stores "
+             "8 motifs per byte and unpacks column blocks on the fly, which "
+             "bounds the memory usage for very large inputs. If `--cache-dir` "
+             "is specified, the packed matrix is memory-mapped from the "
+             "cache. `sparse` only stores the motif hits, the memory and "
+             "time scale with the number of hits, which is much faster for "
+             "low-density motif sets (e.g. stringent scans). Default: dense")
+    parser_integrate.add_argument(
+        "--permutations", metavar="N", dest="permutations", type=_pos_int,
+        default=0,
+        help="Also report empirical P values of the T-test and RankSum-test "
+             "from N permutations of the M values. Disabled by default.")
+    parser_integrate.add_argument(
+        "--seed", metavar="SEED", dest="seed", type=int, default=None,
+        help="Random seed of the permutations, used to reproduce the "
+             "empirical P values. Random by default.")
+    parser_dose = parser_integrate.add_mutually_exclusive_group()
+    parser_dose.add_argument(
+        "--dose-response", dest="dose", action="store_const", const=True,
+        default=None,
+        help="Regress the M values on the motif site numbers, the slope of "
+             "the site numbers (given the motif presence), its standard "
+             "error and right-tailed P value are reported for each motif. "
+             "Enabled by default unless `--presence-format packed`, whose "
+             "memory bound does not hold with the site numbers.")
+    parser_dose.add_argument(
+        "--no-dose-response", dest="dose", action="store_const", const=False,
+        help="Do not regress the M values on the motif site numbers.")
+    parser_integrate.add_argument(
+        "--dose-transform", dest="dose_transform",
+        choices=["count", "log1p"], default="count",
+        help="Regress the M values on the motif site numbers (count) or on "
+             "log(1 + site numbers) (log1p). Default: count")
+    parser_integrate.add_argument(
+        "--pairs", dest="pairs", action="store_true", default=False,
+        help="Also test the co-occurrence of all motif pairs: the target "
+             "regions of a pair have both motifs present. The results are "
+             "written to `*_MAmotif_pairs_output.xls`.")
+    parser_integrate.add_argument(
+        "--min-support", metavar="N", dest="min_support", type=_pos_int,
+        default=10,
+        help="Only report the motif pairs with at least N target regions, "
+             "the multiple testing correction is over the reported pairs. "
+             "Default: 10")
+    parser_integrate.add_argument(
+        "-j", "--jobs", metavar="N", dest="n_jobs", type=_pos_int, default=1,
+        help="Number of processes used to run the integrations of samples "
+             "and promoter/distal subsets in parallel. Default: 1")
+    parser_cache = parser.add_argument_group("Cache Options")
+    parser_cache.add_argument(
+        "--cache-dir", metavar="DIR", dest="cache_dir", default=None,
+        help="Directory to cache the parsed and matched MAnorm/MotifScan "
+             "results. Later runs with unchanged inputs load them from the "
+             "cache. Disabled by default.")
+    parser_cache.add_argument(
+        "--cache-size", metavar="MB", dest="cache_size", type=_pos_int,
+        default=4096,
+        help="Maximal total size of the cache directory in megabytes, least "
+             "recently used entries are evicted. Default: 4096")
+    parser_cache.add_argument(
+        "--incremental", dest="incremental", action="store_true",
+        default=False,
+        help="Also cache the statistics of each motif, keyed by the M values "
+             "and the motif presence. Later runs only compute the statistics "
+             "of new or changed motifs (e.g. after adding motifs to the "
+             "motif set) and redo the multiple testing correction over all "
+             "motifs. Requires `--cache-dir`.")
     parser_output = parser.add_argument_group("Output Options")
     parser_output.add_argument(
         "-o", "--output-dir", metavar="DIR", dest="output_dir", required=True,
         help="Directory to write output files.")
+    parser_output.add_argument(
+        "--output-format", dest="output_format",
+        choices=["xls", "xls.gz", "parquet"], default="xls",
+        help="Format of the MAmotif output tables: tab-separated (xls), "
+             "gzip-compressed tab-separated (xls.gz) or Parquet (parquet, "
+             "requires pyarrow). Default: xls")
+    return parser
+
+
+def _add_profile_arguments(parser):
+    parser_profile = parser.add_argument_group("Profiling Options")
+    parser_profile.add_argument(
+        "--profile", dest="profile", action="store_true", default=False,
+        help="Record the wall time, CPU time and peak memory of each stage "
+             "and write them to `mamotif_profile.json` in the output "
+             "directory.")
+    parser_profile.add_argument(
+        "--cprofile", metavar="STAGE", dest="cprofile_stage",
+        choices=["manorm", "motifscan", "strata", "cache", "parse", "match",
+                 "classify", "test", "permutations", "pairs", "write"],
+        default=None,
+        help="Also run a stage under cProfile and dump the stats to "
+             "`mamotif_profile_STAGE.prof` in the output directory. Only the "
+             "main process is profiled, use `-j 1` to profile the work of "
+             "the process pool. Implies `--profile`.")
     return parser
 
 
@@ -157,9 +307,17 @@ def configure_parser_run(subparsers):
     parser_mamotif.add_argument(
         "--mode", dest="mode", choices=['both', 'A', 'B'], default='both',
         help="Which sample to perform MAmotif on. Default: both")
+    parser_mamotif.add_argument(
+        "--force", dest="force", action="store_true", default=False,
+        help="Run all stages again. By default, the stages (MAnorm, "
+             "MotifScan and the integration of each sample) finished by a "
+             "previous run in the same output directory are skipped if "
+             "their input files, options and output files are unchanged, as "
+             "recorded in `mamotif_run_manifest.json`.")
     parser = add_mamotif_arguments(parser)
+    parser = _add_profile_arguments(parser)
     parser = _add_verbose_argument(parser)
-    parser.set_defaults(func=run.run)
+    parser.set_defaults(func=_command('mamotif.cli.run'))
 
 
 def configure_parser_integrate(subparsers):
@@ -191,10 +349,12 @@ def configure_parser_integrate(subparsers):
     parser_input = parser.add_argument_group("Input Options")
     parser_input.add_argument(
         "-i", metavar="FILE", dest="f_manorm", required=True,
-        help="MAnorm result for sample A or B (A/B_MAvalues.xls).")
+        help="MAnorm result for sample A or B (A/B_MAvalues.xls). "
+             "Gzip-compressed files are supported.")
     parser_input.add_argument(
         "-m", metavar="FILE", dest="f_motifscan", required=True,
-        help="MotifScan result for sample A or B (motif_sites_number.xls).")
+        help="MotifScan result for sample A or B (motif_sites_number.xls). "
+             "Gzip-compressed files are supported.")
     parser_input.add_argument(
         "-n", "--negative", dest="negative", action="store_true",
         default=False,
@@ -202,10 +362,56 @@ def configure_parser_integrate(subparsers):
              "co-factors for sample B.")
     parser_input.add_argument(
         "-g", dest="genome", default=None,
-        help="Genome name. Required if `--split` is enabled.")
+        help="Genome name. Required if `--split` or `--tss-bins` is "
+             "enabled.")
+    parser = add_mamotif_arguments(parser)
+    parser = _add_profile_arguments(parser)
+    parser = _add_verbose_argument(parser)
+    parser.set_defaults(func=_command('mamotif.cli.intergrate'))
+
+
+def configure_parser_integrate_batch(subparsers):
+    help_msg = "Run the integration module for a batch of comparisons."
+    desc_msg = help_msg + dedent("""
+
+    This command runs the integration procedure for many MAnorm/MotifScan
+    results listed in a manifest. Shared resources (e.g. the genome
+    annotations) are loaded only once and the comparisons run in a pool of
+    processes. A summary index of the output files and failed comparisons is
+    written to `integrate_batch_summary.xls` in the output directory.
+    """)
+    epilog_msg = dedent("""
+    Manifest:
+    ---------
+    A tab-separated file, one comparison per line with the columns:
+    
+        MAvalues file, motif_sites_number file, negative, output prefix
+    
+    The negative column (true/false, yes/no or 1/0) and the output prefix are 
+    optional, the prefix defaults to the MAnorm sample name. Lines starting 
+    with `#` are ignored. Relative paths are relative to the manifest.
+    
+    Examples:
+    ---------
+        mamotif integrate-batch --manifest comparisons.tsv -j 8 -o <path>
+    """)
+    parser = subparsers.add_parser(
+        "integrate-batch", description=desc_msg, help=help_msg,
+        epilog=epilog_msg,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser_input = parser.add_argument_group("Input Options")
+    parser_input.add_argument(
+        "--manifest", metavar="FILE", dest="f_manifest", required=True,
+        type=_existed_file,
+        help="Manifest of the comparisons to run.")
+    parser_input.add_argument(
+        "-g", dest="genome", default=None,
+        help="Genome name. Required if `--split` or `--tss-bins` is "
+             "enabled.")
     parser = add_mamotif_arguments(parser)
     parser = _add_verbose_argument(parser)
-    parser.set_defaults(func=intergrate.run)
+    parser.set_defaults(func=_command('mamotif.cli.integrate_batch'))
 
 
 def configure_parser_main():
@@ -245,6 +451,7 @@ def configure_parser_main():
                                        metavar="command", dest="cmd")
     configure_parser_run(subparsers)
     configure_parser_integrate(subparsers)
+    configure_parser_integrate_batch(subparsers)
     return parser
 
 
@@ -7,11 +7,20 @@ Run complete MAmotif workflow (MAnorm + MotifScan + Integration).
 
 import logging
 import os
+from functools import partial
 
+import manorm
 import manorm.cli as cli_manorm
+import motifscan
 import motifscan.cli.main as cli_motifscan
 
-from mamotif.integration import run_integration
+from mamotif import __version__
+from mamotif.checkpoint import MANIFEST_FILE, RunManifest
+from mamotif.integration import (_dose_enabled, load_stratifier,
+                                 run_integration)
+from mamotif.io import split_table_rows, write_union_regions
+from mamotif.profile import StageProfiler
+from mamotif.scheduler import StageScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -41,13 +50,16 @@ def run_manorm_from_mamotif(args):
     return manorm_dir
 
 
-def run_motifscan_from_mamotif(args, f_manorm):
-    sample_name = os.path.basename(f_manorm).replace('_MAvalues.xls', '')
-    motifscan_dir = os.path.abspath(
-        os.path.join(args.output_dir, f'{sample_name}_motifscan_output'))
+def run_motifscan_from_mamotif(args, f_manorm, motifscan_dir=None,
+                               n_threads=None):
+    if motifscan_dir is None:
+        sample_name = os.path.basename(f_manorm).replace('_MAvalues.xls', '')
+        motifscan_dir = os.path.abspath(
+            os.path.join(args.output_dir, f'{sample_name}_motifscan_output'))
     args_motifscan = [
         "scan", "-i", f_manorm, "-f", "manorm", "--motif", args.motif,
-        "--genome", args.genome, "-p", args.p_value, "-t", args.n_threads,
+        "--genome", args.genome, "-p", args.p_value,
+        "-t", n_threads or args.n_threads,
         "--no-enrich", "-o", motifscan_dir]
 
     parser_motifscan = cli_motifscan.configure_parser_main()
@@ -56,25 +68,163 @@ def run_motifscan_from_mamotif(args, f_manorm):
     return os.path.join(motifscan_dir, "motif_sites_number.xls")
 
 
+def run_union_motifscan_from_mamotif(args, f_manorms):
+    """Scan the union of regions of samples once and split the results.
+
+    Regions shared by the samples (e.g. merged common peaks) are scanned
+    only once, the per-region results are then split back into the
+    MotifScan output directory of each sample.
+
+    Returns
+    -------
+    list of str
+        Paths of the `motif_sites_number.xls` of each sample.
+    """
+    union_dir = os.path.abspath(os.path.join(
+        args.output_dir, f'{args.name1}_vs_{args.name2}_motifscan_output'))
+    os.makedirs(union_dir, exist_ok=True)
+    f_union = os.path.join(union_dir, 'union_MAvalues.xls')
+    logger.info("Merging the regions of samples to scan once")
+    rows = write_union_regions(f_union, f_manorms)
+    run_motifscan_from_mamotif(args, f_union, motifscan_dir=union_dir)
+
+    logger.info("Splitting the MotifScan results into samples")
+    sample_dirs = []
+    for f_manorm in f_manorms:
+        sample_name = os.path.basename(f_manorm).replace('_MAvalues.xls', '')
+        sample_dir = os.path.join(args.output_dir,
+                                  f'{sample_name}_motifscan_output')
+        os.makedirs(sample_dir, exist_ok=True)
+        sample_dirs.append(os.path.abspath(sample_dir))
+    for table in ('motif_sites_number.xls', 'motif_sites_score.xls'):
+        split_table_rows(
+            os.path.join(union_dir, table),
+            [(os.path.join(sample_dir, table), sample_rows)
+             for sample_dir, sample_rows in zip(sample_dirs, rows)])
+    return [os.path.join(sample_dir, 'motif_sites_number.xls')
+            for sample_dir in sample_dirs]
+
+
+def _dir_files(path):
+    """Return the paths of all files under a directory."""
+    return sorted(os.path.join(root, name)
+                  for root, _, files in os.walk(path) for name in files)
+
+
 def run(args):
     cli_manorm.setup_logger(args.verbose)
     cli_motifscan.setup_logger(args.verbose)
-    manorm_dir = run_manorm_from_mamotif(args)
+    samples = []
     if args.mode in ['both', 'A']:
-        logger.info("\nScanning motifs for sample A")
-        f_manorm = os.path.join(manorm_dir, f"{args.name1}_MAvalues.xls")
-        f_motifscan = run_motifscan_from_mamotif(args, f_manorm)
-        logger.info("Running MAmotif for sample A")
-        run_integration(f_manorm=f_manorm, f_motifscan=f_motifscan,
-                        negative=False, genome=args.genome, split=args.split,
-                        upstream=args.upstream, downstream=args.downstream,
-                        correction=args.correction, output_dir=args.output_dir)
+        samples.append(('A', False))
     if args.mode in ['both', 'B']:
-        logger.info("\nScanning motifs for sample B")
-        f_manorm = os.path.join(manorm_dir, f"{args.name2}_MAvalues.xls")
-        f_motifscan = run_motifscan_from_mamotif(args, f_manorm)
-        logger.info("Running MAmotif for sample B")
-        run_integration(f_manorm=f_manorm, f_motifscan=f_motifscan,
-                        negative=True, genome=args.genome, split=args.split,
-                        upstream=args.upstream, downstream=args.downstream,
-                        correction=args.correction, output_dir=args.output_dir)
+        samples.append(('B', True))
+    # split the process budget among the concurrent sample integrations
+    n_jobs = max(1, args.n_jobs // len(samples))
+    args.name1 = args.name1 or os.path.splitext(
+        os.path.basename(args.peak_file1))[0]
+    args.name2 = args.name2 or os.path.splitext(
+        os.path.basename(args.peak_file2))[0]
+    os.makedirs(args.output_dir, exist_ok=True)
+    # finished stages with unchanged inputs and outputs are skipped
+    manifest = RunManifest(os.path.join(args.output_dir, MANIFEST_FILE),
+                           force=args.force)
+
+    profiler = StageProfiler(
+        enabled=args.profile or args.cprofile_stage is not None,
+        cprofile_stage=args.cprofile_stage)
+    scheduler = StageScheduler(profiler=profiler)
+
+    def _f_manorm(results, sample):
+        name = args.name1 if sample == 'A' else args.name2
+        return os.path.join(results['manorm'], f"{name}_MAvalues.xls")
+
+    def _manorm(results):
+        return manifest.run(
+            'manorm', lambda: run_manorm_from_mamotif(args),
+            inputs=[args.peak_file1, args.peak_file2, args.read_file1,
+                    args.read_file2],
+            options={'manorm': manorm.__version__,
+                     'peak_format': args.peak_format,
+                     'read_format': args.read_format, 'name1': args.name1,
+                     'name2': args.name2, 'shift_size1': args.shift_size1,
+                     'shift_size2': args.shift_size2,
+                     'paired': args.paired},
+            outputs=_dir_files)
+
+    def _scan(results):
+        logger.info("\nScanning motifs for sample " +
+                    " and ".join(sample for sample, _ in samples))
+        f_manorms = [_f_manorm(results, sample) for sample, _ in samples]
+        return dict(zip([sample for sample, _ in samples],
+                        run_union_motifscan_from_mamotif(args, f_manorms)))
+
+    def _motifscan(results):
+        return manifest.run(
+            'motifscan', lambda: _scan(results),
+            inputs=[_f_manorm(results, sample) for sample, _ in samples],
+            options={'motifscan': motifscan.__version__,
+                     'motif': args.motif, 'genome': args.genome,
+                     'p_value': args.p_value},
+            outputs=lambda result: [
+                path for f_motifscan in result.values()
+                for path in _dir_files(os.path.dirname(f_motifscan))])
+
+    def _integrate(results, sample, negative):
+        logger.info(f"\nRunning MAmotif for sample {sample}")
+        return run_integration(
+            f_manorm=_f_manorm(results, sample),
+            f_motifscan=results['motifscan'][sample], negative=negative,
+            genome=args.genome, split=args.split, upstream=args.upstream,
+            downstream=args.downstream, correction=args.correction,
+            tie_correction=args.tie_correction, output_dir=args.output_dir,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024 * 1024,
+            presence_format=args.presence_format, n_jobs=n_jobs,
+            stratifier=results.get('strata'),
+            permutations=args.permutations, seed=args.seed,
+            output_format=args.output_format, profiler=profiler,
+            pairs=args.pairs, min_support=args.min_support,
+            incremental=args.incremental, dose=args.dose,
+            dose_transform=args.dose_transform)
+
+    def _integration(results, sample, negative):
+        return manifest.run(
+            f'integration_{sample}',
+            lambda: _integrate(results, sample, negative),
+            inputs=[_f_manorm(results, sample),
+                    results['motifscan'][sample]] +
+            [path for _, path in args.annotations or []],
+            options={'mamotif': __version__, 'negative': negative,
+                     'genome': args.genome, 'split': args.split,
+                     'upstream': args.upstream,
+                     'downstream': args.downstream,
+                     'tss_bins': args.tss_bins,
+                     'annotations': args.annotations,
+                     'correction': args.correction,
+                     'tie_correction': args.tie_correction,
+                     'permutations': args.permutations, 'seed': args.seed,
+                     'pairs': args.pairs, 'min_support': args.min_support,
+                     # resolved, the default depends on the presence format
+                     'dose': _dose_enabled(args.dose, args.presence_format),
+                     'dose_transform': args.dose_transform,
+                     'output_format': args.output_format},
+            outputs=lambda paths: paths)
+
+    scheduler.add('manorm', _manorm)
+    integration_deps = ['motifscan']
+    if args.split or args.tss_bins or args.annotations:
+        scheduler.add('strata', lambda results: load_stratifier(
+            genome=args.genome, split=args.split, upstream=args.upstream,
+            downstream=args.downstream, tss_bins=args.tss_bins,
+            annotations=args.annotations, cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024 * 1024))
+        integration_deps.append('strata')
+    scheduler.add('motifscan', _motifscan, deps=['manorm'])
+    for sample, negative in samples:
+        scheduler.add(f'integration_{sample}',
+                      partial(_integration, sample=sample, negative=negative),
+                      deps=integration_deps)
+    scheduler.run()
+    if profiler.enabled:
+        profiler.write(args.output_dir)
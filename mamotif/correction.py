@@ -0,0 +1,96 @@
+"""
+mamotif.correction
+------------------
+
+Vectorized multiple testing correction of p-values.
+"""
+
+import numpy as np
+
+CORRECTION_METHODS = ['benjamin', 'bonferroni', 'yekutieli', 'storey']
+
+
+def _step_up(p_sorted, factors):
+    """Step-up adjustment of ascending sorted p-values.
+
+    The adjusted p-value of rank `i` is the minimum of ``p * factor`` over all
+    ranks ``>= i``, which keeps the adjusted p-values monotonic.
+    """
+    adjusted = p_sorted * factors
+    adjusted = np.minimum.accumulate(adjusted[::-1])[::-1]
+    return np.minimum(adjusted, 1)
+
+
+def storey_pi0(p_values, lambda_=0.5):
+    """Estimate the proportion of true null hypotheses (Storey, 2002).
+
+    Parameters
+    ----------
+    p_values : array_like
+        The p-values, NaNs are ignored.
+    lambda_ : float, optional
+        The tuning parameter in [0, 1), p-values above it are considered to
+        come from the null hypotheses.
+
+    Returns
+    -------
+    pi0 : float
+        The estimated proportion, capped to 1. One pseudo-count is added to
+        the p-values above `lambda_` (Storey et al., 2004), so the estimate
+        stays positive even if no p-value is above it.
+    """
+    if not 0 <= lambda_ < 1:
+        raise ValueError(f"lambda should be in [0, 1): {lambda_}")
+    p_values = np.asarray(p_values, dtype=float)
+    p_values = p_values[~np.isnan(p_values)]
+    if p_values.size == 0:
+        return 1.0
+    n_null = np.count_nonzero(p_values > lambda_)
+    return min(1.0, (n_null + 1) / (p_values.size * (1 - lambda_)))
+
+
+def adjust_p_values(p_values, correction='benjamin', lambda_=0.5):
+    """Adjust p-values for multiple testing.
+
+    Parameters
+    ----------
+    p_values : array_like
+        The p-values, NaNs are kept as NaNs and not counted as tests.
+    correction : {'benjamin', 'bonferroni', 'yekutieli', 'storey'}, optional
+        The correction method:
+
+        * benjamin: Benjamini-Hochberg step-up FDR procedure
+        * bonferroni: Bonferroni family-wise error rate correction
+        * yekutieli: Benjamini-Yekutieli FDR under arbitrary dependence
+        * storey: Storey q-values, BH scaled by the estimated null proportion
+    lambda_ : float, optional
+        The tuning parameter of `storey_pi0` for the 'storey' method.
+
+    Returns
+    -------
+    adjusted : `numpy.ndarray`
+        The adjusted p-values, with the same shape as `p_values`.
+    """
+    if correction not in CORRECTION_METHODS:
+        raise ValueError(f"invalid correction type: {correction}")
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = ~np.isnan(p_values)
+    p_valid = p_values[valid]
+    n = p_valid.size
+    if n == 0:
+        return adjusted
+    if correction == 'bonferroni':
+        adjusted[valid] = np.minimum(p_valid * n, 1)
+        return adjusted
+
+    order = np.argsort(p_valid)
+    factors = n / np.arange(1, n + 1, dtype=float)
+    if correction == 'yekutieli':
+        factors *= np.sum(1 / np.arange(1, n + 1, dtype=float))
+    elif correction == 'storey':
+        factors *= storey_pi0(p_valid, lambda_=lambda_)
+    adjusted_valid = np.empty(n)
+    adjusted_valid[order] = _step_up(p_valid[order], factors)
+    adjusted[valid] = adjusted_valid
+    return adjusted
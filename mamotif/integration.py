@@ -6,23 +6,45 @@ The final integration module of MAmotif.
 """
 
 import logging
+import multiprocessing as mp
 import os
+import threading
+import time
 
 import numpy as np
-from motifscan.genome import Genome
-from motifscan.region.utils import subset_by_location
+from scipy import sparse
 
-from mamotif.io import write_mamotif_results
-from mamotif.region import load_mamotif_regions
-from mamotif.stats import mamotif_t_test, mamotif_ranksum_test, adjust_p_values
+from mamotif.cache import PromoterCache, RegionCache, StatisticsCache
+from mamotif.correction import adjust_p_values
+from mamotif.io import (PAIR_COLUMNS, RESULT_COLUMNS, write_batch_summary,
+                        write_mamotif_pair_results, write_mamotif_results)
+from mamotif.profile import StageProfiler
+from mamotif.promoter import PromoterIndex, TssIndex, gene_annotation_path
+from mamotif.region import (PackedPresence, RegionTable, SparsePresence,
+                            load_mamotif_regions)
+from mamotif.stratify import Stratifier, load_annotations
+from mamotif.stats import (dose_fit, dose_sums, grouped_statistics,
+                           pair_block_size, pair_statistics,
+                           permutation_counts, ranksum_test, welch_t_test)
 
 logger = logging.getLogger(__name__)
 
+PRESENCE_FORMATS = ['dense', 'packed', 'sparse']
+# number of region subsets (strata) tested by one grouped product
+SUBSET_BLOCK = 4
+# file extensions of the output formats
+OUTPUT_FORMATS = {'xls': '.xls', 'xls.gz': '.xls.gz', 'parquet': '.parquet'}
+# number of permutations per task of the process pool
+PERMUTATION_BATCH = 1000
+# default minimal number of target regions of the reported motif pairs
+MIN_SUPPORT = 10
+
 
 class MAmotifResult:
     def __init__(self, motif, n_pos, mean_pos, std_pos, n_neg, mean_neg,
                  std_neg, t_stat, t_pval, t_padj, r_stat, r_pval, r_padj,
-                 padj):
+                 padj, dose_slope=None, dose_stderr=None, dose_pval=None,
+                 t_perm_pval=None, r_perm_pval=None):
         self.motif = motif
         self.n_pos = n_pos
         self.mean_pos = mean_pos
@@ -37,87 +59,975 @@ class MAmotifResult:
         self.r_pval = r_pval
         self.r_padj = r_padj
         self.padj = padj
+        self.dose_slope = dose_slope
+        self.dose_stderr = dose_stderr
+        self.dose_pval = dose_pval
+        self.t_perm_pval = t_perm_pval
+        self.r_perm_pval = r_perm_pval
+
+
+class MAmotifResults:
+    """Columnar MAmotif results of all motifs.
+
+    Each field of `MAmotifResult` is kept as an array over motifs, which is
+    written in bulk by `mamotif.io.write_mamotif_results`. Iterating or
+    indexing yields `MAmotifResult` objects.
+
+    Parameters
+    ----------
+    motifs : list of str
+        Motif names.
+    **columns
+        Arrays of the other `MAmotifResult` fields, the dose-response and
+        permutation columns are optional.
+
+    Attributes
+    ----------
+    pairs : `MAmotifPairResults` or None
+        The results of the motif pairs, only if the pairs are tested.
+    """
+
+    FIELDS = ('n_pos', 'mean_pos', 'std_pos', 'n_neg', 'mean_neg', 'std_neg',
+              't_stat', 't_pval', 't_padj', 'r_stat', 'r_pval', 'r_padj',
+              'padj', 'dose_slope', 'dose_stderr', 'dose_pval', 't_perm_pval',
+              'r_perm_pval')
+
+    def __init__(self, motifs, **columns):
+        self.motifs = list(motifs)
+        for field in self.FIELDS:
+            setattr(self, field, columns.get(field))
+        self.pairs = None
+
+    def __len__(self):
+        return len(self.motifs)
+
+    def __getitem__(self, idx):
+        kwargs = {field: getattr(self, field)[idx] for field in self.FIELDS
+                  if getattr(self, field) is not None}
+        return MAmotifResult(motif=self.motifs[idx], **kwargs)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def to_frame(self):
+        """Return the results as a `pandas.DataFrame`, one row per motif.
+
+        The columns are named as in the Parquet outputs (see
+        `mamotif.io.RESULT_COLUMNS`), the dose-response and permutation
+        columns are only included if available.
+        """
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("pandas is required to return DataFrames, "
+                              "please install it with `pip install pandas`") \
+                from None
+        columns = {'motif': self.motifs}
+        for attr, name, _ in RESULT_COLUMNS[1:]:
+            values = getattr(self, attr)
+            if values is not None:
+                columns[name] = np.asarray(values)
+        return pd.DataFrame(columns)
+
+
+class MAmotifPairResults:
+    """Columnar MAmotif results of motif pairs.
+
+    The target regions of a pair have both motifs present. The fields are
+    the same as `MAmotifResults`, without the dose-response and permutation
+    columns.
+
+    Parameters
+    ----------
+    motif_a, motif_b : array_like of str
+        Names of the two motifs of each pair.
+    **columns
+        Arrays of the other fields.
+    """
+
+    FIELDS = MAmotifResults.FIELDS[:13]
+
+    def __init__(self, motif_a, motif_b, **columns):
+        self.motif_a = np.asarray(motif_a, dtype=object)
+        self.motif_b = np.asarray(motif_b, dtype=object)
+        for field in self.FIELDS:
+            setattr(self, field, columns.get(field))
+
+    def __len__(self):
+        return len(self.motif_a)
+
+    def to_frame(self):
+        """Return the results as a `pandas.DataFrame`, one row per pair.
+
+        The columns are named as in the Parquet outputs (see
+        `mamotif.io.PAIR_COLUMNS`).
+        """
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("pandas is required to return DataFrames, "
+                              "please install it with `pip install pandas`") \
+                from None
+        return pd.DataFrame({name: np.asarray(getattr(self, attr))
+                             for attr, name, _ in PAIR_COLUMNS})
+
+
+def _test_columns(statistics, correction='benjamin', tie_correction=False):
+    """Run the tests from the statistics of a region subset.
+
+    Returns the result columns of `MAmotifResults` as a dict.
+    """
+    (n_pos, mean_pos, var_pos, n_neg, mean_neg, var_neg, rank_sum_pos,
+     n_total, tie_sum) = statistics
+    t_stats, t_pvals = welch_t_test(n_pos, mean_pos, var_pos, n_neg,
+                                    mean_neg, var_neg)
+    std_pos = np.sqrt(var_pos)
+    std_neg = np.sqrt(var_neg)
+    # M values are ranked once, target rank sums of all motifs in one product
+    r_stats, r_pvals = ranksum_test(
+        n_pos, rank_sum_pos, n_total,
+        tie_sum=tie_sum if tie_correction else None)
+
+    # multiple testing correction, the overall p-value is the larger one
+    t_padj = adjust_p_values(t_pvals, correction=correction)
+    r_padj = adjust_p_values(r_pvals, correction=correction)
+    padj = np.fmax(t_padj, r_padj)
+
+    return dict(n_pos=n_pos, mean_pos=mean_pos, std_pos=std_pos, n_neg=n_neg,
+                mean_neg=mean_neg, std_neg=std_neg, t_stat=t_stats,
+                t_pval=t_pvals, t_padj=t_padj, r_stat=r_stats, r_pval=r_pvals,
+                r_padj=r_padj, padj=padj)
+
 
+def _test_results(motifs, statistics, correction='benjamin',
+                  tie_correction=False):
+    """Run the tests of all motifs from the statistics of a region subset."""
+    return MAmotifResults(motifs, **_test_columns(
+        statistics, correction=correction, tie_correction=tie_correction))
 
-def mamotif_test(motifs, regions, negative=False, correction='benjamin'):
+
+def mamotif_test_grouped(motifs, regions, masks, negative=False,
+                         correction='benjamin', tie_correction=False,
+                         stat_cache=None, dose=True, dose_transform='count'):
+    """Run MAmotif on several subsets (strata) of the regions at once.
+
+    The subsets are selected by weighting the regions, the presence matrix is
+    not copied and the statistics of each block of `SUBSET_BLOCK` subsets
+    come from one product, see `mamotif.stats.grouped_statistics`.
+
+    Parameters
+    ----------
+    masks : list of array_like of bool or None
+        Boolean masks of the regions of each subset, None for all regions.
+    stat_cache : `mamotif.cache.StatisticsCache`, optional
+        If specified, the per-motif statistics (and dose-response sums) are
+        loaded from and stored to the cache, only new or changed motifs are
+        computed.
+    dose : bool, optional
+        Whether to run the dose-response regression of the M values on the
+        motif site numbers (see `mamotif.stats.dose_response`), only if the
+        regions have the site numbers.
+    dose_transform : {'count', 'log1p'}, optional
+        Regress on the site numbers or on ``log1p`` of them.
+
+    Other parameters are the same as `mamotif_test`.
+
+    Returns
+    -------
+    list of `MAmotifResults`
+        The results of each subset.
+    """
+    if not isinstance(regions, RegionTable):
+        regions = RegionTable.from_regions(motifs, regions)
+    m_values = regions.m_values
+    if negative:  # convert M to -M for sample B, log2(A/B)-> log2(B/A)
+        m_values = -m_values
     results = []
-    for idx, motif in enumerate(motifs):
-        m_values_pos = []
-        m_values_neg = []
-        for region in regions:
-            if region.has_motif[idx]:
-                m_values_pos.append(region.m_value)
+    # fixed blocks of subsets per product, so that the sums of a subset do
+    # not depend on how the subsets are grouped into tasks
+    for start in range(0, len(masks), SUBSET_BLOCK):
+        block_masks = masks[start:start + SUBSET_BLOCK]
+        if stat_cache is None:
+            subset_statistics = grouped_statistics(regions.presence,
+                                                   m_values, block_masks)
+        else:
+            subset_statistics = stat_cache.grouped_statistics(
+                regions.presence, m_values, block_masks, negative=negative)
+        block_results = [_test_results(motifs, statistics,
+                                       correction=correction,
+                                       tie_correction=tie_correction)
+                         for statistics in subset_statistics]
+        if dose and regions.site_counts is not None:
+            if stat_cache is None:
+                sums = dose_sums(regions.site_counts, m_values, block_masks,
+                                 transform=dose_transform)
             else:
-                m_values_neg.append(region.m_value)
-        m_values_pos = np.asarray(m_values_pos)
-        m_values_neg = np.asarray(m_values_neg)
-        if negative:  # convert M to -M for sample B, log2(A/B)-> log2(B/A)
-            m_values_pos = -m_values_pos
-            m_values_neg = -m_values_neg
-        t_test = mamotif_t_test(m_values_pos, m_values_neg)
-        r_test = mamotif_ranksum_test(m_values_pos, m_values_neg)
-        result = MAmotifResult(
-            motif=motif, n_pos=len(m_values_pos), mean_pos=m_values_pos.mean(),
-            std_pos=m_values_pos.std(), n_neg=len(m_values_neg),
-            mean_neg=m_values_neg.mean(), std_neg=m_values_neg.std(),
-            t_stat=t_test[0], t_pval=t_test[1], t_padj=None,
-            r_stat=r_test[0], r_pval=r_test[1], r_padj=None,
-            padj=None)
-        results.append(result)
-
-    # multiple testing correction
-    p_values_t = [result.t_pval for result in results]
-    p_values_r = [result.r_pval for result in results]
-    adjusted_p_values_t = adjust_p_values(p_values_t, correction=correction)
-    adjusted_p_values_r = adjust_p_values(p_values_r, correction=correction)
-    for idx, result in enumerate(results):
-        result.t_padj = adjusted_p_values_t[idx]
-        result.r_padj = adjusted_p_values_r[idx]
-        if np.isnan(result.t_padj):
-            result.padj = result.r_padj
-        elif np.isnan(result.r_padj):
-            result.padj = result.t_padj
+                sums = stat_cache.dose_sums(
+                    regions.site_counts, m_values, block_masks,
+                    negative=negative, transform=dose_transform)
+            for subset_results, (slope, stderr, p_right) in zip(
+                    block_results, dose_fit(sums, m_values, block_masks,
+                                            subset_statistics)):
+                subset_results.dose_slope = slope
+                subset_results.dose_stderr = stderr
+                subset_results.dose_pval = p_right
+        results.extend(block_results)
+    return results
+
+
+def mamotif_test(motifs, regions, negative=False, correction='benjamin',
+                 tie_correction=False, mask=None):
+    return mamotif_test_grouped(
+        motifs, regions, [mask], negative=negative, correction=correction,
+        tie_correction=tie_correction)[0]
+
+
+def sample_name_of(f_manorm):
+    """Get the sample name from the path of a MAnorm `*_MAvalues.xls`."""
+    name = os.path.basename(f_manorm)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name.replace('_MAvalues.xls', '')
+
+
+def _dose_enabled(dose, presence_format):
+    """Whether to run the dose-response regression, see `run_integrations`."""
+    if dose is None:
+        return presence_format != 'packed'
+    return dose
+
+
+def load_regions(f_manorm, f_motifscan, cache_dir=None, cache_size=None,
+                 presence_format='dense', site_counts=False, profiler=None):
+    if presence_format not in PRESENCE_FORMATS:
+        raise ValueError(f"invalid presence format: {presence_format}")
+    packed = presence_format == 'packed'
+    sparse_presence = presence_format == 'sparse'
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+    if cache_dir:
+        cache = RegionCache(cache_dir, max_size=cache_size)
+        with profiler.stage('cache'):
+            key, motifs, regions = cache.load(
+                f_manorm, f_motifscan, packed=packed,
+                site_counts=site_counts, sparse_presence=sparse_presence)
+        if regions is None:
+            motifs, regions = load_mamotif_regions(
+                f_manorm, f_motifscan, packed=packed,
+                site_counts=site_counts, sparse_presence=sparse_presence,
+                profiler=profiler)
+            with profiler.stage('cache'):
+                cache.store(key, regions)
+    else:
+        motifs, regions = load_mamotif_regions(
+            f_manorm, f_motifscan, packed=packed, site_counts=site_counts,
+            sparse_presence=sparse_presence, profiler=profiler)
+    return motifs, regions
+
+
+def load_promoters(genome, upstream=4000, downstream=2000, cache_dir=None,
+                   cache_size=None):
+    """Load the promoter index of a genome, from the cache if available."""
+    f_genes = gene_annotation_path(genome)
+    logger.info(f"Loading promoters of genome {genome!r}")
+    if cache_dir:
+        cache = PromoterCache(cache_dir, max_size=cache_size)
+        return cache.load(f_genes, upstream=upstream, downstream=downstream)
+    return PromoterIndex.from_gene_file(f_genes, upstream=upstream,
+                                        downstream=downstream)
+
+
+def load_stratifier(genome=None, split=False, upstream=4000,
+                    downstream=2000, tss_bins=None, annotations=None,
+                    cache_dir=None, cache_size=None):
+    """Load the annotations to stratify regions into a `Stratifier`.
+
+    Parameters
+    ----------
+    genome : str, optional
+        Genome name, required by `split` and `tss_bins`.
+    split : bool, optional
+        Whether to split regions into promoter/distal regions.
+    upstream, downstream : int, optional
+        TSS upstream/downstream distances to define promoters.
+    tss_bins : list of int, optional
+        Upper edges of the distance-to-TSS bins.
+    annotations : list of tuple, optional
+        The ``(name, path)`` of BED annotations.
+    cache_dir : str, optional
+        Cache directory of the promoter index.
+    cache_size : int, optional
+        Maximal total size of the cache in bytes.
+    """
+    promoters = None
+    tss = None
+    if split:
+        promoters = load_promoters(genome, upstream=upstream,
+                                   downstream=downstream, cache_dir=cache_dir,
+                                   cache_size=cache_size)
+    if tss_bins:
+        tss = TssIndex.from_gene_file(gene_annotation_path(genome))
+    return Stratifier(promoters=promoters, tss=tss, tss_bins=tss_bins,
+                      annotations=load_annotations(annotations or []))
+
+
+def _output_path(output_dir, prefix, subset, output_format='xls',
+                 name='MAmotif_output'):
+    """Return the output path of the results of a subset of regions."""
+    suffix = '' if subset == 'all' else f'_{subset}'
+    return os.path.join(output_dir, f'{prefix}{suffix}_{name}'
+                                    f'{OUTPUT_FORMATS[output_format]}')
+
+
+# data shared with the worker processes, inherited when forked
+_shared = {}
+
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+
+def _run_task(task, shared=None):
+    shared = _shared if shared is None else shared
+    sample_idx, subsets, kwargs = task
+    motifs, regions = shared['regions'][sample_idx]
+    masks = [shared['masks'][sample_idx][subset] for subset in subsets]
+    return mamotif_test_grouped(motifs=motifs, regions=regions, masks=masks,
+                                **kwargs)
+
+
+def _run_permutation_task(task, shared=None):
+    shared = _shared if shared is None else shared
+    sample_idx, subset, negative, n_permutations, seed = task
+    _, regions = shared['regions'][sample_idx]
+    mask = shared['masks'][sample_idx][subset]
+    m_values = -regions.m_values if negative else regions.m_values
+    return permutation_counts(regions.presence, m_values, n_permutations,
+                              seed=seed, mask=mask)
+
+
+def _run_pair_task(task, shared=None):
+    shared = _shared if shared is None else shared
+    sample_idx, subset, negative, start, end, min_support = task
+    _, regions = shared['regions'][sample_idx]
+    mask = shared['masks'][sample_idx][subset]
+    m_values = -regions.m_values if negative else regions.m_values
+    return pair_statistics(regions.presence, m_values, start, end, mask=mask,
+                           min_support=min_support)
+
+
+def _run_tasks(tasks, shared, n_jobs=1, func=_run_task):
+    """Run the tasks with `func`, in a process pool if `n_jobs` > 1."""
+    n_jobs = min(n_jobs, len(tasks))
+    if n_jobs <= 1:
+        return [func(task, shared) for task in tasks]
+    methods = mp.get_all_start_methods()
+    if threading.current_thread() is not threading.main_thread():
+        # forking while other threads run (e.g. the stages of `mamotif run`)
+        # can deadlock the children on locks held by those threads
+        context = mp.get_context(
+            'forkserver' if 'forkserver' in methods else 'spawn')
+    elif 'fork' in methods:
+        # fork shares the loaded regions with workers without pickling them
+        context = mp.get_context('fork')
+    else:
+        context = mp.get_context()
+    with context.Pool(n_jobs, initializer=_init_worker,
+                      initargs=(shared,)) as pool:
+        return pool.map(func, tasks, chunksize=1)
+
+
+def _add_permutation_p_values(tasks, task_results, shared, n_permutations,
+                              seed=None, n_jobs=1):
+    """Add empirical p-values from `n_permutations` permutations.
+
+    The permutations of each task are split into batches of
+    `PERMUTATION_BATCH`, which run in the process pool. Every batch has its
+    own seed spawned from `seed`, so the p-values do not depend on `n_jobs`.
+    """
+    seed_seq = np.random.SeedSequence(seed)
+    logger.info(f"Running {n_permutations} permutations with seed "
+                f"{seed_seq.entropy}")
+    batches = []
+    owners = []
+    for task_idx, (task, task_seq) in enumerate(
+            zip(tasks, seed_seq.spawn(len(tasks)))):
+        sample_idx, subset, kwargs = task
+        sizes = [min(PERMUTATION_BATCH, n_permutations - start)
+                 for start in range(0, n_permutations, PERMUTATION_BATCH)]
+        for size, batch_seq in zip(sizes, task_seq.spawn(len(sizes))):
+            batches.append((sample_idx, subset, kwargs['negative'], size,
+                            batch_seq))
+            owners.append(task_idx)
+    counts = [[0, 0] for _ in tasks]
+    for task_idx, (t_counts, r_counts) in zip(
+            owners, _run_tasks(batches, shared, n_jobs,
+                               func=_run_permutation_task)):
+        counts[task_idx][0] += t_counts
+        counts[task_idx][1] += r_counts
+    for results, (t_counts, r_counts) in zip(task_results, counts):
+        # undefined statistics have no empirical p-values either
+        results.t_perm_pval = np.where(
+            np.isnan(results.t_pval), np.nan,
+            (t_counts + 1) / (n_permutations + 1))
+        results.r_perm_pval = np.where(
+            np.isnan(results.r_pval), np.nan,
+            (r_counts + 1) / (n_permutations + 1))
+
+
+def _add_pair_results(tasks, task_results, shared, min_support=MIN_SUPPORT,
+                      correction='benjamin', tie_correction=False, n_jobs=1):
+    """Test the motif pairs of each task and attach them as `pairs`.
+
+    The pairs ``(i, j)`` with ``i < j`` are split into tasks by blocks of
+    the first motif (see `mamotif.stats.pair_statistics`), which run in the
+    process pool. Only pairs with at least `min_support` target regions are
+    reported, and the multiple testing correction is over them.
+    """
+    blocks = []
+    owners = []
+    for task_idx, (sample_idx, subset, kwargs) in enumerate(tasks):
+        motifs, regions = shared['regions'][sample_idx]
+        align = 8 if isinstance(regions.presence, PackedPresence) else 1
+        block_size = pair_block_size(len(regions), align)
+        # at least one (empty) block, so that every task has its pairs
+        for start in range(0, max(len(motifs), 1), block_size):
+            blocks.append((sample_idx, subset, kwargs['negative'], start,
+                           min(start + block_size, len(motifs)),
+                           min_support))
+            owners.append(task_idx)
+    parts = [[] for _ in tasks]
+    for task_idx, part in zip(owners, _run_tasks(blocks, shared, n_jobs,
+                                                 func=_run_pair_task)):
+        parts[task_idx].append(part)
+    for (sample_idx, _, _), results, task_parts in zip(tasks, task_results,
+                                                       parts):
+        motifs = np.asarray(shared['regions'][sample_idx][0], dtype=object)
+        idx_a = np.concatenate([part[0] for part in task_parts])
+        idx_b = np.concatenate([part[1] for part in task_parts])
+        # order the pairs by the motifs, independent of the block size
+        order = np.lexsort((idx_b, idx_a))
+        idx_a, idx_b = idx_a[order], idx_b[order]
+        statistics = [np.concatenate([part[2][idx] for part in task_parts])
+                      [order] for idx in range(7)]
+        # the subset-level terms are the same in all parts
+        statistics += list(task_parts[0][2][7:])
+        logger.debug(f"Testing {len(idx_a)} motif pairs with at least "
+                     f"{min_support} target regions")
+        results.pairs = MAmotifPairResults(
+            motifs[idx_a], motifs[idx_b], **_test_columns(
+                statistics, correction=correction,
+                tie_correction=tie_correction))
+
+
+def _test_sample(sample_idx, subsets, shared, negative=False,
+                 correction='benjamin', tie_correction=False,
+                 stat_cache=None, dose=True, dose_transform='count',
+                 n_jobs=1):
+    """Run the grouped tests of the subsets of a sample.
+
+    The blocks of `SUBSET_BLOCK` subsets are dealt into up to `n_jobs`
+    groups, each group is tested in the process pool. Each block is tested
+    by the same product whatever the grouping, so the outputs do not depend
+    on `n_jobs`.
+    """
+    kwargs = {'negative': negative, 'correction': correction,
+              'tie_correction': tie_correction, 'stat_cache': stat_cache,
+              'dose': dose, 'dose_transform': dose_transform}
+    blocks = [subsets[start:start + SUBSET_BLOCK]
+              for start in range(0, len(subsets), SUBSET_BLOCK)]
+    n_groups = max(1, min(n_jobs, len(blocks)))
+    groups = [[subset for block in blocks[idx::n_groups] for subset in block]
+              for idx in range(n_groups)]
+    tasks = [(sample_idx, group, kwargs) for group in groups]
+    results = {}
+    for group, group_results in zip(groups, _run_tasks(tasks, shared,
+                                                       n_jobs)):
+        results.update(zip(group, group_results))
+    return [results[subset] for subset in subsets]
+
+
+def integrate_regions(samples, stratifier=None, correction='benjamin',
+                      tie_correction=False, permutations=0, seed=None,
+                      n_jobs=1, profiler=None, pairs=False,
+                      min_support=MIN_SUPPORT, stat_cache=None, dose=True,
+                      dose_transform='count'):
+    """Run MAmotif on the in-memory regions of one or more samples.
+
+    Regions of each sample are tested as a whole and in each stratum of the
+    `stratifier`. The strata of a sample are tested together over the shared
+    presence matrix, samples run in a process pool of `n_jobs` processes.
+
+    Parameters
+    ----------
+    samples : list of tuple
+        The ``(motifs, regions, negative)`` of each sample, where `regions`
+        is a `RegionTable` with M values.
+    stratifier : `mamotif.stratify.Stratifier`, optional
+        Stratifier of the regions, only all regions are tested by default.
+    profiler : `mamotif.profile.StageProfiler`, optional
+        Profiler to record the stages: 'classify', 'test', 'permutations'
+        and 'pairs'.
+    stat_cache : `mamotif.cache.StatisticsCache`, optional
+        Cache of the per-motif statistics for incremental integration, see
+        `mamotif_test_grouped`.
+    dose, dose_transform : optional
+        Options of the dose-response regression, see `mamotif_test_grouped`.
+
+    Other parameters are the same as `run_integrations`.
+
+    Returns
+    -------
+    list of dict
+        The `MAmotifResults` of each sample keyed by the stratum name, the
+        first one is ``'all'`` for all regions. With `pairs`, the results of
+        the motif pairs are the `pairs` attribute of each `MAmotifResults`.
+    """
+    if stratifier is None:
+        stratifier = Stratifier()
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+    shared = {'regions': [], 'masks': []}
+    for motifs, regions, _ in samples:
+        with profiler.stage('classify'):
+            masks = dict(stratifier.subsets(regions))
+        shared['regions'].append((motifs, regions))
+        shared['masks'].append(masks)
+
+    logger.info(f"Performing MAmotif on {len(samples)} sample(s)")
+    # several samples run in parallel as one task each (with all subsets of
+    # the sample), the subsets are only spread over the processes if there
+    # is a single sample
+    n_sample_jobs = min(n_jobs, len(samples))
+    sample_tasks = [
+        (sample_idx, list(shared['masks'][sample_idx]),
+         {'negative': negative, 'correction': correction,
+          'tie_correction': tie_correction, 'stat_cache': stat_cache,
+          'dose': dose, 'dose_transform': dose_transform})
+        for sample_idx, (_, _, negative) in enumerate(samples)]
+    with profiler.stage('test'):
+        if n_sample_jobs > 1:
+            task_results = _run_tasks(sample_tasks, shared, n_sample_jobs)
         else:
-            result.padj = max(result.t_padj, result.r_padj)
+            task_results = [
+                _test_sample(sample_idx, subsets, shared, n_jobs=n_jobs,
+                             **kwargs)
+                for sample_idx, subsets, kwargs in sample_tasks]
+    if permutations > 0:
+        with profiler.stage('permutations'):
+            _add_permutation_p_values(
+                [(sample_idx, subset, kwargs)
+                 for sample_idx, subsets, kwargs in sample_tasks
+                 for subset in subsets],
+                [results for sample_results in task_results
+                 for results in sample_results],
+                shared, permutations, seed=seed, n_jobs=n_jobs)
+    if pairs:
+        with profiler.stage('pairs'):
+            _add_pair_results(
+                [(sample_idx, subset, kwargs)
+                 for sample_idx, subsets, kwargs in sample_tasks
+                 for subset in subsets],
+                [results for sample_results in task_results
+                 for results in sample_results],
+                shared, min_support=min_support, correction=correction,
+                tie_correction=tie_correction, n_jobs=n_jobs)
+    return [dict(zip(subsets, sample_results))
+            for (_, subsets, _), sample_results in zip(sample_tasks,
+                                                      task_results)]
+
+
+def regions_from_arrays(chroms, starts, ends, m_values, site_counts,
+                        motifs, presence_format='dense'):
+    """Build a `RegionTable` from in-memory arrays.
+
+    See `integrate_arrays` for the parameters.
+    """
+    if presence_format not in PRESENCE_FORMATS:
+        raise ValueError(f"invalid presence format: {presence_format}")
+    chrom_names, chrom_codes = np.unique(np.asarray(chroms, dtype=str),
+                                         return_inverse=True)
+    if not sparse.issparse(site_counts):
+        site_counts = np.asarray(site_counts)
+    elif presence_format != 'sparse':
+        site_counts = site_counts.toarray()
+    if site_counts.ndim != 2:
+        raise ValueError(f"expect 2-D motif site numbers, got "
+                         f"{site_counts.ndim}-D")
+    if presence_format == 'packed':
+        presence = PackedPresence.from_dense(site_counts)
+    elif presence_format == 'sparse':
+        presence = SparsePresence(site_counts)
+        site_counts = sparse.csc_matrix(site_counts)
+    else:
+        presence = site_counts > 0
+    regions = RegionTable(motifs=motifs, chroms=chrom_names.tolist(),
+                          chrom_codes=chrom_codes, starts=starts, ends=ends,
+                          presence=presence, m_values=m_values,
+                          site_counts=site_counts)
+    if len(regions.m_values) != len(regions):
+        raise ValueError(f"expect {len(regions)} M values, got "
+                         f"{len(regions.m_values)}")
+    return regions
+
+
+def integrate_arrays(chroms, starts, ends, m_values, site_counts,
+                     motifs=None, negative=False, correction='benjamin',
+                     tie_correction=False, stratifier=None, permutations=0,
+                     seed=None, n_jobs=1, presence_format='dense',
+                     as_frame=False, pairs=False, min_support=MIN_SUPPORT,
+                     dose=None, dose_transform='count'):
+    """Run MAmotif on in-memory MAnorm/MotifScan results.
+
+    This is the same procedure as `run_integration`, without reading or
+    writing any file.
+
+    Parameters
+    ----------
+    chroms : array_like of str
+        The chromosome of each region.
+    starts, ends : array_like of int
+        The 0-based start and end coordinates of each region.
+    m_values : array_like of float
+        The M values of each region.
+    site_counts : (n_regions, n_motifs) array_like or `pandas.DataFrame`
+        The number of motif sites of each motif in each region. If it is a
+        DataFrame, the motif names default to its columns. A `scipy.sparse`
+        matrix is kept sparse with ``presence_format='sparse'``.
+    motifs : list of str, optional
+        The motif names, required unless `site_counts` is a DataFrame.
+    negative : bool, optional
+        Convert M=log2(A/B) to -M=log2(B/A).
+    stratifier : `mamotif.stratify.Stratifier`, optional
+        Stratifier of the regions (e.g. promoter/distal), see
+        `load_stratifier`. Only all regions are tested by default.
+    as_frame : bool, optional
+        If True, return the results as `pandas.DataFrame`, see
+        `MAmotifResults.to_frame`. The results of the motif pairs are not
+        returned as DataFrames, use ``results.pairs.to_frame()`` on the
+        `MAmotifResults` instead.
+
+    Other parameters are the same as `run_integrations`.
+
+    Returns
+    -------
+    dict
+        The `MAmotifResults` (or DataFrame) keyed by the stratum name, the
+        results of all regions are keyed by ``'all'``.
+
+    Examples
+    --------
+    >>> results = integrate_arrays(chroms, starts, ends, m_values,
+    ...                            site_counts, motifs)
+    >>> results['all'].padj
+    """
+    if motifs is None:
+        if not hasattr(site_counts, 'columns'):
+            raise ValueError("motif names are required for array inputs")
+        motifs = [str(motif) for motif in site_counts.columns]
+    regions = regions_from_arrays(chroms, starts, ends, m_values,
+                                  site_counts, motifs,
+                                  presence_format=presence_format)
+    results = integrate_regions(
+        [(regions.motifs, regions, negative)], stratifier=stratifier,
+        correction=correction, tie_correction=tie_correction,
+        permutations=permutations, seed=seed, n_jobs=n_jobs, pairs=pairs,
+        min_support=min_support, dose=_dose_enabled(dose, presence_format),
+        dose_transform=dose_transform)[0]
+    if as_frame:
+        results = {subset: subset_results.to_frame()
+                   for subset, subset_results in results.items()}
     return results
 
 
+def integrate_frame(frame, motifs, m_column='M_value', **kwargs):
+    """Run MAmotif on a `pandas.DataFrame` of regions.
+
+    Parameters
+    ----------
+    frame : `pandas.DataFrame`
+        One region per row, with the columns ``chr``, ``start``, ``end``,
+        the M values and the motif site numbers (e.g. a MAnorm table joined
+        with a MotifScan table).
+    motifs : list of str
+        The columns of the motif site numbers.
+    m_column : str, optional
+        The column of the M values.
+    **kwargs
+        Other parameters of `integrate_arrays`, results are returned as
+        DataFrames unless `as_frame` is False.
+    """
+    kwargs.setdefault('as_frame', True)
+    return integrate_arrays(
+        frame['chr'].to_numpy(), frame['start'].to_numpy(),
+        frame['end'].to_numpy(), frame[m_column].to_numpy(),
+        frame[list(motifs)].to_numpy(), motifs=list(motifs), **kwargs)
+
+
+def run_integrations(samples, genome=None, split=False, upstream=4000,
+                     downstream=2000, correction='benjamin',
+                     tie_correction=False, output_dir=None, cache_dir=None,
+                     cache_size=None, presence_format='dense', n_jobs=1,
+                     stratifier=None, permutations=0, seed=None,
+                     tss_bins=None, annotations=None, output_format='xls',
+                     profiler=None, pairs=False, min_support=MIN_SUPPORT,
+                     incremental=False, dose=None, dose_transform='count'):
+    """Run MAmotif integration for one or more samples.
+
+    Regions of each sample are loaded from the MAnorm/MotifScan results,
+    tested as a whole and in each stratum (promoter/distal, distance-to-TSS
+    bins and annotations) by `integrate_regions`, and the results of each
+    stratum are written into `output_dir`. Output files are identical to the
+    serial run.
+
+    Parameters
+    ----------
+    samples : list of tuple
+        The ``(f_manorm, f_motifscan, negative)`` of each sample.
+    n_jobs : int, optional
+        Number of processes used to run in parallel.
+    stratifier : `mamotif.stratify.Stratifier`, optional
+        Pre-loaded stratifier, it replaces the stratification options
+        (`split`, `upstream`, `downstream`, `tss_bins` and `annotations`).
+    permutations : int, optional
+        If positive, also report empirical p-values from this number of
+        permutations of the M values.
+    seed : int, optional
+        Seed of the permutations, random if not specified.
+    tss_bins : list of int, optional
+        Upper edges of the distance-to-TSS bins to stratify regions, e.g.
+        ``[1000, 5000, 50000]``.
+    annotations : list of tuple, optional
+        The ``(name, path)`` of BED annotations to stratify regions.
+    output_format : {'xls', 'xls.gz', 'parquet'}, optional
+        Format of the output files: tab-separated, gzip-compressed
+        tab-separated or Parquet tables.
+    profiler : `mamotif.profile.StageProfiler`, optional
+        Profiler to record the stages: 'strata', 'cache' (loading and
+        storing the matched regions in `cache_dir`), 'parse', 'match' (see
+        `mamotif.region.load_mamotif_regions`), 'classify', 'test',
+        'permutations', 'pairs' and 'write'.
+    pairs : bool, optional
+        Whether to also test the co-occurrence of all motif pairs, the
+        results are written to ``*_MAmotif_pairs_output.xls``.
+    min_support : int, optional
+        Minimal number of target regions (with both motifs present) of the
+        reported motif pairs.
+    incremental : bool, optional
+        Whether to cache the statistics of each motif in `cache_dir`, so
+        that later runs only compute the statistics of new or changed motifs
+        (e.g. after adding motifs to the motif set), see
+        `mamotif.cache.StatisticsCache`. Requires `cache_dir`.
+    dose : bool, optional
+        Whether to regress the M values on the motif site numbers of each
+        motif, see `mamotif.stats.dose_response`. By default, only if the
+        presence matrix is not packed: the site numbers take one byte per
+        region and motif (or per motif hit if sparse), which would undo the
+        memory bound of the packed format.
+    dose_transform : {'count', 'log1p'}, optional
+        Regress on the site numbers or on ``log1p`` of them.
+
+    Other parameters are the same as `run_integration`.
+
+    Returns
+    -------
+    list of str
+        Paths of the output files.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"invalid output format: {output_format}")
+    if incremental and not cache_dir:
+        raise ValueError("incremental integration requires a cache directory")
+    dose = _dose_enabled(dose, presence_format)
+    output_dir = os.path.abspath(output_dir or os.getcwd())
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+    if stratifier is None:
+        with profiler.stage('strata'):
+            stratifier = load_stratifier(
+                genome=genome, split=split, upstream=upstream,
+                downstream=downstream, tss_bins=tss_bins,
+                annotations=annotations, cache_dir=cache_dir,
+                cache_size=cache_size)
+
+    loaded = []
+    for f_manorm, f_motifscan, negative in samples:
+        motifs, regions = load_regions(
+            f_manorm, f_motifscan, cache_dir=cache_dir,
+            cache_size=cache_size, presence_format=presence_format,
+            site_counts=dose, profiler=profiler)
+        loaded.append((motifs, regions, negative))
+    sample_results = integrate_regions(
+        loaded, stratifier=stratifier, correction=correction,
+        tie_correction=tie_correction, permutations=permutations, seed=seed,
+        n_jobs=n_jobs, profiler=profiler, pairs=pairs,
+        min_support=min_support,
+        stat_cache=StatisticsCache(cache_dir, max_size=cache_size)
+        if incremental else None, dose=dose, dose_transform=dose_transform)
+    paths = []
+    with profiler.stage('write'):
+        for (f_manorm, _, _), results in zip(samples, sample_results):
+            sample_name = sample_name_of(f_manorm)
+            for subset, subset_results in results.items():
+                path = _output_path(output_dir, sample_name, subset,
+                                    output_format=output_format)
+                write_mamotif_results(path=path, results=subset_results,
+                                      correction=correction,
+                                      permutations=permutations)
+                paths.append(path)
+                if subset_results.pairs is not None:
+                    path = _output_path(output_dir, sample_name, subset,
+                                        output_format=output_format,
+                                        name='MAmotif_pairs_output')
+                    write_mamotif_pair_results(
+                        path=path, results=subset_results.pairs,
+                        correction=correction)
+                    paths.append(path)
+    return paths
+
+
 def run_integration(f_manorm, f_motifscan, negative=False, genome=None,
                     split=False, upstream=4000, downstream=2000,
-                    correction='benjamin', output_dir=None):
-    motifs, regions = load_mamotif_regions(f_manorm, f_motifscan)
-    sample_name = os.path.basename(f_manorm).replace('_MAvalues.xls', '')
+                    correction='benjamin', tie_correction=False,
+                    output_dir=None, cache_dir=None, cache_size=None,
+                    presence_format='dense', n_jobs=1, stratifier=None,
+                    permutations=0, seed=None, tss_bins=None,
+                    annotations=None, output_format='xls', profiler=None,
+                    pairs=False, min_support=MIN_SUPPORT, incremental=False,
+                    dose=None, dose_transform='count'):
+    return run_integrations(
+        [(f_manorm, f_motifscan, negative)], genome=genome, split=split,
+        upstream=upstream, downstream=downstream, correction=correction,
+        tie_correction=tie_correction, output_dir=output_dir,
+        cache_dir=cache_dir, cache_size=cache_size,
+        presence_format=presence_format, n_jobs=n_jobs,
+        stratifier=stratifier, permutations=permutations, seed=seed,
+        tss_bins=tss_bins, annotations=annotations,
+        output_format=output_format, profiler=profiler, pairs=pairs,
+        min_support=min_support, incremental=incremental, dose=dose,
+        dose_transform=dose_transform)
+
+
+def _run_comparison(task, shared=None):
+    """Run and write one integration of a batch, errors are recorded."""
+    shared = _shared if shared is None else shared
+    f_manorm, f_motifscan, negative, prefix = task
+    options = shared['options']
+    start_time = time.perf_counter()
+    record = {'prefix': prefix, 'status': 'ok', 'outputs': [], 'error': ''}
+    try:
+        motifs, regions = load_regions(
+            f_manorm, f_motifscan, cache_dir=options['cache_dir'],
+            cache_size=options['cache_size'],
+            presence_format=options['presence_format'],
+            site_counts=options['dose'])
+        results = integrate_regions(
+            [(motifs, regions, negative)], stratifier=shared['stratifier'],
+            correction=options['correction'],
+            tie_correction=options['tie_correction'],
+            permutations=options['permutations'], seed=options['seed'],
+            pairs=options['pairs'], min_support=options['min_support'],
+            stat_cache=StatisticsCache(options['cache_dir'],
+                                       max_size=options['cache_size'])
+            if options['incremental'] else None, dose=options['dose'],
+            dose_transform=options['dose_transform'])[0]
+        for subset, subset_results in results.items():
+            path = _output_path(options['output_dir'], prefix, subset,
+                                output_format=options['output_format'])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_mamotif_results(path=path, results=subset_results,
+                                  correction=options['correction'],
+                                  permutations=options['permutations'])
+            record['outputs'].append(path)
+            if subset_results.pairs is not None:
+                path = _output_path(options['output_dir'], prefix, subset,
+                                    output_format=options['output_format'],
+                                    name='MAmotif_pairs_output')
+                write_mamotif_pair_results(
+                    path=path, results=subset_results.pairs,
+                    correction=options['correction'])
+                record['outputs'].append(path)
+    except Exception as e:
+        logger.error(f"Integration {prefix!r} failed: {e}")
+        record['status'] = 'failed'
+        record['error'] = f"{type(e).__name__}: {e}"
+    record['elapsed'] = time.perf_counter() - start_time
+    return record
+
+
+def run_integration_batch(comparisons, genome=None, split=False,
+                          upstream=4000, downstream=2000,
+                          correction='benjamin', tie_correction=False,
+                          output_dir=None, cache_dir=None, cache_size=None,
+                          presence_format='dense', n_jobs=1, stratifier=None,
+                          permutations=0, seed=None, tss_bins=None,
+                          annotations=None, output_format='xls', pairs=False,
+                          min_support=MIN_SUPPORT, incremental=False,
+                          dose=None, dose_transform='count'):
+    """Run MAmotif integration for a batch of comparisons.
+
+    Shared resources (e.g. the stratification annotations) are loaded once,
+    each comparison is loaded, tested and written by a worker of a pool of
+    `n_jobs` processes. A failed comparison does not stop the others, the
+    status, outputs and errors of all comparisons are written to the
+    summary index `integrate_batch_summary.xls` in `output_dir`.
+
+    Parameters
+    ----------
+    comparisons : list of tuple
+        The ``(f_manorm, f_motifscan, negative, prefix)`` of each comparison.
+        The output files are named ``{prefix}_MAmotif_output.xls`` (or the
+        extension of `output_format`), the prefix defaults to the MAnorm
+        sample name if it is None.
+
+    Other parameters are the same as `run_integrations`.
+
+    Returns
+    -------
+    list of dict
+        The summary records of the comparisons, see `write_batch_summary`.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"invalid output format: {output_format}")
+    if incremental and not cache_dir:
+        raise ValueError("incremental integration requires a cache directory")
+    dose = _dose_enabled(dose, presence_format)
     output_dir = os.path.abspath(output_dir or os.getcwd())
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir)
+    tasks = []
+    for f_manorm, f_motifscan, negative, prefix in comparisons:
+        prefix = prefix or sample_name_of(f_manorm)
+        tasks.append((f_manorm, f_motifscan, negative, prefix))
+    prefixes = [task[3] for task in tasks]
+    duplicates = sorted({prefix for prefix in prefixes
+                         if prefixes.count(prefix) > 1})
+    if duplicates:
+        raise ValueError(f"duplicated output prefixes: "
+                         f"{', '.join(duplicates)}")
+    if stratifier is None:
+        stratifier = load_stratifier(
+            genome=genome, split=split, upstream=upstream,
+            downstream=downstream, tss_bins=tss_bins,
+            annotations=annotations, cache_dir=cache_dir,
+            cache_size=cache_size)
+    shared = {'stratifier': stratifier, 'options': {
+        'correction': correction, 'tie_correction': tie_correction,
+        'output_dir': output_dir, 'cache_dir': cache_dir,
+        'cache_size': cache_size, 'presence_format': presence_format,
+        'permutations': permutations, 'seed': seed,
+        'output_format': output_format, 'pairs': pairs,
+        'min_support': min_support, 'incremental': incremental,
+        'dose': dose, 'dose_transform': dose_transform}}
 
-    results = mamotif_test(motifs=motifs, regions=regions,
-                           negative=negative, correction=correction)
-    path = os.path.join(output_dir, sample_name + '_MAmotif_output.xls')
-    write_mamotif_results(path=path, results=results, correction=correction)
-
-    if split:
-        logger.info("Split into promoter/distal regions")
-        genome = Genome(genome)
-        regions_promoter = subset_by_location(
-            regions=regions, genes=genome.genes, location='promoter',
-            upstream=upstream, downstream=downstream)
-        regions_distal = subset_by_location(
-            regions=regions, genes=genome.genes, location='distal',
-            upstream=upstream, downstream=downstream)
-
-        logger.info("Performing MAmotif on promoter regions")
-        results = mamotif_test(motifs=motifs, regions=regions_promoter,
-                               negative=negative, correction=correction)
-        path = os.path.join(output_dir,
-                            sample_name + '_promoter_MAmotif_output.xls')
-        write_mamotif_results(path=path, results=results,
-                              correction=correction)
-
-        logger.info("Performing MAmotif on distal regions")
-        results = mamotif_test(motifs=motifs, regions=regions_distal,
-                               negative=negative, correction=correction)
-        path = os.path.join(output_dir,
-                            sample_name + '_distal_MAmotif_output.xls')
-        write_mamotif_results(path=path, results=results,
-                              correction=correction)
+    logger.info(f"Performing MAmotif on {len(tasks)} comparison(s)")
+    records = _run_tasks(tasks, shared, n_jobs, func=_run_comparison)
+    write_batch_summary(
+        os.path.join(output_dir, 'integrate_batch_summary.xls'), records)
+    n_failed = sum(record['status'] != 'ok' for record in records)
+    if n_failed:
+        logger.warning(f"{n_failed} of {len(records)} comparison(s) failed")
+    return records
@@ -4,30 +4,645 @@ mamotif.io
 I/O module of MAmotif.
 """
 
+import gzip
 import logging
+import os
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# number of bytes of text lines parsed at once by the bulk parsers
+CHUNK_BYTES = 32 * 1024 * 1024
 
-def write_mamotif_results(path, results, correction):
-    logger.info(f"Saving MAmotif results to {path}")
-    correction_str = correction.capitalize()
-    columns = ["Motif Name", "Target Number", "Average of Target M values",
-               "Std. of Target M values", "Non-target Number",
-               "Average of Non-target M values", "Std. of Non-target M values",
-               "T-test Statistic", "T-test P value (right-tailed)",
-               f"T-test P value By {correction_str} correction",
-               "RankSum-test Statistic", "RankSum-test P value (right-tailed)",
-               f"RankSum-test P value By {correction_str} correction",
-               "Maximal corrected P value\n"]
-    header = '\t'.join(columns)
-    results.sort(key=lambda x: x.padj)
+
+def open_file(path, mode='rt'):
+    """Open a plain text or gzip/bgzip-compressed file transparently."""
+    with open(path, 'rb') as fin:
+        magic = fin.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _count_dtype(max_count):
+    """Return the smallest unsigned integer type to hold the site counts."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_count <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+class _ChromEncoder:
+    """Encode chromosome names into categorical codes."""
+
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, chroms):
+        codes = self.codes
+        return [codes.setdefault(chrom, len(codes)) for chrom in chroms]
+
+    @property
+    def chroms(self):
+        return list(self.codes)
+
+
+def read_motif_sites_number(path, chunk_bytes=CHUNK_BYTES, transform=None):
+    """Read the MotifScan motif sites number table in bulk.
+
+    The file is parsed in large chunks of lines and the site counts are
+    converted straight into a typed matrix. Gzip/bgzip-compressed files are
+    also supported.
+
+    Parameters
+    ----------
+    path : str
+        Path of the `motif_sites_number.xls` file.
+    chunk_bytes : int, optional
+        Approximate number of bytes parsed per chunk.
+    transform : callable, optional
+        If specified, it is applied to the site counts of each chunk before
+        the chunks are concatenated, e.g. to keep only the (packed) presence
+        indicators without materializing the full count matrix.
+
+    Returns
+    -------
+    motifs : list of str
+        The motif names.
+    chroms : list of str
+        The chromosome names.
+    chrom_codes : ndarray of int32
+        The chromosome codes of regions, indexed into `chroms`.
+    starts : ndarray of int64
+        The 0-based start coordinates of regions.
+    ends : ndarray of int64
+        The end coordinates of regions.
+    counts : (n_regions, n_motifs) ndarray of unsigned int
+        The motif site numbers of regions, stored in the smallest unsigned
+        integer type (uint8 or uint16 typically) to hold the maximal count.
+        Or the concatenated outputs of `transform` if specified.
+    """
+    logger.info(f"Loading genomic regions from {path} [motifscan]")
+    encoder = _ChromEncoder()
+    chrom_codes = []
+    starts = []
+    ends = []
+    counts = []
+    with open_file(path, 'rt') as fin:
+        header = fin.readline().rstrip('\r\n').split('\t')
+        if header[:3] != ['chr', 'start', 'end']:
+            raise ValueError(
+                f"not a valid MotifScan motif_sites_number.xls file: {path}")
+        motifs = header[3:]
+        n_motifs = len(motifs)
+        line_num = 1
+        while True:
+            lines = fin.readlines(chunk_bytes)
+            if not lines:
+                break
+            # line numbers in the file, before skipping the blank lines
+            line_nums = [line_num + offset + 1
+                         for offset, line in enumerate(lines) if line.strip()]
+            line_num += len(lines)
+            lines = [line for line in lines if line.strip()]
+            if not lines:
+                continue
+            fields = [line.split('\t', 3) for line in lines]
+            try:
+                if any(line.count('\t') != n_motifs + 2 for line in lines):
+                    raise ValueError
+                chroms, chunk_starts, chunk_ends, texts = zip(*fields)
+                chunk_counts = np.loadtxt(texts, dtype=np.int64,
+                                          delimiter='\t', comments=None,
+                                          ndmin=2)
+                if chunk_counts.size != len(lines) * n_motifs:
+                    raise ValueError
+                chunk_starts = np.array(chunk_starts, dtype=np.int64) - 1
+                chunk_ends = np.array(chunk_ends, dtype=np.int64)
+            except ValueError:
+                _raise_format_error(path, fields, n_motifs, line_nums)
+            if chunk_counts.size and chunk_counts.min() < 0:
+                raise ValueError(
+                    f"negative motif site numbers found in {path}")
+            chrom_codes.append(np.array(encoder.encode(chroms),
+                                        dtype=np.int32))
+            starts.append(chunk_starts)
+            ends.append(chunk_ends)
+            chunk_counts = chunk_counts.reshape(len(lines), n_motifs)
+            chunk_counts = chunk_counts.astype(
+                _count_dtype(chunk_counts.max(initial=0)))
+            if transform is not None:
+                chunk_counts = transform(chunk_counts)
+            counts.append(chunk_counts)
+
+    if counts:
+        dtype = np.result_type(*counts)
+        counts = np.concatenate(counts).astype(dtype, copy=False)
+        chrom_codes = np.concatenate(chrom_codes)
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+    else:
+        counts = np.empty((0, n_motifs), dtype=np.uint8)
+        if transform is not None:
+            counts = transform(counts)
+        chrom_codes = np.empty(0, dtype=np.int32)
+        starts = np.empty(0, dtype=np.int64)
+        ends = np.empty(0, dtype=np.int64)
+    logger.info(f"Loaded {len(starts)} genomic regions")
+    return motifs, encoder.chroms, chrom_codes, starts, ends, counts
+
+
+def _raise_format_error(path, fields, n_motifs, line_nums):
+    """Locate the first malformed line of a chunk and raise an error.
+
+    `line_nums` are the line numbers of the (non-blank) lines in the file.
+    """
+    for line_fields, line_num in zip(fields, line_nums):
+        try:
+            int(line_fields[1])
+            int(line_fields[2])
+            if len(list(map(int, line_fields[3].split('\t')))) != n_motifs:
+                raise ValueError
+        except (IndexError, ValueError):
+            line = '\t'.join(line_fields).rstrip('\r\n')
+            raise ValueError(
+                f"invalid motif sites number format in {path} at line "
+                f"{line_num}: {line!r}")
+    raise ValueError(f"invalid motif sites number format in {path}")
+
+
+def is_manorm_header(line):
+    """Returns if the line is a header line used in MAnorm xls."""
+    return line.startswith('#') or line.split('\t', 1)[0] == 'chr'
+
+
+def read_manorm_values(path, chunk_bytes=CHUNK_BYTES):
+    """Read the regions and M values from a MAnorm `*_MAvalues.xls` file.
+
+    Gzip/bgzip-compressed files are also supported.
+
+    Returns
+    -------
+    chroms : list of str
+        The chromosome names.
+    chrom_codes : ndarray of int32
+        The chromosome codes of regions, indexed into `chroms`.
+    starts : ndarray of int64
+        The 0-based start coordinates of regions.
+    ends : ndarray of int64
+        The end coordinates of regions.
+    m_values : ndarray of float64
+        The M values of regions.
+    """
+    logger.info(f"Loading genomic regions from {path} [manorm]")
+    encoder = _ChromEncoder()
+    chrom_codes = []
+    starts = []
+    ends = []
+    m_values = []
+    with open_file(path, 'rt') as fin:
+        line_num = 0
+        expect_header = True
+        while True:
+            lines = fin.readlines(chunk_bytes)
+            if not lines:
+                break
+            fields = []
+            for line in lines:
+                line_num += 1
+                line = line.strip()
+                if not line:
+                    continue
+                if expect_header:
+                    if is_manorm_header(line):
+                        continue
+                    expect_header = False
+                line_fields = line.split('\t', 5)
+                if len(line_fields) < 5:
+                    raise ValueError(
+                        f"invalid MAnorm format in {path} at line "
+                        f"{line_num}: {line!r}")
+                fields.append(line_fields[:5])
+            if not fields:
+                continue
+            chroms, chunk_starts, chunk_ends, _, chunk_m_values = zip(*fields)
+            try:
+                starts.append(np.array(chunk_starts, dtype=np.int64) - 1)
+                ends.append(np.array(chunk_ends, dtype=np.int64))
+                m_values.append(np.array(chunk_m_values, dtype=np.float64))
+            except ValueError:
+                raise ValueError(f"invalid MAnorm format in {path}")
+            chrom_codes.append(np.array(encoder.encode(chroms),
+                                        dtype=np.int32))
+    if starts:
+        chrom_codes = np.concatenate(chrom_codes)
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+        m_values = np.concatenate(m_values)
+    else:
+        chrom_codes = np.empty(0, dtype=np.int32)
+        starts = np.empty(0, dtype=np.int64)
+        ends = np.empty(0, dtype=np.int64)
+        m_values = np.empty(0, dtype=np.float64)
+    logger.info(f"Loaded {len(starts)} genomic regions")
+    return encoder.chroms, chrom_codes, starts, ends, m_values
+
+
+def write_union_regions(path, f_manorms):
+    """Write the deduplicated union of the regions in MAnorm files.
+
+    Regions are identified by their coordinates and summits, so a region
+    shared by several files is scanned once. The MAnorm format is kept, the
+    first occurrence of each region is written.
+
+    Parameters
+    ----------
+    path : str
+        Path to write the union regions.
+    f_manorms : list of str
+        Paths of the MAnorm `*_MAvalues.xls` files.
+
+    Returns
+    -------
+    list of list of int
+        The row indices (in the union) of the regions of each file.
+    """
+    index = {}
+    rows = []
+    with open(path, 'w') as fout:
+        for f_manorm in f_manorms:
+            sample_rows = []
+            with open_file(f_manorm, 'rt') as fin:
+                expect_header = True
+                for line in fin:
+                    if not line.strip():
+                        continue
+                    if expect_header:
+                        if is_manorm_header(line):
+                            if not index and not rows:
+                                fout.write(line)
+                            continue
+                        expect_header = False
+                    key = tuple(line.split('\t', 4)[:4])
+                    row = index.get(key)
+                    if row is None:
+                        row = index[key] = len(index)
+                        fout.write(line if line.endswith('\n')
+                                   else line + '\n')
+                    sample_rows.append(row)
+            rows.append(sample_rows)
+    logger.info(f"Wrote {len(index)} union regions of "
+                f"{sum(len(sample_rows) for sample_rows in rows)} regions")
+    return rows
+
+
+def split_table_rows(path, outputs):
+    """Split the rows of a table with one header line into several tables.
+
+    Parameters
+    ----------
+    path : str
+        Path of the table to split.
+    outputs : list of tuple
+        The ``(path, rows)`` of each output table, where `rows` are the
+        indices of the rows (header excluded) to write, in output order.
+    """
+    # rows in original order are streamed, others are kept until the end
+    streamed = []
+    buffered = []
+    needed = set()
+    for out_path, rows in outputs:
+        if list(rows) == list(range(len(rows))):
+            streamed.append((out_path, len(rows)))
+        else:
+            buffered.append((out_path, rows))
+            needed.update(rows)
+    lines = {}
+    n_lines = 0
+    fouts = [open(out_path, 'wb') for out_path, _ in streamed]
+    try:
+        with open_file(path, 'rb') as fin:
+            header = fin.readline()
+            for fout in fouts:
+                fout.write(header)
+            for idx, line in enumerate(fin):
+                for fout, (_, n_rows) in zip(fouts, streamed):
+                    if idx < n_rows:
+                        fout.write(line)
+                if idx in needed:
+                    lines[idx] = line
+                n_lines += 1
+    finally:
+        for fout in fouts:
+            fout.close()
+    n_expected = max([n_rows for _, n_rows in streamed] +
+                     [max(needed) + 1 if needed else 0])
+    if n_lines < n_expected:
+        raise ValueError(f"expect at least {n_expected} rows in {path}, "
+                         f"got {n_lines}")
+    for out_path, rows in buffered:
+        with open(out_path, 'wb') as fout:
+            fout.write(header)
+            for row in rows:
+                fout.write(lines[row])
+
+
+def read_bed_intervals(path):
+    """Read the intervals of a BED file.
+
+    Header lines (`track`, `browser` or starting with `#`) are skipped, only
+    the first three columns are used.
+
+    Returns
+    -------
+    chroms : list of str
+        Chromosome of each interval.
+    starts, ends : ndarray of int64
+        Start/end coordinates of each interval.
+    """
+    chroms = []
+    starts = []
+    ends = []
+    with open_file(path, 'rt') as fin:
+        for line_num, line in enumerate(fin, start=1):
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            fields = line.split('\t') if '\t' in line else line.split()
+            try:
+                chroms.append(fields[0])
+                starts.append(int(fields[1]))
+                ends.append(int(fields[2]))
+            except (IndexError, ValueError):
+                raise ValueError(f"invalid BED format at line {line_num} of "
+                                 f"{path}: {line.strip()!r}") from None
+    return (chroms, np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64))
+
+
+_BOOL_VALUES = {'true': True, 'yes': True, '1': True, 'false': False,
+                'no': False, '0': False, '': False}
+
+
+def read_integration_manifest(path):
+    """Read the manifest of a batch of integrations.
+
+    The manifest is a tab-separated table with the columns: path of the
+    MAnorm `*_MAvalues.xls` file, path of the MotifScan
+    `motif_sites_number.xls` file, whether to convert M to -M (true/false,
+    yes/no or 1/0) and the prefix of the output files. The last two columns
+    are optional, an empty prefix defaults to the MAnorm sample name. Blank
+    lines and lines starting with `#` are ignored, relative input paths are
+    relative to the directory of the manifest.
+
+    Returns
+    -------
+    list of tuple
+        The ``(f_manorm, f_motifscan, negative, prefix)`` of each row, the
+        prefix is None if not specified.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    rows = []
+    with open_file(path, 'rt') as fin:
+        for line_num, line in enumerate(fin, start=1):
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.rstrip('\r\n').split(
+                '\t')]
+            if len(fields) < 2 or len(fields) > 4:
+                raise ValueError(f"invalid manifest format at line {line_num} "
+                                 f"of {path}: expect 2 to 4 columns, got "
+                                 f"{len(fields)}")
+            fields += [''] * (4 - len(fields))
+            f_manorm, f_motifscan, negative, prefix = fields
+            if negative.lower() not in _BOOL_VALUES:
+                raise ValueError(f"invalid negative value at line {line_num} "
+                                 f"of {path}: {negative!r}")
+            rows.append((os.path.join(base_dir, f_manorm),
+                         os.path.join(base_dir, f_motifscan),
+                         _BOOL_VALUES[negative.lower()], prefix or None))
+    return rows
+
+
+def write_batch_summary(path, records):
+    """Write the summary index of a batch of integrations.
+
+    Parameters
+    ----------
+    path : str
+        Path of the summary table.
+    records : list of dict
+        The `prefix`, `status`, `elapsed` (seconds), `outputs` (list of
+        paths) and `error` message of each integration.
+    """
+    logger.info(f"Saving batch summary to {path}")
     with open(path, 'w') as fout:
-        fout.write(header)
-        for result in results:
-            fout.write(
-                f"{result.motif}\t{result.n_pos}\t{result.mean_pos}\t"
-                f"{result.std_pos}\t{result.n_neg}\t{result.mean_neg}\t"
-                f"{result.std_neg}\t{result.t_stat}\t{result.t_pval}\t"
-                f"{result.t_padj}\t{result.r_stat}\t{result.r_pval}\t"
-                f"{result.r_padj}\t{result.padj}\n")
+        fout.write('Prefix\tStatus\tElapsed (s)\tOutputs\tError\n')
+        for record in records:
+            error = ' '.join(record['error'].split())  # keep it on one line
+            fout.write(f"{record['prefix']}\t{record['status']}\t"
+                       f"{record['elapsed']:.2f}\t"
+                       f"{','.join(record['outputs'])}\t{error}\n")
+
+
+# (attribute, Parquet column name, dtype) of the MAmotif result columns
+RESULT_COLUMNS = [
+    ('motif', 'motif', 'string'),
+    ('n_pos', 'target_number', 'int64'),
+    ('mean_pos', 'target_mean', 'float64'),
+    ('std_pos', 'target_std', 'float64'),
+    ('n_neg', 'non_target_number', 'int64'),
+    ('mean_neg', 'non_target_mean', 'float64'),
+    ('std_neg', 'non_target_std', 'float64'),
+    ('t_stat', 't_stat', 'float64'),
+    ('t_pval', 't_pval', 'float64'),
+    ('t_padj', 't_padj', 'float64'),
+    ('r_stat', 'ranksum_stat', 'float64'),
+    ('r_pval', 'ranksum_pval', 'float64'),
+    ('r_padj', 'ranksum_padj', 'float64'),
+    ('padj', 'padj', 'float64'),
+    ('dose_slope', 'dose_slope', 'float64'),
+    ('dose_stderr', 'dose_stderr', 'float64'),
+    ('dose_pval', 'dose_pval', 'float64'),
+    ('t_perm_pval', 't_perm_pval', 'float64'),
+    ('r_perm_pval', 'ranksum_perm_pval', 'float64')]
+# columns of the motif pair results, without the permutation p-values
+PAIR_COLUMNS = [('motif_a', 'motif_a', 'string'),
+                ('motif_b', 'motif_b', 'string')] + RESULT_COLUMNS[1:14]
+PARQUET_SCHEMA_VERSION = 2
+# fast compression, random-looking digits gain little from higher levels
+GZIP_LEVEL = 1
+
+
+def _result_columns(results, columns=RESULT_COLUMNS):
+    """Return the result columns as arrays, sorted by the maximal padj.
+
+    `results` is either columnar (e.g. `MAmotifResults`) or a list of
+    `MAmotifResult` objects.
+    """
+    if hasattr(results, 'FIELDS'):
+        values = {}
+        for attr, _, dtype in columns:
+            if attr == 'motif':
+                column = np.array(results.motifs, dtype=object)
+            else:
+                column = getattr(results, attr)
+            if column is not None:
+                column = np.asarray(
+                    column, dtype=object if dtype == 'string' else None)
+            values[attr] = column
+    else:
+        results = list(results)
+        values = {}
+        for attr, _, dtype in columns:
+            column = [getattr(result, attr, None) for result in results]
+            if dtype != 'string' and column and column[0] is None:
+                values[attr] = None
+            else:
+                values[attr] = np.array(
+                    column, dtype=object if dtype == 'string' else dtype)
+    # stable sort, motifs with undefined p-values last
+    order = np.argsort(values['padj'], kind='mergesort')
+    return {attr: None if column is None else column[order]
+            for attr, column in values.items()}
+
+
+def _format_column(values):
+    if values is None:
+        return None
+    if values.dtype.kind == 'f':
+        return [repr(value) for value in values.tolist()]
+    return [str(value) for value in values.tolist()]
+
+
+def _stat_headers(correction):
+    correction_str = correction.capitalize()
+    return ["Target Number", "Average of Target M values",
+            "Std. of Target M values", "Non-target Number",
+            "Average of Non-target M values", "Std. of Non-target M values",
+            "T-test Statistic", "T-test P value (right-tailed)",
+            f"T-test P value By {correction_str} correction",
+            "RankSum-test Statistic", "RankSum-test P value (right-tailed)",
+            f"RankSum-test P value By {correction_str} correction",
+            "Maximal corrected P value"]
+
+
+def _write_table(path, header, texts):
+    """Write formatted columns as a (gzip-compressed) tab-separated table."""
+    body = ''.join(line + '\n' for line in map('\t'.join, zip(*texts)))
+    if path.endswith('.gz'):
+        fout = gzip.open(path, 'wt', compresslevel=GZIP_LEVEL)
+    else:
+        fout = open(path, 'w')
+    with fout:
+        fout.write('\t'.join(header) + '\n')
+        fout.write(body)
+
+
+def write_mamotif_results(path, results, correction, permutations=0):
+    """Write the MAmotif results of all motifs.
+
+    The output format is chosen by the extension of `path`: ``.parquet`` for
+    a Parquet table (see `write_mamotif_results_parquet`), otherwise a
+    tab-separated table which is gzip-compressed if the path ends with
+    ``.gz``. The rows are sorted by the maximal corrected P value. The
+    dose-response columns are written if the results have them.
+
+    Parameters
+    ----------
+    path : str
+        Path of the output file.
+    results : `mamotif.integration.MAmotifResults` or list
+        The results, columnar or a list of `MAmotifResult` objects.
+    correction : str
+        The multiple testing correction method.
+    permutations : int, optional
+        Number of permutations of the empirical P values, which are written
+        if it is positive.
+    """
+    if path.endswith('.parquet'):
+        write_mamotif_results_parquet(path, results, correction,
+                                      permutations=permutations)
+        return
+    logger.info(f"Saving MAmotif results to {path}")
+    header = ["Motif Name"] + _stat_headers(correction)
+    values = _result_columns(results)
+    columns = RESULT_COLUMNS[:14]
+    if values['dose_slope'] is not None:
+        header += ["Dose-response Slope", "Dose-response Std. Error",
+                   "Dose-response P value (right-tailed)"]
+        columns += RESULT_COLUMNS[14:17]
+    if permutations > 0:
+        header += [f"T-test P value ({permutations} permutations)",
+                   f"RankSum-test P value ({permutations} permutations)"]
+        columns += RESULT_COLUMNS[17:]
+    # format each column at once, then join the rows
+    _write_table(path, header, [_format_column(values[attr])
+                                for attr, _, _ in columns])
+
+
+def write_mamotif_pair_results(path, results, correction):
+    """Write the MAmotif results of motif pairs.
+
+    The same as `write_mamotif_results`, with the two motif names of each
+    pair in the first two columns.
+
+    Parameters
+    ----------
+    results : `mamotif.integration.MAmotifPairResults`
+        The results of the motif pairs.
+
+    Other parameters are the same as `write_mamotif_results`.
+    """
+    if path.endswith('.parquet'):
+        _write_parquet(path, _result_columns(results, PAIR_COLUMNS),
+                       PAIR_COLUMNS, {'correction': correction})
+        return
+    logger.info(f"Saving MAmotif motif pair results to {path}")
+    header = ["Motif A", "Motif B"] + _stat_headers(correction)
+    values = _result_columns(results, PAIR_COLUMNS)
+    _write_table(path, header, [_format_column(values[attr])
+                                for attr, _, _ in PAIR_COLUMNS])
+
+
+def _write_parquet(path, values, columns, metadata):
+    """Write result columns as a Parquet table with a stable schema."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow is required to write Parquet outputs, "
+                          "please install it with `pip install pyarrow`") \
+            from None
+    logger.info(f"Saving MAmotif results to {path}")
+    n_rows = len(values[columns[0][0]])
+    types = {'string': pa.string(), 'int64': pa.int64(),
+             'float64': pa.float64()}
+    fields = []
+    arrays = []
+    for attr, name, dtype in columns:
+        fields.append(pa.field(name, types[dtype]))
+        if values[attr] is None:
+            arrays.append(pa.nulls(n_rows, type=types[dtype]))
+        elif dtype == 'string':
+            arrays.append(pa.array(values[attr].tolist(), type=pa.string()))
+        else:
+            arrays.append(pa.array(values[attr].astype(dtype)))
+    metadata = dict(metadata,
+                    mamotif_schema_version=str(PARQUET_SCHEMA_VERSION))
+    schema = pa.schema(fields, metadata=metadata)
+    pq.write_table(pa.Table.from_arrays(arrays, schema=schema), path)
+
+
+def write_mamotif_results_parquet(path, results, correction, permutations=0):
+    """Write the MAmotif results of all motifs as a Parquet table.
+
+    The schema is stable: all columns of `RESULT_COLUMNS` are always
+    written, the dose-response columns are null if the regression is not
+    run and the permutation P values are null if no permutation is run.
+    The correction method, the number of permutations and the schema version
+    are stored in the schema metadata. Requires `pyarrow`.
+    """
+    _write_parquet(path, _result_columns(results), RESULT_COLUMNS,
+                   {'correction': correction,
+                    'permutations': str(permutations)})
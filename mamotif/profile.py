@@ -0,0 +1,212 @@
+"""
+mamotif.profile
+---------------
+
+Per-stage profiling of wall time, CPU time and peak memory.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import platform
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from mamotif import __version__
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# interval (seconds) of sampling the resident memory
+RSS_INTERVAL = 0.01
+PROFILE_REPORT = 'mamotif_profile.json'
+
+
+def _children_cpu_time():
+    """CPU time of the terminated child processes (e.g. process pools)."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _max_rss():
+    """Peak resident memory of the process so far, in bytes."""
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if platform.system() == 'Darwin' else max_rss * 1024
+
+
+def _current_rss():
+    """Current resident memory of the process in bytes, None if unknown."""
+    try:
+        with open('/proc/self/statm') as fin:
+            return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RssSampler(threading.Thread):
+    """Background thread sampling the resident memory of the process."""
+
+    def __init__(self, interval=RSS_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peaks = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def watch(self, key):
+        rss = _current_rss() or 0
+        with self._lock:
+            self.peaks[key] = rss
+
+    def unwatch(self, key):
+        self.sample()
+        with self._lock:
+            return self.peaks.pop(key)
+
+    def sample(self):
+        rss = _current_rss()
+        if rss is None:
+            return
+        with self._lock:
+            for key, peak in self.peaks.items():
+                if rss > peak:
+                    self.peaks[key] = rss
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class StageProfiler:
+    """Record the wall time, CPU time and peak memory of pipeline stages.
+
+    The peak memory of a stage is the peak resident memory of the process
+    while the stage runs, sampled by a background thread. Where the resident
+    memory cannot be sampled (non-Linux systems), the peak of the process so
+    far is reported instead. The CPU time includes the child processes
+    finished during the stage (e.g. the process pool of ``-j``). Stages run
+    concurrently (e.g. by `mamotif.scheduler.StageScheduler`) share the
+    process, their CPU time and memory overlap.
+
+    A stage run several times (e.g. once per sample) is accumulated: the
+    times are summed and the peak memory is the maximum.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        If False, stages are not recorded at all.
+    cprofile_stage : str, optional
+        Name of a stage to run under `cProfile`. Only the calling process is
+        profiled, use one process (``-j 1``) to profile the work of a pool.
+        Concurrent runs of the stage are not profiled, only the first one.
+    """
+
+    def __init__(self, enabled=True, cprofile_stage=None):
+        self.enabled = enabled
+        self.cprofile_stage = cprofile_stage
+        self.stages = {}
+        self.cprofiles = []
+        self._cprofile_running = False
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._start_time = time.perf_counter()
+        if enabled and _current_rss() is not None:
+            self._sampler = _RssSampler()
+            self._sampler.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager to record a stage."""
+        if not self.enabled:
+            yield
+            return
+        key = object()
+        if self._sampler is not None:
+            self._sampler.watch(key)
+        profile = None
+        if name == self.cprofile_stage:
+            with self._lock:
+                # only one profiler can be active in a process
+                if not self._cprofile_running:
+                    self._cprofile_running = True
+                    profile = cProfile.Profile()
+            if profile is None:
+                logger.warning(f"Stage {name!r} is already profiled in "
+                               f"another thread, skip cProfile")
+            else:
+                profile.enable()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time() + _children_cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() + _children_cpu_time() - cpu_start
+            if profile is not None:
+                profile.disable()
+                with self._lock:
+                    self.cprofiles.append(profile)
+                    self._cprofile_running = False
+            if self._sampler is not None:
+                peak = self._sampler.unwatch(key)
+            else:
+                peak = _max_rss()
+            self._record(name, wall, cpu, peak)
+
+    def _record(self, name, wall, cpu, peak):
+        with self._lock:
+            record = self.stages.setdefault(
+                name, {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                       'peak_memory_mb': 0.0})
+            record['calls'] += 1
+            record['wall_time'] += wall
+            record['cpu_time'] += cpu
+            record['peak_memory_mb'] = max(record['peak_memory_mb'],
+                                           peak / 1024 / 1024)
+        logger.debug(f"Stage {name!r}: {wall:.2f}s wall, {cpu:.2f}s CPU, "
+                     f"{peak / 1024 / 1024:.1f}MB peak memory")
+
+    def report(self):
+        """Return the profiling report as a dict."""
+        return {'mamotif': __version__,
+                'wall_time': time.perf_counter() - self._start_time,
+                'max_rss_mb': _max_rss() / 1024 / 1024,
+                'stages': {name: dict(record)
+                           for name, record in self.stages.items()}}
+
+    def write(self, output_dir):
+        """Write the JSON report (and the cProfile dump) to `output_dir`.
+
+        Returns
+        -------
+        str
+            Path of the JSON report.
+        """
+        if self._sampler is not None:
+            self._sampler.stop()
+        path = os.path.join(output_dir, PROFILE_REPORT)
+        logger.info(f"Saving the profiling report to {path}")
+        with open(path, 'w') as fout:
+            json.dump(self.report(), fout, indent=2)
+        if self.cprofiles:
+            f_cprofile = os.path.join(
+                output_dir, f'mamotif_profile_{self.cprofile_stage}.prof')
+            logger.info(f"Saving the cProfile stats of stage "
+                        f"{self.cprofile_stage!r} to {f_cprofile}")
+            pstats.Stats(*self.cprofiles).dump_stats(f_cprofile)
+        return path
@@ -0,0 +1,240 @@
+"""
+mamotif.promoter
+----------------
+
+Interval indexes to classify genomic regions by genomic context (promoters,
+distances to TSSs and other annotations).
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from mamotif.io import open_file
+
+logger = logging.getLogger(__name__)
+
+# chromosomes are laid out on one axis with this stride between them
+CHROM_STRIDE = 2 ** 40
+
+
+def gene_annotation_path(genome):
+    """Return the path of the gene annotation file of a MotifScan genome."""
+    # deferred, importing `motifscan.genome` pulls in pysam
+    from motifscan.config import Config
+    from motifscan.exceptions import GenomeFileNotFoundError
+    from motifscan.genome import gene_path_fmt
+    path = gene_path_fmt.format(Config().get_genome_path(genome), genome)
+    if not os.path.isfile(path):
+        raise GenomeFileNotFoundError(genome, 'gene annotation')
+    return path
+
+
+def read_tss(path):
+    """Read the TSSs and strands of genes from a refGene annotation file.
+
+    Returns
+    -------
+    chroms : list of str
+        Chromosome of each gene.
+    tss : ndarray of int64
+        TSS of each gene.
+    forward : ndarray of bool
+        Whether each gene is on the forward strand.
+    """
+    chroms = []
+    tss = []
+    forward = []
+    with open_file(path, 'rt') as fin:
+        for line in fin:
+            fields = line.split()
+            if not fields:
+                continue
+            strand = fields[3]
+            if strand == '+':
+                tss.append(int(fields[4]))
+            elif strand == '-':
+                tss.append(int(fields[5]))
+            else:
+                raise ValueError(f"Invalid strand {strand!r} detected at "
+                                 f"line: {line.strip()}")
+            chroms.append(fields[2])
+            forward.append(strand == '+')
+    return chroms, np.array(tss, dtype=np.int64), np.array(forward, bool)
+
+
+def _axis_codes(chroms, index_chroms):
+    """Map chromosome names to their positions on a coordinate axis.
+
+    Chromosomes not on the axis are mapped beyond all chromosomes of it.
+    """
+    codes = {chrom: idx for idx, chrom in enumerate(index_chroms)}
+    return np.array([codes.get(chrom, len(index_chroms) + 1)
+                     for chrom in chroms], dtype=np.int64)
+
+
+def _region_coordinates(regions, index_chroms):
+    """Return the starts/ends of regions on the coordinate axis."""
+    offsets = _axis_codes(regions.chroms, index_chroms)[
+        regions.chrom_codes] * CHROM_STRIDE
+    return offsets + regions.starts, offsets + regions.ends
+
+
+class IntervalIndex:
+    """Sorted disjoint genomic intervals, e.g. merged promoters or peaks.
+
+    All chromosomes are laid out on one coordinate axis (separated by
+    `CHROM_STRIDE`), so that the regions of all chromosomes are classified
+    with a single `numpy.searchsorted` pass.
+
+    Parameters
+    ----------
+    chroms : list of str
+        Chromosome names, in the order of the coordinate axis.
+    starts : ndarray of int64
+        Sorted start coordinates of the disjoint intervals, on the
+        coordinate axis.
+    ends : ndarray of int64
+        End coordinates of the intervals, on the coordinate axis.
+    """
+
+    def __init__(self, chroms, starts, ends):
+        self.chroms = list(chroms)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_intervals(cls, chroms, starts, ends):
+        """Build the index from (possibly overlapping) intervals.
+
+        Parameters
+        ----------
+        chroms : list of str
+            Chromosome of each interval.
+        starts, ends : array_like of int
+            Start/end coordinates of each interval on its chromosome.
+        """
+        names = sorted(set(chroms))
+        offsets = _axis_codes(chroms, names) * CHROM_STRIDE
+        starts = offsets + np.asarray(starts, dtype=np.int64)
+        ends = offsets + np.asarray(ends, dtype=np.int64)
+        order = np.argsort(starts, kind='mergesort')
+        starts, ends = starts[order], ends[order]
+        # merge overlapping intervals: a new interval begins where the start
+        # is beyond all previous ends
+        if len(starts):
+            max_ends = np.maximum.accumulate(ends)
+            first = np.ones(len(starts), dtype=bool)
+            first[1:] = starts[1:] > max_ends[:-1]
+            ends = np.maximum.reduceat(ends, np.flatnonzero(first))
+            starts = starts[first]
+        return cls(names, starts, ends)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['chroms'].tolist(), data['starts'], data['ends'])
+
+    def save(self, path):
+        with open(path, 'wb') as fout:
+            np.savez(fout, chroms=np.array(self.chroms, dtype=str),
+                     starts=self.starts, ends=self.ends)
+
+    def classify(self, regions):
+        """Return whether each region overlaps with any interval.
+
+        Parameters
+        ----------
+        regions : `RegionTable`
+            Genomic regions to be classified.
+
+        Returns
+        -------
+        ndarray of bool
+            Boolean mask of the overlapping regions.
+        """
+        if len(self) == 0:
+            return np.zeros(len(regions), dtype=bool)
+        starts, ends = _region_coordinates(regions, self.chroms)
+        # the last interval starting before the region end is the only one
+        # that may overlap with it, as the intervals are disjoint and sorted
+        idx = np.searchsorted(self.starts, ends, side='left') - 1
+        return (idx >= 0) & (self.ends[np.maximum(idx, 0)] > starts)
+
+
+class PromoterIndex(IntervalIndex):
+    """Merged promoter intervals of all genes, see `IntervalIndex`."""
+
+    @classmethod
+    def from_tss(cls, chroms, tss, forward, upstream=4000, downstream=2000):
+        """Build the index from the TSSs/strands of genes.
+
+        See `read_tss` for the parameters, `upstream`/`downstream` are the
+        TSS distances to define promoters.
+        """
+        tss = np.asarray(tss, dtype=np.int64)
+        forward = np.asarray(forward, dtype=bool)
+        return cls.from_intervals(
+            chroms, tss - np.where(forward, upstream, downstream),
+            tss + np.where(forward, downstream, upstream))
+
+    @classmethod
+    def from_gene_file(cls, path, upstream=4000, downstream=2000):
+        """Build the index from a refGene annotation file."""
+        chroms, tss, forward = read_tss(path)
+        return cls.from_tss(chroms, tss, forward, upstream=upstream,
+                            downstream=downstream)
+
+
+class TssIndex:
+    """Sorted TSSs of all genes on one coordinate axis.
+
+    Parameters
+    ----------
+    chroms : list of str
+        Chromosome names, in the order of the coordinate axis.
+    tss : ndarray of int64
+        Sorted TSS coordinates, on the coordinate axis.
+    """
+
+    def __init__(self, chroms, tss):
+        self.chroms = list(chroms)
+        self.tss = np.asarray(tss, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.tss)
+
+    @classmethod
+    def from_gene_file(cls, path):
+        """Build the index from a refGene annotation file."""
+        chroms, tss, _ = read_tss(path)
+        names = sorted(set(chroms))
+        tss = _axis_codes(chroms, names) * CHROM_STRIDE + tss
+        return cls(names, np.sort(tss))
+
+    def distances(self, regions):
+        """Return the distance of each region to its nearest TSS.
+
+        The distance is 0 if a TSS is within the region, and `numpy.inf` if
+        there is no TSS on the chromosome of the region.
+        """
+        distances = np.full(len(regions), np.inf)
+        if len(self) == 0:
+            return distances
+        starts, ends = _region_coordinates(regions, self.chroms)
+        # nearest TSSs before the region start and at/after it
+        right = np.searchsorted(self.tss, starts, side='left')
+        left = right - 1
+        right_tss = self.tss[np.minimum(right, len(self) - 1)]
+        left_tss = self.tss[np.maximum(left, 0)]
+        with np.errstate(invalid='ignore'):
+            to_right = np.where(right < len(self),
+                                np.maximum(right_tss - ends + 1, 0), np.inf)
+            to_left = np.where(left >= 0, starts - left_tss, np.inf)
+        nearest = np.minimum(to_left, to_right)
+        # TSSs on other chromosomes are far beyond the stride
+        return np.where(nearest < CHROM_STRIDE, nearest, np.inf)
@@ -7,7 +7,10 @@ Genomic regions use in MAmotif.
 import logging
 
 import numpy as np
-from motifscan.region import load_motifscan_regions
+from scipy import sparse
+
+from mamotif.io import read_manorm_values, read_motif_sites_number
+from mamotif.profile import StageProfiler
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +41,8 @@ class MamotifRegion:
         The end coordinate of the region.
     m_value : float or None
         The m_value of the region or None if not specified.
+    n_sites : ndarray of int
+        The motif sites numbers of the region.
     has_motif : list of bool
         The target site indicators for motifs.
 
@@ -51,7 +56,8 @@ class MamotifRegion:
         self.start = int(start)
         self.end = int(end)
         self.m_value = m_value
-        self.has_motif = np.asarray(n_sites) > 0
+        self.n_sites = np.asarray(n_sites)
+        self.has_motif = self.n_sites > 0
 
     def match_manorm(self, manorm_regions):
         for region in manorm_regions:
@@ -66,40 +72,492 @@ class MamotifRegion:
         return f"GenomicRegion({self.chrom}:{self.start}-{self.end})"
 
 
-def load_mamotif_regions(f_manorm, f_motifscan):
-    logger.info("Loading MAnorm result")
-    manorm_regions = load_motifscan_regions(f_manorm, 'manorm')
-    logger.info("Loading MotifScan result")
-    logger.info(f"Loading genomic regions from {f_motifscan} [motifscan]")
-    regions = []
-    with open(f_motifscan, 'r') as fin:
-        line = fin.readline()
-        header = line.strip().split('\t')
-        if header[:3] != ['chr', 'start', 'end']:
+class PackedPresence:
+    """Bit-packed motif presence matrix.
+
+    The presence indicators of 8 motifs are packed into one byte in the
+    `numpy.packbits` layout (along the motif axis), the packed bits can be
+    memory-mapped from a `.npy` file. Column blocks are unpacked on the fly
+    when computing per-motif statistics.
+
+    Parameters
+    ----------
+    bits : (n_regions, ceil(n_motifs / 8)) array_like of uint8
+        The packed presence bits.
+    n_motifs : int
+        The number of motifs.
+    """
+
+    def __init__(self, bits, n_motifs):
+        self.bits = bits if isinstance(bits, np.ndarray) else np.asarray(
+            bits, dtype=np.uint8)
+        self.n_motifs = int(n_motifs)
+        if self.bits.ndim != 2 or \
+                self.bits.shape[1] != (self.n_motifs + 7) // 8:
             raise ValueError(
-                "not a valid MotifScan motif_sites_number.xls file")
-        motifs = header[3:]
-        for line in fin:
-            fields = line.strip().split('\t')
-            chrom = fields[0]
-            start = int(fields[1]) - 1
-            end = int(fields[2])
-            n_sites = list(map(int, fields[3:]))
-            region = MamotifRegion(chrom=chrom, start=start, end=end,
-                                   n_sites=n_sites)
-            regions.append(region)
-    logger.info(f"Loaded {len(regions)} genomic regions")
-
-    logger.info("Matching MAnorm and MotifScan results")
-    if len(manorm_regions) != len(regions):
-        logger.warning("the number of genomic regions are unmatched!")
-    # group manorm regions by chrom to match with motifscan
-    manorm_regions_by_chrom = {}
-    for region in manorm_regions:
-        manorm_regions_by_chrom.setdefault(region.chrom, [])
-        manorm_regions_by_chrom[region.chrom].append(region)
-
-    # find the matched manorm region and set the M value
-    for region in regions:
-        region.match_manorm(manorm_regions_by_chrom[region.chrom])
+                f"expect packed bits of {(self.n_motifs + 7) // 8} columns "
+                f"for {self.n_motifs} motifs, got shape {self.bits.shape}")
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self.n_motifs
+
+    def __len__(self):
+        return self.bits.shape[0]
+
+    def __getitem__(self, idx):
+        """Return the unpacked presence indicators of the `idx`-th region."""
+        return np.unpackbits(self.bits[idx])[:self.n_motifs].view(bool)
+
+    @classmethod
+    def from_dense(cls, presence, path=None, block_size=65536):
+        """Pack a dense presence matrix, optionally into a `.npy` file.
+
+        Parameters
+        ----------
+        presence : (n_regions, n_motifs) array_like of bool
+            The dense presence matrix.
+        path : str, optional
+            If specified, the packed bits are written into this `.npy` file
+            and memory-mapped.
+        block_size : int, optional
+            Number of regions packed per block.
+        """
+        presence = np.asarray(presence)
+        n_regions, n_motifs = presence.shape
+        shape = (n_regions, (n_motifs + 7) // 8)
+        if path is None:
+            bits = np.empty(shape, dtype=np.uint8)
+        else:
+            bits = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                             shape=shape)
+        for start in range(0, n_regions, block_size):
+            end = min(start + block_size, n_regions)
+            bits[start:end] = np.packbits(presence[start:end] > 0, axis=1)
+        if path is not None:
+            bits.flush()
+        return cls(bits, n_motifs)
+
+    @classmethod
+    def load(cls, path, n_motifs, mmap_mode='r'):
+        """Load the packed bits from a `.npy` file (memory-mapped)."""
+        return cls(np.load(path, mmap_mode=mmap_mode), n_motifs)
+
+    def save(self, path):
+        """Save the packed bits into a `.npy` file."""
+        np.save(path, self.bits)
+
+    def column_block(self, start, end):
+        """Unpack the presence indicators of motifs in [start, end)."""
+        byte_start = start // 8
+        byte_end = (end + 7) // 8
+        block = np.unpackbits(self.bits[:, byte_start:byte_end], axis=1)
+        offset = start - byte_start * 8
+        return block[:, offset:offset + end - start].view(bool)
+
+    def to_dense(self):
+        """Unpack the full presence matrix."""
+        return self.column_block(0, self.n_motifs)
+
+    def take(self, indices, block_size=65536):
+        """Return the packed presence matrix of the selected motifs.
+
+        The regions are unpacked and repacked block by block, so only the
+        packed copy of the selected motifs is kept in memory.
+        """
+        indices = np.asarray(indices, dtype=int)
+        n_regions = self.bits.shape[0]
+        bits = np.empty((n_regions, (len(indices) + 7) // 8), dtype=np.uint8)
+        for start in range(0, n_regions, block_size):
+            end = min(start + block_size, n_regions)
+            block = np.unpackbits(self.bits[start:end], axis=1)
+            bits[start:end] = np.packbits(block[:, indices], axis=1)
+        return PackedPresence(bits, len(indices))
+
+
+def _stack_rows(blocks, shape):
+    """Stack blocks of rows (dense or sparse) into a CSC matrix."""
+    blocks = [sparse.csr_matrix(block) for block in blocks]
+    if not blocks:
+        return sparse.csc_matrix(shape, dtype=bool)
+    return sparse.vstack(blocks, format='csr').tocsc()
+
+
+class SparsePresence:
+    """Sparse motif presence matrix.
+
+    Only the motif hits are stored, as the pattern of a
+    `scipy.sparse.csc_matrix` with one column per motif, so the memory and
+    the per-motif sums (see `transpose_dot`) scale with the number of hits
+    instead of regions x motifs. This pays off for low-density motif sets,
+    e.g. scans of long motifs with a stringent P value cutoff.
+
+    Parameters
+    ----------
+    matrix : (n_regions, n_motifs) sparse matrix or array_like
+        The motif presence indicators (or site numbers) of each region,
+        nonzero entries are hits. The index arrays of a CSC matrix are
+        shared, not copied.
+    """
+
+    def __init__(self, matrix):
+        matrix = sparse.csc_matrix(matrix)
+        matrix.eliminate_zeros()
+        self.matrix = sparse.csc_matrix(
+            (np.ones(matrix.nnz, dtype=bool), matrix.indices, matrix.indptr),
+            shape=matrix.shape)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def nnz(self):
+        """The number of motif hits."""
+        return self.matrix.nnz
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __getitem__(self, idx):
+        """Return the presence indicators of the `idx`-th region."""
+        return self.matrix[idx].toarray().ravel()
+
+    @classmethod
+    def from_dense(cls, presence, block_size=65536):
+        """Build a sparse presence matrix from a dense one.
+
+        Parameters
+        ----------
+        presence : array_like of bool or `PackedPresence`
+            The (n_regions, n_motifs) dense (or packed) presence matrix.
+        block_size : int, optional
+            Number of regions converted per block.
+        """
+        if isinstance(presence, PackedPresence):
+            bits = presence.bits
+            n_motifs = presence.n_motifs
+            rows = (np.unpackbits(bits[start:start + block_size],
+                                  axis=1)[:, :n_motifs]
+                    for start in range(0, len(bits), block_size))
+        else:
+            presence = np.asarray(presence)
+            rows = (presence[start:start + block_size] > 0
+                    for start in range(0, len(presence), block_size))
+        return cls(_stack_rows(rows, presence.shape))
+
+    @classmethod
+    def load(cls, path):
+        """Load the presence matrix from a `.npz` file."""
+        return cls(sparse.load_npz(path))
+
+    def save(self, path):
+        """Save the presence matrix into a `.npz` file."""
+        sparse.save_npz(path, self.matrix)
+
+    def column_block(self, start, end):
+        """Return the dense presence indicators of motifs in [start, end)."""
+        return self.matrix[:, start:end].toarray()
+
+    def to_dense(self):
+        """Return the full dense presence matrix."""
+        return self.matrix.toarray()
+
+    def to_packed(self, path=None, block_size=65536):
+        """Return the bit-packed presence matrix, see
+        `PackedPresence.from_dense`."""
+        n_regions, n_motifs = self.shape
+        shape = (n_regions, (n_motifs + 7) // 8)
+        if path is None:
+            bits = np.empty(shape, dtype=np.uint8)
+        else:
+            bits = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                             shape=shape)
+        rows = self.matrix.tocsr()
+        for start in range(0, n_regions, block_size):
+            end = min(start + block_size, n_regions)
+            bits[start:end] = np.packbits(rows[start:end].toarray(), axis=1)
+        if path is not None:
+            bits.flush()
+        return PackedPresence(bits, n_motifs)
+
+    def take(self, indices):
+        """Return the sparse presence matrix of the selected motifs."""
+        return SparsePresence(self.matrix[:, np.asarray(indices, dtype=int)])
+
+    def transpose_dot(self, values):
+        """Compute ``presence.T @ values`` over the motif hits only."""
+        return self.matrix.T @ np.asarray(values, dtype=float)
+
+
+class RegionTable:
+    """Columnar table of MAmotif genomic regions.
+
+    Parameters
+    ----------
+    motifs : list of str
+        The motif names.
+    chroms : list of str
+        The chromosome names, indexed by `chrom_codes`.
+    chrom_codes : array_like of int
+        The chromosome code of each region.
+    starts : array_like of int
+        The start coordinates of the regions.
+    ends : array_like of int
+        The end coordinates of the regions.
+    presence : (n_regions, n_motifs) array_like of bool, `PackedPresence` or
+        `SparsePresence`
+        The target site indicators of motifs for each region.
+    m_values : array_like of float, optional
+        The M values of the regions. If not specified, M values are set to NaN
+        and should be filled in later (e.g. by `match_manorm_regions`).
+    site_counts : (n_regions, n_motifs) array_like of int, optional
+        The motif site numbers of each region (dense or a `scipy.sparse`
+        matrix), only needed by the dose-response regression (see
+        `mamotif.stats.dose_response`).
+
+    Notes
+    -----
+    The coordinates are 0-based, which means the region range is [start, end).
+    """
+
+    def __init__(self, motifs, chroms, chrom_codes, starts, ends, presence,
+                 m_values=None, site_counts=None):
+        self.motifs = list(motifs)
+        self.chroms = list(chroms)
+        self.chrom_codes = np.asarray(chrom_codes, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        if isinstance(presence, (PackedPresence, SparsePresence)):
+            self.presence = presence
+        else:
+            self.presence = np.ascontiguousarray(presence, dtype=bool)
+        if m_values is None:
+            self.m_values = np.full(len(self.starts), np.nan)
+        else:
+            self.m_values = np.asarray(m_values, dtype=np.float64)
+        n_regions = len(self.starts)
+        if self.presence.shape != (n_regions, len(self.motifs)):
+            raise ValueError(
+                f"expect presence matrix of shape "
+                f"{(n_regions, len(self.motifs))}, got {self.presence.shape}")
+        self.site_counts = site_counts if site_counts is None or isinstance(
+            site_counts, np.ndarray) or sparse.issparse(site_counts) \
+            else np.asarray(site_counts)
+        if self.site_counts is not None and \
+                self.site_counts.shape != self.presence.shape:
+            raise ValueError(
+                f"expect site counts of shape {self.presence.shape}, got "
+                f"{self.site_counts.shape}")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return (f"RegionTable({len(self)} regions, "
+                f"{len(self.motifs)} motifs)")
+
+    @classmethod
+    def from_regions(cls, motifs, regions):
+        """Build a region table from a list of `MamotifRegion`."""
+        chroms = {}
+        chrom_codes = np.empty(len(regions), dtype=np.int32)
+        starts = np.empty(len(regions), dtype=np.int64)
+        ends = np.empty(len(regions), dtype=np.int64)
+        m_values = np.empty(len(regions), dtype=np.float64)
+        site_counts = np.empty((len(regions), len(motifs)), dtype=np.int64)
+        for idx, region in enumerate(regions):
+            chrom_codes[idx] = chroms.setdefault(region.chrom, len(chroms))
+            starts[idx] = region.start
+            ends[idx] = region.end
+            m_values[idx] = np.nan if region.m_value is None \
+                else region.m_value
+            site_counts[idx] = region.n_sites
+        return cls(motifs=motifs, chroms=list(chroms),
+                   chrom_codes=chrom_codes, starts=starts, ends=ends,
+                   presence=site_counts > 0, m_values=m_values,
+                   site_counts=site_counts)
+
+    def region(self, idx):
+        """Return the `idx`-th region as a `MamotifRegion`."""
+        if self.site_counts is None:
+            n_sites = self.presence[idx]
+        elif sparse.issparse(self.site_counts):
+            n_sites = self.site_counts[idx].toarray().ravel()
+        else:
+            n_sites = self.site_counts[idx]
+        region = MamotifRegion(chrom=self.chroms[self.chrom_codes[idx]],
+                               start=self.starts[idx], end=self.ends[idx],
+                               n_sites=n_sites)
+        if not np.isnan(self.m_values[idx]):
+            region.m_value = float(self.m_values[idx])
+        return region
+
+    def chrom_indices(self):
+        """Yield each chromosome name with the indices of its regions."""
+        # group the regions of all chromosomes in one pass
+        order = np.argsort(self.chrom_codes, kind='stable')
+        bounds = np.zeros(len(self.chroms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.chrom_codes, minlength=len(self.chroms)),
+                  out=bounds[1:])
+        for code, chrom in enumerate(self.chroms):
+            yield chrom, order[bounds[code]:bounds[code + 1]]
+
+
+def load_mamotif_regions(f_manorm, f_motifscan, packed=False,
+                         site_counts=False, sparse_presence=False,
+                         profiler=None):
+    """Load the MotifScan regions matched with the MAnorm M values.
+
+    Parameters
+    ----------
+    f_manorm : str
+        Path of the MAnorm `*_MAvalues.xls` file.
+    f_motifscan : str
+        Path of the MotifScan `motif_sites_number.xls` file.
+    packed : bool, optional
+        If True, keep the presence matrix bit-packed, see `PackedPresence`.
+    site_counts : bool, optional
+        If True, also keep the motif site numbers, e.g. for the
+        dose-response regression.
+    sparse_presence : bool, optional
+        If True, keep the presence matrix (and the site numbers) sparse, see
+        `SparsePresence`.
+    profiler : `mamotif.profile.StageProfiler`, optional
+        Profiler to record the stages: 'parse' (reading both files) and
+        'match' (matching the MotifScan regions with the MAnorm regions).
+
+    Returns
+    -------
+    motifs : list of str
+        The motif names.
+    regions : `RegionTable`
+        The matched regions.
+    """
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+    with profiler.stage('parse'):
+        motifs, manorm_regions, regions = _parse_regions(
+            f_manorm, f_motifscan, packed=packed, site_counts=site_counts,
+            sparse_presence=sparse_presence)
+    with profiler.stage('match'):
+        logger.info("Matching MAnorm and MotifScan results")
+        if len(manorm_regions) != len(regions):
+            logger.warning("the number of genomic regions are unmatched!")
+        match_manorm_regions(regions, manorm_regions)
     return motifs, regions
+
+
+def _parse_regions(f_manorm, f_motifscan, packed, site_counts,
+                   sparse_presence):
+    """Read the MAnorm and MotifScan regions, see `load_mamotif_regions`."""
+    logger.info("Loading MAnorm result")
+    chroms, chrom_codes, starts, ends, m_values = read_manorm_values(f_manorm)
+    manorm_regions = RegionTable(
+        motifs=[], chroms=chroms, chrom_codes=chrom_codes, starts=starts,
+        ends=ends, presence=np.empty((len(starts), 0), dtype=bool),
+        m_values=m_values)
+    logger.info("Loading MotifScan result")
+    count_chunks = []
+
+    def _presence(counts):
+        if sparse_presence:  # only keep the hits of each chunk
+            count_chunks.append(sparse.csr_matrix(counts))
+            return np.empty((len(counts), 0), dtype=bool)
+        if site_counts:
+            count_chunks.append(counts)
+        if packed:  # pack each chunk, never hold the dense presence matrix
+            return np.packbits(counts > 0, axis=1)
+        return counts > 0
+
+    motifs, chroms, chrom_codes, starts, ends, presence = \
+        read_motif_sites_number(f_motifscan, transform=_presence)
+    counts = None
+    if sparse_presence:
+        counts = _stack_rows(count_chunks, (len(starts), len(motifs)))
+        presence = SparsePresence(counts)
+        if not site_counts:
+            counts = None
+    elif packed:
+        presence = PackedPresence(presence, len(motifs))
+    if site_counts and counts is None:
+        counts = np.concatenate(count_chunks) if count_chunks else \
+            np.zeros(presence.shape, dtype=np.uint8)
+    regions = RegionTable(motifs=motifs, chroms=chroms,
+                          chrom_codes=chrom_codes, starts=starts, ends=ends,
+                          presence=presence, site_counts=counts)
+    return motifs, manorm_regions, regions
+
+
+def _format_examples(regions, limit=5):
+    examples = ', '.join(repr(region) for region in regions[:limit])
+    if len(regions) > limit:
+        examples += ', ...'
+    return examples
+
+
+def match_manorm_regions(regions, manorm_regions):
+    """Set the M values of MotifScan regions from the matched MAnorm regions.
+
+    MAnorm regions are indexed by ``(chrom, start, end)`` so that matching
+    runs in linear time. Unmatched and duplicated regions are collected and
+    reported together.
+
+    Parameters
+    ----------
+    regions : `RegionTable`
+        MotifScan regions to set the M values for.
+    manorm_regions : `RegionTable`
+        MAnorm regions with M values.
+
+    Raises
+    ------
+    ValueError
+        If any MotifScan region has no matched MAnorm region.
+    """
+    index = {}
+    duplicated = []
+    for chrom, indices in manorm_regions.chrom_indices():
+        for idx, start, end, m_value in zip(
+                indices, manorm_regions.starts[indices].tolist(),
+                manorm_regions.ends[indices].tolist(),
+                manorm_regions.m_values[indices].tolist()):
+            key = (chrom, start, end)
+            if key in index:
+                duplicated.append(idx)
+            else:
+                index[key] = m_value
+    if duplicated:
+        duplicated = [manorm_regions.region(idx)
+                      for idx in sorted(duplicated)]
+        logger.warning(
+            f"found {len(duplicated)} duplicated MAnorm regions, the M value "
+            f"of the first occurrence is used: "
+            f"{_format_examples(duplicated)}")
+
+    seen = set()
+    duplicated = []
+    unmatched = []
+    m_values = regions.m_values
+    for chrom, indices in regions.chrom_indices():
+        for idx, start, end in zip(indices, regions.starts[indices].tolist(),
+                                   regions.ends[indices].tolist()):
+            key = (chrom, start, end)
+            if key in seen:
+                duplicated.append(idx)
+            else:
+                seen.add(key)
+            m_value = index.get(key)
+            if m_value is None:
+                unmatched.append(idx)
+            else:
+                m_values[idx] = m_value
+    if duplicated:
+        duplicated = [regions.region(idx) for idx in sorted(duplicated)]
+        logger.warning(f"found {len(duplicated)} duplicated MotifScan "
+                       f"regions: {_format_examples(duplicated)}")
+    if unmatched:
+        unmatched = [regions.region(idx) for idx in sorted(unmatched)]
+        raise ValueError(
+            f"no matched MAnorm region found for {len(unmatched)} MotifScan "
+            f"regions: {_format_examples(unmatched)}")
@@ -0,0 +1,139 @@
+"""
+mamotif.scheduler
+-----------------
+
+A small dependency-graph scheduler to run workflow stages concurrently.
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """Class for a workflow stage.
+
+    Parameters
+    ----------
+    name : str
+        The unique name of the stage.
+    func : callable
+        The function to run the stage. It is called with a dict of the
+        results of finished stages (keyed by stage name) and its return value
+        is recorded as the result of the stage.
+    deps : list of str, optional
+        Names of the stages that must finish before this stage starts.
+    """
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def elapsed(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+class StageScheduler:
+    """Run workflow stages as soon as their dependencies are finished.
+
+    Independent stages run concurrently in a thread pool, heavy stages are
+    expected to release the GIL or run their own processes (e.g. MotifScan).
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Maximal number of stages running at the same time.
+    profiler : `mamotif.profile.StageProfiler`, optional
+        Profiler to record the resource usage of each stage.
+    """
+
+    def __init__(self, max_workers=None, profiler=None):
+        self.max_workers = max_workers
+        self.profiler = profiler
+        self.stages = {}
+        self.results = {}
+
+    def add(self, name, func, deps=()):
+        """Add a stage, see `Stage` for the parameters."""
+        if name in self.stages:
+            raise ValueError(f"duplicated stage name: {name!r}")
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"unknown dependency of stage {name!r}: "
+                                 f"{dep!r}")
+        self.stages[name] = Stage(name, func, deps)
+
+    def _run_stage(self, stage):
+        logger.debug(f"Stage {stage.name!r} started")
+        stage.start_time = time.perf_counter()
+        try:
+            if self.profiler is None:
+                return stage.func(self.results)
+            with self.profiler.stage(stage.name):
+                return stage.func(self.results)
+        finally:
+            stage.end_time = time.perf_counter()
+            logger.info(f"Stage {stage.name!r} finished in "
+                        f"{stage.elapsed:.2f}s")
+
+    def run(self):
+        """Run all stages and return their results keyed by stage name.
+
+        If any stage fails, no more stages are started and the first error is
+        raised after the running stages are finished.
+        """
+        start_time = time.perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(dep in self.results for dep in stage.deps):
+                            future = executor.submit(self._run_stage, stage)
+                            running[future] = stage
+                            del pending[name]
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        self.results[stage.name] = future.result()
+                    except Exception as e:
+                        logger.error(f"Stage {stage.name!r} failed: {e}")
+                        if error is None:
+                            error = e
+        if error is not None:
+            raise error
+        logger.info(f"All stages finished in "
+                    f"{time.perf_counter() - start_time:.2f}s, critical "
+                    f"path: {self.format_critical_path()}")
+        return self.results
+
+    def critical_path(self):
+        """Return the chain of stages which determines the total wall time."""
+        finished = [stage for stage in self.stages.values()
+                    if stage.end_time is not None]
+        if not finished:
+            return []
+        stage = max(finished, key=lambda x: x.end_time)
+        path = [stage]
+        while stage.deps:
+            stage = max((self.stages[dep] for dep in stage.deps),
+                        key=lambda x: x.end_time)
+            path.append(stage)
+        return path[::-1]
+
+    def format_critical_path(self):
+        return ' -> '.join(f"{stage.name} ({stage.elapsed:.2f}s)"
+                           for stage in self.critical_path())
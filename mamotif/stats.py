@@ -6,10 +6,16 @@ Statistical functions used in MAmotif.
 """
 
 import numpy as np
-from scipy import stats
+from scipy import sparse, special
+
+from mamotif.correction import adjust_p_values  # noqa: F401
+
+# upper bound of the temporary float buffer used by `presence_dot` (bytes)
+BLOCK_BYTES = 64 * 1024 * 1024
 
 
 def mamotif_t_test(m_values_pos, m_values_neg):
+    from scipy import stats
     try:
         t_stat, p_value = stats.ttest_ind(m_values_pos, m_values_neg,
                                           equal_var=False)
@@ -23,6 +29,7 @@ def mamotif_t_test(m_values_pos, m_values_neg):
 
 
 def mamotif_ranksum_test(m_values_pos, m_values_neg):
+    from scipy import stats
     try:
         z_stat, p_value = stats.ranksums(m_values_pos, m_values_neg)
         if z_stat < 0:
@@ -34,24 +41,627 @@ def mamotif_ranksum_test(m_values_pos, m_values_neg):
         return np.nan, np.nan
 
 
-def adjust_p_values(p_values, correction='benjamin'):
-    n = len(p_values)
-    adjusted_p_values = []
-    if correction == 'benjamin':
-        order = np.argsort(p_values)
-        ranks = np.empty_like(order)
-        ranks[order] = np.arange(1, n + 1)
-        for p_value, rank in zip(p_values, ranks):
-            if np.isnan(p_value):
-                adjusted_p_values.append(np.nan)
-            else:
-                adjusted_p_values.append(min(1, p_value * n / rank))
-    elif correction == 'bonferroni':
-        for p_value in p_values:
-            if np.isnan(p_value):
-                adjusted_p_values.append(np.nan)
-            else:
-                adjusted_p_values.append(min(1, p_value * n))
+def _column_blocks(presence):
+    """Return a function slicing motif columns of a presence matrix, and the
+    alignment of the block boundaries (packed bytes hold 8 motifs)."""
+    if hasattr(presence, 'column_block'):  # e.g. `PackedPresence`
+        return presence.column_block, 8
+    presence = np.asarray(presence)
+
+    def column_block(start, end):
+        return presence[:, start:end]
+
+    return column_block, 1
+
+
+def presence_dot(presence, values, block_size=None):
+    """Compute ``presence.T @ values`` for a boolean presence matrix.
+
+    The presence matrix is cast to float block by block (along the motif axis)
+    so that the temporary memory stays bounded for wide motif sets. Sparse
+    presence matrices are multiplied as they are, over the motif hits only.
+
+    Parameters
+    ----------
+    presence : (n_regions, n_motifs) array_like of bool, `PackedPresence` or
+        `SparsePresence`
+        Motif presence indicators of each region. Packed presence matrices
+        are unpacked block by block.
+    values : (n_regions,) or (n_regions, k) array_like
+        Values (e.g. M values) of each region.
+    block_size : int, optional
+        Number of motifs processed per block. If not specified, it is chosen
+        to keep the float buffer under `BLOCK_BYTES`.
+
+    Returns
+    -------
+    (n_motifs,) or (n_motifs, k) ndarray
+        Per-motif sums of the values over regions with the motif.
+    """
+    if hasattr(presence, 'transpose_dot'):  # e.g. `SparsePresence`
+        return presence.transpose_dot(values)
+    column_block, align = _column_blocks(presence)
+    values = np.asarray(values, dtype=float)
+    n_regions, n_motifs = np.shape(presence)
+    if block_size is None:
+        block_size = max(1, BLOCK_BYTES // (8 * max(n_regions, 1)))
+        block_size = max(align, block_size // align * align)
+    out = np.empty((n_motifs,) + values.shape[1:], dtype=float)
+    for start in range(0, n_motifs, block_size):
+        end = min(start + block_size, n_motifs)
+        block = column_block(start, end).astype(float)
+        out[start:end] = block.T @ values
+    return out
+
+
+def group_moments(presence, m_values, mask=None):
+    """Summarize the target/non-target M values of all motifs at once.
+
+    Per-motif counts, sums and sums of squares of the target group are
+    obtained from a single presence-matrix product, the non-target group is
+    then derived from the totals.
+
+    Parameters
+    ----------
+    presence : (n_regions, n_motifs) array_like of bool
+        Motif presence indicators of each region.
+    m_values : (n_regions,) array_like of float
+        M values of the regions.
+    mask : (n_regions,) array_like of bool, optional
+        If specified, only summarize the regions selected by the mask. The
+        presence matrix is not copied, unselected regions are given zero
+        weights instead.
+
+    Returns
+    -------
+    n_pos, mean_pos, var_pos, n_neg, mean_neg, var_neg : ndarray
+        Sizes, means and (population) variances of the target and non-target
+        groups of each motif. Means/variances of empty groups are NaN.
+    """
+    m_values = np.asarray(m_values, dtype=float)
+    weights = np.ones_like(m_values)
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        weights[~mask] = 0
+        selected = m_values[mask]
+    else:
+        selected = m_values
+    # center the M values to reduce the cancellation error of sum of squares
+    shift = selected.mean() if selected.size else 0.0
+    centered = np.where(weights > 0, m_values - shift, 0)
+    columns = np.column_stack([weights, centered, centered ** 2])
+    pos = presence_dot(presence, columns)
+    neg = columns.sum(axis=0) - pos
+    return _summarize(pos[:, :3], shift) + _summarize(neg[:, :3], shift)
+
+
+def _summarize(sums, shift):
+    """Sizes, means and variances from the weight/value/square sums."""
+    n, s, ss = sums[:, 0], sums[:, 1], sums[:, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = s / n
+        var = np.maximum(ss / n - mean ** 2, 0)
+    return np.rint(n).astype(int), mean + shift, var
+
+
+def grouped_statistics(presence, m_values, masks):
+    """Summarize the target/non-target groups of several region subsets.
+
+    The weights, centered M values, squares and within-subset ranks of all
+    subsets are stacked as the columns of one matrix, so the statistics of
+    all motifs in all subsets come from a single presence-matrix product.
+
+    Parameters
+    ----------
+    presence : (n_regions, n_motifs) array_like of bool, `PackedPresence` or
+        `SparsePresence`
+        Motif presence indicators of each region.
+    m_values : (n_regions,) array_like of float
+        M values of the regions.
+    masks : list of array_like of bool or None
+        Boolean masks of the regions of each subset, None for all regions.
+
+    Returns
+    -------
+    list of tuple
+        The ``(n_pos, mean_pos, var_pos, n_neg, mean_neg, var_neg,
+        rank_sum_pos, n_total, tie_sum)`` of each subset, see `group_moments`
+        and `ranksum_test`.
+    """
+    m_values = np.asarray(m_values, dtype=float)
+    columns = np.zeros((len(m_values), 4 * len(masks)))
+    subsets = []
+    for idx, mask in enumerate(masks):
+        subsets.append(_subset_columns(m_values, mask,
+                                       out=columns[:, 4 * idx:4 * idx + 4]))
+    pos = presence_dot(presence, columns)
+    neg = columns.sum(axis=0) - pos
+    results = []
+    for idx, (shift, n_total, tie_sum) in enumerate(subsets):
+        cols = slice(4 * idx, 4 * idx + 4)
+        results.append(_summarize(pos[:, cols], shift) +
+                       _summarize(neg[:, cols], shift) +
+                       (pos[:, 4 * idx + 3], n_total, tie_sum))
+    return results
+
+
+def _subset_columns(m_values, mask, out):
+    """Fill the weight, centered M value, square and rank columns of a subset.
+
+    Regions out of the subset are left zero in `out`, a (n_regions, 4)
+    array. Returns the ``(shift, n_total, tie_sum)`` of the subset.
+    """
+    if mask is None:
+        mask = np.ones(len(m_values), dtype=bool)
+    mask = np.asarray(mask, dtype=bool)
+    selected = m_values[mask]
+    # center the M values to reduce the cancellation error
+    shift = selected.mean() if selected.size else 0.0
+    ranks, tie_sum = rank_with_ties(selected)
+    out[mask, 0] = 1
+    out[mask, 1] = selected - shift
+    out[mask, 2] = (selected - shift) ** 2
+    out[mask, 3] = ranks
+    return shift, len(selected), tie_sum
+
+
+def pair_block_size(n_regions, align=1):
+    """Number of motifs per block of `pair_statistics`.
+
+    The unpacked row and column blocks and the stacked weighted columns of a
+    block take ``6 * block_size`` floats per region, kept under
+    `BLOCK_BYTES`.
+    """
+    block_size = max(1, BLOCK_BYTES // (6 * 8 * max(n_regions, 1)))
+    return max(align, block_size // align * align)
+
+
+def pair_statistics(presence, m_values, start, end, mask=None,
+                    min_support=1, block_size=None):
+    """Summarize the target/non-target groups of motif pairs.
+
+    The target regions of a pair ``(i, j)`` have both motifs present. For
+    the motifs ``i`` in ``[start, end)`` and all motifs ``j > i``, the target
+    sums of the weights, centered M values, squares and ranks come from
+    matrix products of the presence blocks: the row block weighted by each
+    of the 4 columns is stacked into one (regions x 4*block) matrix, which
+    is multiplied with the presence blocks of ``j``. The presence matrix is
+    only unpacked block by block, so the memory stays bounded by the block
+    size (see `pair_block_size`) however many motifs there are. Sparse
+    presence matrices are not unpacked, the products run over the motif hits.
+
+    Parameters
+    ----------
+    presence : (n_regions, n_motifs) array_like of bool, `PackedPresence` or
+        `SparsePresence`
+        Motif presence indicators of each region.
+    m_values : (n_regions,) array_like of float
+        M values of the regions.
+    start, end : int
+        Range of the first motif of the pairs.
+    mask : (n_regions,) array_like of bool, optional
+        If specified, only the selected regions are tested.
+    min_support : int, optional
+        Only pairs with at least this number of target regions are returned.
+    block_size : int, optional
+        Number of motifs per block, see `pair_block_size`.
+
+    Returns
+    -------
+    idx_a, idx_b : ndarray of int
+        Indices of the two motifs of the returned pairs.
+    statistics : tuple
+        The ``(n_pos, mean_pos, var_pos, n_neg, mean_neg, var_neg,
+        rank_sum_pos, n_total, tie_sum)`` of the returned pairs, see
+        `grouped_statistics`.
+    """
+    column_block, align = _column_blocks(presence)
+    m_values = np.asarray(m_values, dtype=float)
+    n_regions, n_motifs = np.shape(presence)
+    columns = np.zeros((n_regions, 4))
+    shift, n_total, tie_sum = _subset_columns(m_values, mask, out=columns)
+    totals = columns.sum(axis=0)
+    if block_size is None:
+        block_size = pair_block_size(n_regions, align)
+    n_rows = end - start
+    matrix = getattr(presence, 'matrix', None)  # e.g. `SparsePresence`
+    if matrix is not None:
+        # ([weights, values, squares, ranks] x regions of each row motif)
+        rows = matrix[:, start:end]
+        stacked = sparse.hstack([rows.multiply(columns[:, [k]])
+                                 for k in range(4)], format='csr').T
+    else:
+        rows = column_block(start, end).astype(float)
+        # (regions x [weights, values, squares, ranks] of each row motif)
+        stacked = (rows[:, :, np.newaxis] *
+                   columns[:, np.newaxis, :]).reshape(n_regions, 4 * n_rows)
+    del rows
+    pairs_a, pairs_b, sums = [], [], []
+    for col_start in range(start // align * align, n_motifs, block_size):
+        col_end = min(col_start + block_size, n_motifs)
+        if matrix is not None:
+            block = (stacked @ matrix[:, col_start:col_end]).toarray()
+            block = block.reshape(4, n_rows, col_end - col_start)
+            block = block.transpose(1, 2, 0)
+        else:
+            cols = column_block(col_start, col_end).astype(float)
+            block = (stacked.T @ cols).reshape(n_rows, 4,
+                                               col_end - col_start)
+            block = block.transpose(0, 2, 1)
+        idx_a, idx_b = np.meshgrid(np.arange(start, end),
+                                   np.arange(col_start, col_end),
+                                   indexing='ij')
+        keep = (idx_b > idx_a) & (block[:, :, 0] >= min_support - 0.5)
+        pairs_a.append(idx_a[keep])
+        pairs_b.append(idx_b[keep])
+        sums.append(block[keep])
+    pos = np.concatenate(sums) if sums else np.empty((0, 4))
+    neg = totals - pos
+    statistics = (_summarize(pos, shift) + _summarize(neg, shift) +
+                  (pos[:, 3], n_total, tie_sum))
+    return (np.concatenate(pairs_a).astype(int) if pairs_a
+            else np.empty(0, dtype=int),
+            np.concatenate(pairs_b).astype(int) if pairs_b
+            else np.empty(0, dtype=int), statistics)
+
+
+def _dose_shift(m_values, mask):
+    """Mean M value of a subset, by which its M values are centered."""
+    selected = m_values if mask is None else m_values[np.asarray(mask,
+                                                                 dtype=bool)]
+    return selected.mean() if selected.size else 0.0
+
+
+def dose_sums(site_counts, m_values, masks, transform='count',
+              block_size=None):
+    """Per-motif sums of the dose-response regression, see `dose_response`.
+
+    Parameters
+    ----------
+    site_counts : (n_regions, n_motifs) array_like of int
+        The motif site numbers of each region. A `scipy.sparse` matrix is
+        multiplied at once over its nonzero entries.
+    m_values : (n_regions,) array_like of float
+        M values of the regions.
+    masks : list of array_like of bool or None
+        Boolean masks of the regions of each subset, None for all regions.
+    transform : {'count', 'log1p'}, optional
+        Sum the site numbers or ``log1p`` of them.
+    block_size : int, optional
+        Number of motifs processed per block. If not specified, it is chosen
+        to keep the float buffers under `BLOCK_BYTES`.
+
+    Returns
+    -------
+    list of (n_motifs, 3) ndarray
+        The sums of the (transformed) site numbers, of their products with
+        the M values centered by the subset mean and of their squares over
+        the regions of each subset.
+    """
+    if transform not in ('count', 'log1p'):
+        raise ValueError(f"invalid dose-response transform: {transform}")
+    m_values = np.asarray(m_values, dtype=float)
+    n_regions, n_motifs = np.shape(site_counts)
+    # weights and centered M values of each subset
+    columns = np.zeros((n_regions, 2 * len(masks)))
+    for idx, mask in enumerate(masks):
+        if mask is None:
+            mask = np.ones(n_regions, dtype=bool)
+        mask = np.asarray(mask, dtype=bool)
+        columns[mask, 2 * idx] = 1
+        columns[mask, 2 * idx + 1] = m_values[mask] - _dose_shift(m_values,
+                                                                  mask)
+    weights = columns[:, 0::2]
+    if sparse.issparse(site_counts):
+        # one block over the nonzero site numbers
+        site_counts = sparse.csc_matrix(site_counts)
+        block_size = max(n_motifs, 1)
+    elif block_size is None:
+        block_size = max(1, BLOCK_BYTES // (2 * 8 * max(n_regions, 1)))
+    x_sums = np.empty((n_motifs, columns.shape[1]))
+    xx_sums = np.empty((n_motifs, len(masks)))
+    for start in range(0, n_motifs, block_size):
+        end = min(start + block_size, n_motifs)
+        if sparse.issparse(site_counts):
+            doses = site_counts[:, start:end].astype(float)
+            values = doses.data
+        else:
+            # a copy, the caller's (e.g. float) site counts stay unchanged
+            doses = values = np.array(site_counts[:, start:end],
+                                      dtype=float)
+        if transform == 'log1p':
+            np.log1p(values, out=values)
+        x_sums[start:end] = doses.T @ columns
+        values **= 2
+        xx_sums[start:end] = doses.T @ weights
+    return [np.column_stack([x_sums[:, 2 * idx], x_sums[:, 2 * idx + 1],
+                             xx_sums[:, idx]]) for idx in range(len(masks))]
+
+
+def dose_fit(sums, m_values, masks, statistics):
+    """Fit the dose-response regression from the sums of `dose_sums`.
+
+    Parameters
+    ----------
+    sums : list of (n_motifs, 3) array_like of float
+        The per-motif sums of each subset returned by `dose_sums`.
+    m_values, masks : optional
+        The M values and subset masks `sums` were computed with.
+    statistics : list of tuple
+        The group summaries of each subset returned by `grouped_statistics`.
+
+    Returns
+    -------
+    list of tuple
+        The ``(slope, stderr, p_right)`` arrays of each subset, see
+        `dose_response`.
+    """
+    m_values = np.asarray(m_values, dtype=float)
+    results = []
+    for mask, subset_sums, subset_statistics in zip(masks, sums, statistics):
+        shift = _dose_shift(m_values, mask)
+        n_pos, mean_pos, var_pos, n_neg, _, var_neg = subset_statistics[:6]
+        s_x, s_xy, s_xx = np.asarray(subset_sums, dtype=float).T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # centered sums of the target regions
+            c_xx = s_xx - s_x ** 2 / n_pos
+            c_xy = s_xy - s_x * (mean_pos - shift)
+            slope = c_xy / c_xx
+            rss = np.maximum(n_pos * var_pos - slope * c_xy, 0)
+            rss += np.where(n_neg > 0, n_neg * var_neg, 0)
+            # intercept, presence (if any motif-absent region) and slope
+            df = n_pos + n_neg - 2 - (n_neg > 0)
+            stderr = np.sqrt(rss / df / c_xx)
+            t_stat = slope / stderr
+        invalid = (n_pos < 2) | (df < 1) | ~(c_xx > 1e-10 * np.maximum(
+            s_xx, 1))
+        slope = np.where(invalid, np.nan, slope)
+        stderr = np.where(invalid, np.nan, stderr)
+        p_right = np.where(invalid, np.nan,
+                           special.stdtr(np.maximum(df, 1), -t_stat))
+        results.append((slope, stderr, p_right))
+    return results
+
+
+def dose_response(site_counts, m_values, masks, statistics,
+                  transform='count', block_size=None):
+    """Regress the M values on the motif site numbers of all motifs at once.
+
+    For each motif, M values are fitted by least squares against an
+    intercept, the motif presence indicator and the site number (or its
+    ``log1p``). The site number is zero in motif-absent regions, so the
+    slope equals the slope of M values on site numbers among the target
+    regions, and the fit reduces to the group summaries of `statistics` and
+    per-motif sums of the site numbers, their squares and cross products
+    with the M values. These come from products of the site count matrix
+    with the weight/value columns shared by all motifs, block by block as in
+    `presence_dot` (see `dose_sums` and `dose_fit`).
+
+    Parameters
+    ----------
+    site_counts : (n_regions, n_motifs) array_like of int
+        The motif site numbers of each region. A `scipy.sparse` matrix is
+        multiplied at once over its nonzero entries.
+    m_values : (n_regions,) array_like of float
+        M values of the regions.
+    masks : list of array_like of bool or None
+        Boolean masks of the regions of each subset, None for all regions.
+    statistics : list of tuple
+        The group summaries of each subset returned by `grouped_statistics`.
+    transform : {'count', 'log1p'}, optional
+        Regress on the site numbers or on ``log1p`` of them.
+    block_size : int, optional
+        Number of motifs processed per block. If not specified, it is chosen
+        to keep the float buffers under `BLOCK_BYTES`.
+
+    Returns
+    -------
+    list of tuple
+        The ``(slope, stderr, p_right)`` arrays of each subset: the slope of
+        the site numbers, its standard error and the right-tailed P value of
+        the slope being positive. NaN is reported for motifs whose site
+        numbers do not vary among the target regions.
+    """
+    sums = dose_sums(site_counts, m_values, masks, transform=transform,
+                     block_size=block_size)
+    return dose_fit(sums, m_values, masks, statistics)
+
+
+def _welch_t(n_pos, mean_pos, var_pos, n_neg, mean_neg, var_neg):
+    n_pos = np.asarray(n_pos, dtype=float)
+    n_neg = np.asarray(n_neg, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vn_pos = var_pos / (n_pos - 1)  # sample variance / n
+        vn_neg = var_neg / (n_neg - 1)
+        t_stat = (mean_pos - mean_neg) / np.sqrt(vn_pos + vn_neg)
+    return t_stat, vn_pos, vn_neg
+
+
+def welch_t_test(n_pos, mean_pos, var_pos, n_neg, mean_neg, var_neg):
+    """Right-tailed Welch's t-test computed from group summaries.
+
+    This is the vectorized counterpart of `mamotif_t_test`, the variances are
+    population variances as returned by `group_moments`.
+
+    Returns
+    -------
+    t_stat, p_right : ndarray
+        T statistics and right-tailed P values. NaN is reported for motifs
+        with less than 2 regions in either group.
+    """
+    t_stat, vn_pos, vn_neg = _welch_t(n_pos, mean_pos, var_pos, n_neg,
+                                      mean_neg, var_neg)
+    n_pos = np.asarray(n_pos, dtype=float)
+    n_neg = np.asarray(n_neg, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df = (vn_pos + vn_neg) ** 2 / (
+                vn_pos ** 2 / (n_pos - 1) + vn_neg ** 2 / (n_neg - 1))
+    # follow scipy when both groups have zero variance
+    df = np.where(np.isnan(df), 1, df)
+    invalid = (n_pos < 2) | (n_neg < 2)
+    t_stat = np.where(invalid, np.nan, t_stat)
+    # survival function of the t distribution, as `scipy.stats.t.sf`
+    p_right = np.where(invalid, np.nan, special.stdtr(df, -t_stat))
+    return t_stat, p_right
+
+
+def rank_with_ties(values):
+    """Rank the values once, averaging the ranks of ties.
+
+    Returns
+    -------
+    ranks : ndarray
+        1-based ranks of the values.
+    tie_sum : float
+        Sum of ``t**3 - t`` over all groups of ``t`` tied values, used for
+        the tie-corrected variance of the rank-sum statistic.
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.size
+    order = np.argsort(values, kind='mergesort')
+    sorted_values = values[order]
+    # the first position of each group of tied values
+    first = np.ones(n, dtype=bool)
+    first[1:] = sorted_values[1:] != sorted_values[:-1]
+    bounds = np.append(np.flatnonzero(first), n)
+    groups = np.cumsum(first) - 1
+    ranks = np.empty(n)
+    ranks[order] = (bounds[groups] + bounds[groups + 1] + 1) / 2
+    counts = np.diff(bounds).astype(float)
+    tie_sum = float(np.sum(counts ** 3 - counts))
+    return ranks, tie_sum
+
+
+def ranksum_test(n_pos, rank_sum_pos, n_total, tie_sum=None):
+    """Right-tailed Wilcoxon rank-sum test computed from target rank sums.
+
+    This is the vectorized counterpart of `mamotif_ranksum_test`, all motifs
+    share the ranks of the same M values so only the per-motif target rank
+    sums are needed.
+
+    Parameters
+    ----------
+    n_pos : array_like of int
+        Numbers of target regions.
+    rank_sum_pos : array_like of float
+        Sums of the ranks of target regions.
+    n_total : int
+        Total number of regions.
+    tie_sum : float, optional
+        Tie term returned by `rank_with_ties`. If specified, the variance of
+        the statistic is corrected for ties, otherwise the uncorrected
+        variance is used as in `scipy.stats.ranksums`.
+
+    Returns
+    -------
+    z_stat, p_right : ndarray
+        Z statistics and right-tailed P values.
+    """
+    n_pos = np.asarray(n_pos, dtype=float)
+    n_neg = n_total - n_pos
+    expected = n_pos * (n_total + 1) / 2
+    var = n_pos * n_neg * (n_total + 1) / 12
+    if tie_sum and n_total > 1:
+        var = var * (1 - tie_sum / (n_total ** 3 - n_total))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_stat = (rank_sum_pos - expected) / np.sqrt(var)
+    p_right = special.ndtr(-z_stat)
+    return z_stat, p_right
+
+
+def _permuted_stats(presence, index, values, ranks, n_pos, permutations):
+    """T statistics and target rank sums of permuted M values.
+
+    The permuted values, squares and ranks of a batch are stacked as the
+    columns of one (regions x 3*batch) matrix, so that the target sums of all
+    motifs and permutations come from a single presence-matrix product.
+    """
+    n_batch = len(permutations)
+    columns = np.zeros((presence.shape[0], 3 * n_batch))
+    permuted = values[permutations].T
+    columns[index, :n_batch] = permuted
+    columns[index, n_batch:2 * n_batch] = permuted ** 2
+    columns[index, 2 * n_batch:] = ranks[permutations].T
+    pos = presence_dot(presence, columns)
+    n_total = len(values)
+    n_pos = n_pos[:, np.newaxis]
+    n_neg = n_total - n_pos
+    s_pos, ss_pos = pos[:, :n_batch], pos[:, n_batch:2 * n_batch]
+    s_neg, ss_neg = values.sum() - s_pos, (values ** 2).sum() - ss_pos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_pos, mean_neg = s_pos / n_pos, s_neg / n_neg
+        var_pos = np.maximum(ss_pos / n_pos - mean_pos ** 2, 0)
+        var_neg = np.maximum(ss_neg / n_neg - mean_neg ** 2, 0)
+    t_stat, _, _ = _welch_t(n_pos, mean_pos, var_pos, n_neg, mean_neg,
+                            var_neg)
+    t_stat[((n_pos < 2) | (n_neg < 2)).ravel()] = np.nan
+    return t_stat, pos[:, 2 * n_batch:]
+
+
+def permutation_counts(presence, m_values, n_permutations, seed=None,
+                       mask=None, batch_size=None):
+    """Count permutations with statistics at least as large as observed.
+
+    M values are shuffled against the fixed presence matrix, the Welch t
+    statistics and rank sums of all motifs are computed for a batch of
+    permutations at once (see `presence_dot`).
+
+    Parameters
+    ----------
+    presence : (n_regions, n_motifs) array_like of bool, `PackedPresence` or
+        `SparsePresence`
+        Motif presence indicators of each region.
+    m_values : (n_regions,) array_like of float
+        M values of the regions.
+    n_permutations : int
+        Number of permutations.
+    seed : int or `numpy.random.SeedSequence`, optional
+        Seed of the random generator.
+    mask : (n_regions,) array_like of bool, optional
+        If specified, only permute the M values of the selected regions.
+    batch_size : int, optional
+        Number of permutations per product. If not specified, it is chosen
+        to keep the stacked permuted columns under `BLOCK_BYTES`.
+
+    Returns
+    -------
+    t_counts, r_counts : (n_motifs,) ndarray of int
+        Numbers of permutations whose t statistic/target rank sum is greater
+        than or equal to the observed one of each motif. Motifs whose
+        observed statistic is undefined have zero counts.
+    """
+    m_values = np.asarray(m_values, dtype=float)
+    if mask is None:
+        index = np.arange(len(m_values))
     else:
-        raise ValueError(f"invalid correction type: {correction}")
-    return adjusted_p_values
+        index = np.flatnonzero(np.asarray(mask, dtype=bool))
+    values = m_values[index]
+    values = values - values.mean() if values.size else values
+    ranks, _ = rank_with_ties(values)
+    weights = np.zeros_like(m_values)
+    weights[index] = 1
+    n_pos = np.rint(presence_dot(presence, weights))
+    if batch_size is None:
+        batch_size = max(1, BLOCK_BYTES // (3 * 8 * max(len(m_values), 1)))
+
+    identity = np.arange(len(values))[np.newaxis]
+    t_obs, r_obs = _permuted_stats(presence, index, values, ranks, n_pos,
+                                   identity)
+    # tolerate floating-point noise when permuted statistics equal observed
+    t_obs = t_obs - 1e-10 * np.maximum(np.abs(t_obs), 1)
+    r_obs = r_obs - 1e-6
+    rng = np.random.default_rng(seed)
+    t_counts = np.zeros(len(n_pos), dtype=int)
+    r_counts = np.zeros(len(n_pos), dtype=int)
+    for start in range(0, n_permutations, batch_size):
+        n_batch = min(batch_size, n_permutations - start)
+        permutations = np.stack([rng.permutation(len(values))
+                                 for _ in range(n_batch)])
+        t_stat, r_sum = _permuted_stats(presence, index, values, ranks,
+                                        n_pos, permutations)
+        with np.errstate(invalid='ignore'):
+            t_counts += np.count_nonzero(t_stat >= t_obs, axis=1)
+            r_counts += np.count_nonzero(r_sum >= r_obs, axis=1)
+    invalid = (n_pos < 1) | (n_pos >= len(values))
+    r_counts[invalid] = 0
+    return t_counts, r_counts
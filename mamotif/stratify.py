@@ -0,0 +1,142 @@
+"""
+mamotif.stratify
+----------------
+
+Stratify genomic regions by genomic context (promoter/distal, distance to
+TSSs and user-supplied annotations).
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from mamotif.io import read_bed_intervals
+from mamotif.promoter import IntervalIndex
+
+logger = logging.getLogger(__name__)
+
+
+def parse_tss_bins(text):
+    """Parse comma-separated upper edges of distance-to-TSS bins.
+
+    For example, ``1000,5000,50000`` defines the bins 0-1kb, 1-5kb, 5-50kb
+    and >50kb.
+    """
+    try:
+        edges = [int(edge) for edge in text.split(',')]
+    except ValueError:
+        raise ValueError(f"invalid distance-to-TSS bins: {text!r}") from None
+    if not edges or edges[0] <= 0 or any(
+            b <= a for a, b in zip(edges[:-1], edges[1:])):
+        raise ValueError(f"distance-to-TSS bins should be positive and "
+                         f"increasing: {text!r}")
+    return edges
+
+
+def _format_distance(distance):
+    if distance == 0:
+        return '0'
+    if distance % 1000 == 0:
+        return f'{distance // 1000}kb'
+    return f'{distance}bp'
+
+
+def tss_bin_names(edges):
+    """Return the names of the distance-to-TSS bins, e.g. `tss_1kb-5kb`."""
+    bounds = [0] + list(edges)
+    names = [f'tss_{_format_distance(lower)}-{_format_distance(upper)}'
+             for lower, upper in zip(bounds[:-1], bounds[1:])]
+    names.append(f'tss_gt{_format_distance(bounds[-1])}')
+    return names
+
+
+def parse_annotation(text):
+    """Parse a ``[NAME=]FILE`` annotation argument into ``(name, path)``.
+
+    The name defaults to the file name without extensions.
+    """
+    if '=' in text and not os.path.exists(text):
+        name, path = text.split('=', 1)
+    else:
+        path = text
+        name = os.path.basename(path).split('.')[0]
+    if not name or not path:
+        raise ValueError(f"invalid annotation: {text!r}")
+    return name, path
+
+
+def load_annotations(annotations):
+    """Load BED annotations into `IntervalIndex` objects.
+
+    Parameters
+    ----------
+    annotations : list of tuple
+        The ``(name, path)`` of each BED annotation.
+
+    Returns
+    -------
+    list of tuple
+        The ``(name, index)`` of each annotation.
+    """
+    indexes = []
+    for name, path in annotations:
+        logger.info(f"Loading annotation {name!r} from {path}")
+        indexes.append((name, IntervalIndex.from_intervals(
+            *read_bed_intervals(path))))
+    return indexes
+
+
+class Stratifier:
+    """Assign genomic regions to the strata to test separately.
+
+    Parameters
+    ----------
+    promoters : `mamotif.promoter.PromoterIndex`, optional
+        If specified, split regions into promoter/distal regions.
+    tss : `mamotif.promoter.TssIndex`, optional
+        TSSs to stratify regions by the distance to the nearest TSS.
+    tss_bins : list of int, optional
+        Upper edges of the distance-to-TSS bins, see `parse_tss_bins`.
+    annotations : list of tuple, optional
+        The ``(name, IntervalIndex)`` of annotations (e.g. enhancers), the
+        regions overlapping with each annotation form a stratum.
+    """
+
+    def __init__(self, promoters=None, tss=None, tss_bins=None,
+                 annotations=None):
+        if (tss is None) != (not tss_bins):
+            raise ValueError("both the TSSs and distance bins are required")
+        self.promoters = promoters
+        self.tss = tss
+        self.tss_bins = list(tss_bins or [])
+        self.annotations = list(annotations or [])
+        names = [name for name, _ in self.annotations]
+        reserved = {'all', 'promoter', 'distal'} | set(
+            tss_bin_names(self.tss_bins) if self.tss_bins else [])
+        for name in names:
+            if name in reserved or names.count(name) > 1:
+                raise ValueError(f"duplicated stratum name: {name}")
+
+    def subsets(self, regions):
+        """Return the strata of the regions.
+
+        Returns
+        -------
+        list of tuple
+            The ``(name, mask)`` of each stratum, the first one is all regions
+            with name ``'all'`` and mask None.
+        """
+        subsets = [('all', None)]
+        if self.promoters is not None:
+            is_promoter = self.promoters.classify(regions)
+            subsets += [('promoter', is_promoter), ('distal', ~is_promoter)]
+        if self.tss is not None:
+            distances = self.tss.distances(regions)
+            # bin i holds the distances in [edges[i-1], edges[i])
+            bins = np.searchsorted(self.tss_bins, distances, side='right')
+            for idx, name in enumerate(tss_bin_names(self.tss_bins)):
+                subsets.append((name, bins == idx))
+        for name, index in self.annotations:
+            subsets.append((name, index.classify(regions)))
+        return subsets
@@ -20,7 +20,7 @@ with open(os.path.join(pkg_dir, 'README.rst')) as fin:
     long_description = fin.read()
 
 install_requires = [
-    "numpy>=1.15",
+    "numpy>=1.17",
     "scipy>=1.0",
     "MAnorm>=1.3.0",
     "motifscan>=1.2.0"
@@ -30,7 +30,9 @@ extras_require = {
     "test": ["pytest>=4.0.0",
              "pytest-cov>=2.8.0"],
     "docs": ["sphinx>=2.0.0",
-             "sphinx_rtd_theme"]
+             "sphinx_rtd_theme"],
+    "parquet": ["pyarrow>=1.0"],
+    "pandas": ["pandas>=0.24"]
 }
 
 classifiers = [
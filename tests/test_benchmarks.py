@@ -0,0 +1,51 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARK_DIR)
+
+from bench_integration import main  # noqa: E402
+from synthetic import generate_dataset  # noqa: E402
+
+from mamotif.region import load_mamotif_regions  # noqa: E402
+
+
+def test_generate_dataset(tmp_path):
+    paths = generate_dataset(str(tmp_path), n_regions=300, n_motifs=20,
+                             n_chroms=3, compress=True)
+    motifs, regions = load_mamotif_regions(paths['manorm'],
+                                           paths['motifscan'])
+    assert len(motifs) == 20 and len(regions) == 300
+    assert not np.isnan(regions.m_values).any()
+    assert 0 < regions.presence.mean() < 0.5
+
+
+def test_benchmarks(tmp_path):
+    output = str(tmp_path / 'bench.json')
+    main(['--regions', '200', '--motifs', '10', '--repeat', '1',
+          '-o', output])
+    with open(output) as fin:
+        report = json.load(fin)
+    assert report['config']['regions'] == 200
+    for stage in ['load_mamotif_regions', 'match_manorm_regions',
+                  'mamotif_test', 'adjust_p_values',
+                  'write_mamotif_results[xls]', 'run_integration',
+                  'split:mamotif_test']:
+        assert report['stages'][stage]['min'] >= 0
+
+
+def test_benchmarks_unavailable(tmp_path, monkeypatch):
+    # e.g. an older MAmotif without the multiple testing module
+    monkeypatch.setitem(sys.modules, 'mamotif.correction', None)
+    output = str(tmp_path / 'bench.json')
+    main(['--regions', '200', '--motifs', '10', '--repeat', '1',
+          '-o', output])
+    with open(output) as fin:
+        stages = json.load(fin)['stages']
+    assert 'unavailable' in stages['adjust_p_values']
+    assert stages['mamotif_test']['min'] >= 0
+    assert stages['split:mamotif_test']['min'] >= 0
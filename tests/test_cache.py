@@ -0,0 +1,190 @@
+import os
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from mamotif.cache import (PromoterCache, RegionCache, StatisticsCache,
+                           column_digests, count_digests, evict)
+from mamotif.region import (PackedPresence, SparsePresence,
+                            load_mamotif_regions)
+from mamotif.stats import dose_sums, grouped_statistics
+from test_io import MANORM_TEXT, MOTIFSCAN_TEXT, _write
+from test_promoter import GENES_TEXT
+
+
+def _inputs(tmp_path):
+    f_manorm = _write(tmp_path / 'A_MAvalues.xls', MANORM_TEXT)
+    f_motifscan = _write(tmp_path / 'motif_sites_number.xls',
+                         '\n'.join(MOTIFSCAN_TEXT.splitlines()[:3]) + '\n')
+    return f_manorm, f_motifscan
+
+
+def test_region_cache(tmp_path):
+    f_manorm, f_motifscan = _inputs(tmp_path)
+    cache = RegionCache(str(tmp_path / 'cache'))
+    key, motifs, regions = cache.load(f_manorm, f_motifscan)
+    assert regions is None
+    motifs, regions = load_mamotif_regions(f_manorm, f_motifscan)
+    cache.store(key, regions)
+
+    key_cached, motifs_cached, regions_cached = cache.load(f_manorm,
+                                                           f_motifscan)
+    assert key_cached == key
+    assert motifs_cached == motifs
+    assert regions_cached.chroms == regions.chroms
+    for name in ('chrom_codes', 'starts', 'ends', 'm_values', 'presence'):
+        assert np.array_equal(getattr(regions_cached, name),
+                              getattr(regions, name))
+
+    _, _, regions_packed = cache.load(f_manorm, f_motifscan, packed=True)
+    assert isinstance(regions_packed.presence.bits, np.memmap)
+    assert np.array_equal(regions_packed.presence.to_dense(),
+                          regions.presence)
+
+    # entries without the site counts are missing when they are needed
+    assert cache.load(f_manorm, f_motifscan, site_counts=True)[2] is None
+    _, regions = load_mamotif_regions(f_manorm, f_motifscan,
+                                      site_counts=True)
+    cache.store(key, regions)
+    _, _, regions_cached = cache.load(f_manorm, f_motifscan,
+                                      site_counts=True)
+    assert np.array_equal(regions_cached.site_counts, regions.site_counts)
+    _, _, regions_sparse = cache.load(f_manorm, f_motifscan,
+                                      site_counts=True, sparse_presence=True)
+    assert isinstance(regions_sparse.presence, SparsePresence)
+    assert np.array_equal(regions_sparse.presence.to_dense(),
+                          regions.presence)
+    assert np.array_equal(regions_sparse.site_counts.toarray(),
+                          regions.site_counts)
+    # sparse regions are stored in the same format
+    _, regions_sparse = load_mamotif_regions(
+        f_manorm, f_motifscan, site_counts=True, sparse_presence=True)
+    assert np.array_equal(regions_sparse.site_counts.toarray(),
+                          regions.site_counts)
+    cache.store(key, regions_sparse)
+    _, _, regions_cached = cache.load(f_manorm, f_motifscan,
+                                      site_counts=True)
+    assert np.array_equal(regions_cached.presence, regions.presence)
+    assert np.array_equal(regions_cached.site_counts, regions.site_counts)
+
+    # stale entry after the input changed
+    _write(f_manorm, MANORM_TEXT.replace('1.5', '2.5'))
+    key_new, _, regions_new = cache.load(f_manorm, f_motifscan)
+    assert key_new != key and regions_new is None
+
+
+def test_region_cache_corrupted(tmp_path):
+    f_manorm, f_motifscan = _inputs(tmp_path)
+    cache = RegionCache(str(tmp_path / 'cache'))
+    key, _, _ = cache.load(f_manorm, f_motifscan)
+    _, regions = load_mamotif_regions(f_manorm, f_motifscan)
+    cache.store(key, regions)
+    path = os.path.join(cache.path, key, 'presence_bits.npy')
+    with open(path, 'r+b') as fout:
+        fout.truncate(os.path.getsize(path) - 1)
+    _, _, regions = cache.load(f_manorm, f_motifscan)
+    assert regions is None
+    assert not os.path.exists(os.path.join(cache.path, key))
+
+
+def test_evict(tmp_path):
+    for idx, name in enumerate(['a', 'b', 'c']):
+        os.makedirs(tmp_path / name)
+        _write(tmp_path / name / 'meta.json', 'x' * 100)
+        os.utime(tmp_path / name / 'meta.json', (idx, idx))
+    evict(str(tmp_path), max_size=250, keep=('a',))
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c']
+
+
+def test_promoter_cache(tmp_path):
+    f_genes = _write(tmp_path / 'genes.txt', GENES_TEXT)
+    cache = PromoterCache(str(tmp_path / 'cache'))
+    index = cache.load(f_genes, upstream=4000, downstream=2000)
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+    cached = cache.load(f_genes, upstream=4000, downstream=2000)
+    assert cached.chroms == index.chroms
+    assert np.array_equal(cached.starts, index.starts)
+    assert np.array_equal(cached.ends, index.ends)
+    # one entry per window
+    assert len(cache.load(f_genes, upstream=4000, downstream=3000)) == 2
+    assert len(os.listdir(tmp_path / 'cache')) == 2
+
+
+def _assert_statistics(results, expected):
+    for statistics, expected_statistics in zip(results, expected):
+        for value, expected_value in zip(statistics, expected_statistics):
+            assert np.allclose(value, expected_value, equal_nan=True)
+
+
+@pytest.mark.parametrize('presence_type',
+                         [np.asarray, PackedPresence.from_dense,
+                          SparsePresence.from_dense])
+def test_statistics_cache(tmp_path, monkeypatch, presence_type):
+    rng = np.random.RandomState(0)
+    presence = rng.rand(50, 12) < 0.3
+    m_values = rng.normal(size=50)
+    masks = [None, np.arange(50) % 2 == 0]
+    data = presence_type(presence)
+    assert column_digests(data) == column_digests(presence)
+    cache = StatisticsCache(str(tmp_path / 'cache'))
+    expected = grouped_statistics(presence, m_values, masks)
+    _assert_statistics(cache.grouped_statistics(data, m_values, masks),
+                       expected)
+    assert len(os.listdir(cache.path)) == 2
+
+    # one changed and one new motif, the others are loaded from the cache
+    presence = np.column_stack([presence, rng.rand(50) < 0.3])
+    presence[:, 3] = ~presence[:, 3]
+    data = presence_type(presence)
+    computed = []
+
+    def _grouped_statistics(subset_presence, *args):
+        computed.append(np.shape(subset_presence)[1])
+        return grouped_statistics(subset_presence, *args)
+
+    monkeypatch.setattr('mamotif.cache.grouped_statistics',
+                        _grouped_statistics)
+    results = cache.grouped_statistics(data, m_values, masks)
+    assert computed == [2]
+    _assert_statistics(results,
+                       grouped_statistics(presence, m_values, masks))
+    # other M values (e.g. -M) have their own entries
+    cache.grouped_statistics(data, -m_values, masks, negative=True)
+    assert len(os.listdir(cache.path)) == 4
+
+
+@pytest.mark.parametrize('counts_type', [np.asarray, sparse.csc_matrix])
+def test_dose_sums_cache(tmp_path, monkeypatch, counts_type):
+    rng = np.random.RandomState(0)
+    counts = rng.poisson(0.5, size=(50, 12))
+    m_values = rng.normal(size=50)
+    masks = [None, np.arange(50) % 2 == 0]
+    data = counts_type(counts)
+    assert count_digests(data) == count_digests(counts)
+    cache = StatisticsCache(str(tmp_path / 'cache'))
+    results = cache.dose_sums(data, m_values, masks, transform='log1p')
+    for values, expected in zip(
+            results, dose_sums(counts, m_values, masks, transform='log1p')):
+        assert np.allclose(values, expected)
+    assert len(os.listdir(cache.path)) == 2
+
+    # one changed and one new motif, the others are loaded from the cache
+    counts = np.column_stack([counts, rng.poisson(0.5, size=50)])
+    counts[:, 3] += 1
+    data = counts_type(counts)
+    computed = []
+
+    def _dose_sums(subset_counts, *args, **kwargs):
+        computed.append(np.shape(subset_counts)[1])
+        return dose_sums(subset_counts, *args, **kwargs)
+
+    monkeypatch.setattr('mamotif.cache.dose_sums', _dose_sums)
+    results = cache.dose_sums(data, m_values, masks, transform='log1p')
+    assert computed == [2]
+    for values, expected in zip(
+            results, dose_sums(counts, m_values, masks, transform='log1p')):
+        assert np.allclose(values, expected)
+    # other transforms have their own entries
+    cache.dose_sums(data, m_values, masks)
+    assert len(os.listdir(cache.path)) == 4
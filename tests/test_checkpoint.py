@@ -0,0 +1,117 @@
+import os
+
+from mamotif.checkpoint import MANIFEST_FILE, RunManifest
+from mamotif.cli import run as cli_run
+from mamotif.cli.main import configure_parser_main
+
+
+def _write(path, text):
+    with open(path, 'w') as fout:
+        fout.write(text)
+    return str(path)
+
+
+def test_run_manifest(tmp_path):
+    f_input = _write(tmp_path / 'input.txt', 'input')
+    f_output = str(tmp_path / 'output.txt')
+    path = str(tmp_path / 'manifest.json')
+    calls = []
+
+    def _stage():
+        calls.append(1)
+        _write(f_output, 'output')
+        return {'output': f_output}
+
+    def _run(manifest, options=None):
+        return manifest.run('stage', _stage, inputs=[f_input],
+                            options=options or {'value': (1, 2)},
+                            outputs=lambda result: [result['output']])
+
+    assert _run(RunManifest(path)) == {'output': f_output}
+    # skipped: inputs, options and outputs are unchanged
+    assert _run(RunManifest(path)) == {'output': f_output}
+    assert len(calls) == 1
+    # rewritten with the same content
+    os.utime(f_input, ns=(0, 0))
+    _run(RunManifest(path))
+    assert len(calls) == 1
+
+    _run(RunManifest(path, force=True))
+    assert len(calls) == 2
+    _run(RunManifest(path), options={'value': 3})
+    assert len(calls) == 3
+    _write(f_input, 'changed')
+    _run(RunManifest(path), options={'value': 3})
+    assert len(calls) == 4
+    os.remove(f_output)
+    _run(RunManifest(path), options={'value': 3})
+    assert len(calls) == 5
+
+
+def test_run_resume(tmp_path, monkeypatch):
+    files = [_write(tmp_path / name, name) for name in
+             ['a.bed', 'b.bed', 'a_reads.bed', 'b_reads.bed']]
+    output_dir = tmp_path / 'output'
+    calls = []
+
+    def _manorm(args):
+        calls.append('manorm')
+        manorm_dir = output_dir / 'manorm'
+        os.makedirs(manorm_dir, exist_ok=True)
+        for name in [args.name1, args.name2]:
+            _write(manorm_dir / f'{name}_MAvalues.xls', name)
+        return str(manorm_dir)
+
+    def _motifscan(args, f_manorms):
+        calls.append('motifscan')
+        paths = []
+        for idx, f_manorm in enumerate(f_manorms):
+            os.makedirs(output_dir / f'scan{idx}', exist_ok=True)
+            paths.append(_write(output_dir / f'scan{idx}' / 'sites.xls',
+                                f_manorm))
+        return paths
+
+    def _integration(f_manorm, negative, output_dir, **kwargs):
+        calls.append(f'integration_{negative}')
+        return [_write(os.path.join(output_dir, f'{negative}.xls'), 'out')]
+
+    monkeypatch.setattr(cli_run, 'run_manorm_from_mamotif', _manorm)
+    monkeypatch.setattr(cli_run, 'run_union_motifscan_from_mamotif',
+                        _motifscan)
+    monkeypatch.setattr(cli_run, 'run_integration', _integration)
+    argv = ['run', '--p1', files[0], '--p2', files[1], '--r1', files[2],
+            '--r2', files[3], '-m', 'motifs', '-g', 'genome',
+            '-o', str(output_dir)]
+    parser = configure_parser_main()
+
+    cli_run.run(parser.parse_args(argv))
+    assert sorted(calls) == ['integration_False', 'integration_True',
+                             'manorm', 'motifscan']
+    assert os.path.isfile(output_dir / MANIFEST_FILE)
+
+    # nothing changed
+    calls.clear()
+    cli_run.run(parser.parse_args(argv))
+    assert calls == []
+
+    # only the integration of sample B is rerun
+    os.remove(output_dir / 'True.xls')
+    cli_run.run(parser.parse_args(argv))
+    assert calls == ['integration_True']
+
+    # changed options of the integration
+    calls.clear()
+    cli_run.run(parser.parse_args(argv + ['--correction', 'bonferroni']))
+    assert sorted(calls) == ['integration_False', 'integration_True']
+
+    # the dose-response regression is off by default for packed presence
+    argv += ['--correction', 'bonferroni']
+    calls.clear()
+    cli_run.run(parser.parse_args(argv + ['--presence-format', 'sparse']))
+    assert calls == []
+    cli_run.run(parser.parse_args(argv + ['--presence-format', 'packed']))
+    assert sorted(calls) == ['integration_False', 'integration_True']
+
+    calls.clear()
+    cli_run.run(parser.parse_args(argv + ['--force']))
+    assert len(calls) == 4
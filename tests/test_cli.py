@@ -1,6 +1,54 @@
+import os
+import subprocess
+import sys
+
+import mamotif
+from mamotif.cli.main import READ_FORMATS, REGION_FORMATS
+
+
+def _imported_modules(code):
+    """Return the modules imported by `code` in a fresh interpreter."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(mamotif.__file__))] +
+        env.get('PYTHONPATH', '').split(os.pathsep))
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         code + '\nimport sys\nprint("\\n".join(sys.modules))'],
+        env=env, universal_newlines=True)
+    return set(output.split())
+
+
+def _is_imported(modules, package):
+    return any(module == package or module.startswith(package + '.')
+               for module in modules)
+
+
 def test_run():
     pass
 
 
 def test_integrate():
     pass
+
+
+def test_startup_imports():
+    modules = _imported_modules(
+        "from mamotif.cli.main import configure_parser_main\n"
+        "configure_parser_main()")
+    for package in ['numpy', 'scipy', 'manorm', 'motifscan', 'matplotlib',
+                    'mamotif.integration']:
+        assert not _is_imported(modules, package), package
+
+    # integrate needs neither the MAnorm/MotifScan CLIs nor scipy.stats
+    modules = _imported_modules("import mamotif.cli.intergrate")
+    for package in ['manorm.cli', 'motifscan.cli', 'scipy.stats',
+                    'matplotlib', 'pysam']:
+        assert not _is_imported(modules, package), package
+
+
+def test_format_choices():
+    from manorm.read import READ_FORMATS as MANORM_READ_FORMATS
+    from manorm.region import REGION_FORMATS as MANORM_REGION_FORMATS
+    assert READ_FORMATS == list(MANORM_READ_FORMATS)
+    assert REGION_FORMATS == list(MANORM_REGION_FORMATS)
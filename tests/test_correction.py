@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from mamotif.correction import adjust_p_values, storey_pi0
+
+
+def _brute_force_step_up(p_values, factor=1.0):
+    p_values = np.asarray(p_values, dtype=float)
+    n = len(p_values)
+    order = np.argsort(p_values)
+    adjusted = np.empty(n)
+    for rank, idx in enumerate(order, start=1):
+        adjusted[idx] = min(1, min(p_values[order[k]] * n * factor / (k + 1)
+                                   for k in range(rank - 1, n)))
+    return adjusted
+
+
+def test_benjamin_step_up():
+    p_values = [0.01, 0.04, 0.03, 0.2]
+    expected = [0.04, 0.04 * 4 / 3, 0.04 * 4 / 3, 0.2]
+    assert np.allclose(adjust_p_values(p_values), expected)
+
+    rng = np.random.RandomState(0)
+    p_values = rng.rand(200) ** 3
+    adjusted = adjust_p_values(p_values)
+    assert np.allclose(adjusted, _brute_force_step_up(p_values))
+    order = np.argsort(p_values)
+    assert np.all(np.diff(adjusted[order]) >= 0)
+
+
+def test_bonferroni():
+    assert np.allclose(adjust_p_values([0.01, 0.5, 0.2], 'bonferroni'),
+                       [0.03, 1, 0.6])
+
+
+def test_yekutieli():
+    rng = np.random.RandomState(1)
+    p_values = rng.rand(50) ** 2
+    factor = np.sum(1 / np.arange(1, 51))
+    assert np.allclose(adjust_p_values(p_values, 'yekutieli'),
+                       _brute_force_step_up(p_values, factor))
+
+
+def test_storey():
+    p_values = np.array([0.001, 0.002, 0.01, 0.6, 0.7, 0.8, 0.9, 0.95])
+    assert storey_pi0(p_values) == 1.0  # capped
+    p_values = np.concatenate([np.full(30, 1e-4), np.linspace(0.51, 1, 10)])
+    pi0 = storey_pi0(p_values)
+    assert pi0 == pytest.approx(11 / (40 * 0.5))
+    assert np.allclose(adjust_p_values(p_values, 'storey'),
+                       np.minimum(pi0 * adjust_p_values(p_values), 1))
+    with pytest.raises(ValueError):
+        storey_pi0(p_values, lambda_=1)
+    # no p-value above lambda, the q-values are still positive
+    p_values = np.array([0.01, 0.2, 0.3, 0.04])
+    assert storey_pi0(p_values) == pytest.approx(1 / (4 * 0.5))
+    q_values = adjust_p_values(p_values, 'storey')
+    assert np.all(q_values > 0)
+    assert np.allclose(q_values, 0.5 * adjust_p_values(p_values))
+
+
+def test_nan_values():
+    p_values = [0.01, np.nan, 0.04, np.nan]
+    for correction in ['benjamin', 'bonferroni', 'yekutieli', 'storey']:
+        adjusted = adjust_p_values(p_values, correction)
+        assert np.isnan(adjusted[[1, 3]]).all()
+        assert not np.isnan(adjusted[[0, 2]]).any()
+    assert np.allclose(adjust_p_values(p_values)[[0, 2]], [0.02, 0.04])
+    assert np.isnan(adjust_p_values([np.nan, np.nan])).all()
+    assert adjust_p_values([]).shape == (0,)
+
+
+def test_invalid_correction():
+    with pytest.raises(ValueError):
+        adjust_p_values([0.1], correction='holm')
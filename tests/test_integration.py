@@ -0,0 +1,228 @@
+import multiprocessing as mp
+import os
+import threading
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+import mamotif
+from mamotif.integration import (integrate_arrays, run_integration,
+                                 run_integration_batch)
+from mamotif.io import read_manorm_values, read_motif_sites_number
+from mamotif.promoter import IntervalIndex
+from mamotif.stratify import Stratifier
+
+from test_io import MANORM_TEXT, MOTIFSCAN_TEXT, _write
+
+MANORM_MATCHED = MANORM_TEXT + "chr1\t301\t400\t350\t0.5\t6.0\t0.1\tcommon\n"
+
+
+def test_run_integration_batch(tmp_path):
+    f_manorm = _write(tmp_path / 'A_MAvalues.xls', MANORM_MATCHED)
+    f_unmatched = _write(tmp_path / 'B_MAvalues.xls', MANORM_TEXT)
+    f_motifscan = _write(tmp_path / 'motif_sites_number.xls', MOTIFSCAN_TEXT)
+    output_dir = tmp_path / 'output'
+    records = run_integration_batch(
+        [(f_manorm, f_motifscan, False, None),
+         (f_manorm, f_motifscan, True, 'neg/A'),
+         (f_unmatched, f_motifscan, False, None)],
+        output_dir=str(output_dir), n_jobs=2)
+    assert [record['status'] for record in records] == \
+        ['ok', 'ok', 'failed']
+    assert records[0]['outputs'] == [
+        str(output_dir / 'A_MAmotif_output.xls')]
+    assert records[1]['outputs'] == [
+        str(output_dir / 'neg' / 'A_MAmotif_output.xls')]
+    assert 'no matched MAnorm region' in records[2]['error']
+    with open(output_dir / 'integrate_batch_summary.xls') as fin:
+        lines = fin.read().splitlines()
+    assert len(lines) == 4
+    assert lines[3].startswith('B\tfailed\t')
+
+    # same outputs as the single integration
+    run_integration(f_manorm, f_motifscan, negative=True,
+                    output_dir=str(tmp_path / 'single'))
+    with open(tmp_path / 'single' / 'A_MAmotif_output.xls') as fin:
+        expected = fin.read()
+    with open(records[1]['outputs'][0]) as fin:
+        assert fin.read() == expected
+
+
+def test_run_integration_incremental(tmp_path):
+    f_manorm = _write(tmp_path / 'A_MAvalues.xls', MANORM_MATCHED)
+    f_motifscan = _write(tmp_path / 'motif_sites_number.xls', MOTIFSCAN_TEXT)
+    with pytest.raises(ValueError, match="requires a cache directory"):
+        run_integration(f_manorm, f_motifscan, incremental=True,
+                        output_dir=str(tmp_path))
+    outputs = []
+    for name in ['full', 'cold', 'warm']:
+        path, = run_integration(
+            f_manorm, f_motifscan, output_dir=str(tmp_path / name),
+            cache_dir=str(tmp_path / 'cache'), incremental=name != 'full')
+        with open(path) as fin:
+            outputs.append(fin.read())
+    assert outputs[1] == outputs[0]
+    assert outputs[2] == outputs[0]
+
+
+def test_run_integration_batch_duplicated_prefix(tmp_path):
+    comparisons = [('A_MAvalues.xls', 'A.xls', False, None),
+                   ('A_MAvalues.xls', 'B.xls', False, 'A')]
+    with pytest.raises(ValueError, match="duplicated output prefixes: A"):
+        run_integration_batch(comparisons, output_dir=str(tmp_path))
+    assert not os.listdir(tmp_path)
+
+
+def _arrays(tmp_path):
+    f_manorm = _write(tmp_path / 'A_MAvalues.xls', MANORM_MATCHED)
+    f_motifscan = _write(tmp_path / 'motif_sites_number.xls', MOTIFSCAN_TEXT)
+    chroms, chrom_codes, starts, ends, m_values = read_manorm_values(
+        f_manorm)
+    motifs, _, _, _, _, counts = read_motif_sites_number(f_motifscan)
+    chroms = np.array(chroms)[chrom_codes]
+    return f_manorm, f_motifscan, (chroms, starts, ends, m_values, counts,
+                                   motifs)
+
+
+def test_integrate_arrays(tmp_path):
+    f_manorm, f_motifscan, arrays = _arrays(tmp_path)
+    results = mamotif.integrate_arrays(*arrays, negative=True)
+    assert list(results) == ['all']
+    assert results['all'].dose_pval is not None
+    assert integrate_arrays(*arrays, dose=False)['all'].dose_pval is None
+    # off by default for packed presence, to keep its memory bound
+    for dose, expected in [(None, False), (True, True)]:
+        path, = run_integration(f_manorm, f_motifscan, dose=dose,
+                                presence_format='packed',
+                                output_dir=str(tmp_path / f'packed{dose}'))
+        with open(path) as fin:
+            assert ('Dose-response' in fin.readline()) == expected
+    # float site numbers are not transformed in place
+    float_counts = arrays[4].astype(float)
+    for transform in ('count', 'log1p'):
+        integrate_arrays(*arrays[:4], float_counts, arrays[5],
+                         dose_transform=transform)
+        assert np.array_equal(float_counts, arrays[4])
+    sparse_counts = sparse.csc_matrix(arrays[4])
+    sparse_results = integrate_arrays(*arrays[:4], sparse_counts, arrays[5],
+                                      negative=True,
+                                      presence_format='sparse')
+    for field in ('n_pos', 't_stat', 'r_pval', 'dose_slope'):
+        assert np.allclose(getattr(sparse_results['all'], field),
+                           getattr(results['all'], field), equal_nan=True)
+    run_integration(f_manorm, f_motifscan, negative=True,
+                    output_dir=str(tmp_path))
+    with open(tmp_path / 'A_MAmotif_output.xls') as fin:
+        lines = fin.read().splitlines()[1:]
+    for line in lines:
+        fields = line.split('\t')
+        result = results['all'][results['all'].motifs.index(fields[0])]
+        assert int(fields[1]) == result.n_pos
+        assert float(fields[2]) == pytest.approx(result.mean_pos,
+                                                 nan_ok=True)
+
+    stratifier = Stratifier(annotations=[
+        ('ann', IntervalIndex.from_intervals(['chr1'], [0], [250]))])
+    results = integrate_arrays(*arrays, stratifier=stratifier,
+                               presence_format='packed', permutations=10,
+                               seed=0)
+    assert list(results) == ['all', 'ann']
+    assert results['ann'].n_pos.tolist() == [0, 1]
+    assert results['all'].t_perm_pval is not None
+
+    results = integrate_arrays(*arrays, stratifier=stratifier, pairs=True,
+                               min_support=1)
+    pairs = results['all'].pairs
+    assert pairs.motif_a.tolist() == [arrays[5][0]]
+    assert pairs.motif_b.tolist() == [arrays[5][1]]
+    target = (arrays[4][:, 0] > 0) & (arrays[4][:, 1] > 0)
+    assert pairs.n_pos.tolist() == [target.sum()]
+    assert len(results['ann'].pairs) == 0
+    assert len(integrate_arrays(*arrays, pairs=True,
+                                min_support=3)['all'].pairs) == 0
+
+    with pytest.raises(ValueError, match="motif names are required"):
+        integrate_arrays(*arrays[:5])
+    with pytest.raises(ValueError, match="expect 3 M values"):
+        integrate_arrays(*arrays[:3], arrays[3][:2], *arrays[4:])
+
+
+def test_integrate_frame(tmp_path):
+    pd = pytest.importorskip('pandas')
+    _, _, (chroms, starts, ends, m_values, counts, motifs) = _arrays(
+        tmp_path)
+    frame = pd.DataFrame({'chr': chroms, 'start': starts, 'end': ends,
+                          'M_value': m_values})
+    sites = pd.DataFrame(counts, columns=motifs)
+    expected = integrate_arrays(chroms, starts, ends, m_values, counts,
+                                motifs)['all']
+    results = integrate_arrays(chroms, starts, ends, m_values, sites,
+                               as_frame=True)['all']
+    assert results['motif'].tolist() == motifs
+    assert np.allclose(results['t_stat'], expected.t_stat, equal_nan=True)
+    results = mamotif.integrate_frame(pd.concat([frame, sites], axis=1),
+                                      motifs)['all']
+    assert np.allclose(results['padj'], expected.padj, equal_nan=True)
+
+
+def _annotation_stratifier(n_annotations=6):
+    return Stratifier(annotations=[
+        (f'ann{idx}', IntervalIndex.from_intervals(['chr1'], [0],
+                                                   [100 * idx + 150]))
+        for idx in range(n_annotations)])
+
+
+def test_run_integration_parallel(tmp_path):
+    f_manorm = _write(tmp_path / 'A_MAvalues.xls', MANORM_MATCHED)
+    f_motifscan = _write(tmp_path / 'motif_sites_number.xls', MOTIFSCAN_TEXT)
+    # more strata than one product block, dealt into several tasks
+    stratifier = _annotation_stratifier()
+    outputs = {}
+    for n_jobs in (1, 3):
+        output_dir = tmp_path / f'j{n_jobs}'
+        paths = run_integration(f_manorm, f_motifscan, n_jobs=n_jobs,
+                                output_dir=str(output_dir),
+                                stratifier=stratifier, pairs=True,
+                                min_support=1)
+        outputs[n_jobs] = {}
+        for path in paths:
+            with open(path, 'rb') as fin:
+                outputs[n_jobs][os.path.basename(path)] = fin.read()
+    assert len(outputs[1]) == 14
+    assert outputs[3] == outputs[1]
+
+
+def test_run_tasks_in_thread(tmp_path, monkeypatch):
+    f_manorm = _write(tmp_path / 'A_MAvalues.xls', MANORM_MATCHED)
+    f_motifscan = _write(tmp_path / 'motif_sites_number.xls', MOTIFSCAN_TEXT)
+    get_context = mp.get_context
+    methods = []
+
+    def _get_context(method=None):
+        methods.append(method)
+        return get_context(method)
+
+    monkeypatch.setattr('mamotif.integration.mp.get_context', _get_context)
+    outputs = {}
+
+    def _run(name):
+        paths = run_integration(f_manorm, f_motifscan, n_jobs=2,
+                                permutations=10, seed=0,
+                                stratifier=_annotation_stratifier(),
+                                output_dir=str(tmp_path / name))
+        outputs[name] = []
+        for path in paths:
+            with open(path) as fin:
+                outputs[name].append(fin.read())
+
+    _run('main')
+    assert set(methods) == {'fork'}
+    # pools started from other threads (e.g. the stages of `mamotif run`)
+    # do not fork the multithreaded process
+    methods.clear()
+    thread = threading.Thread(target=_run, args=('thread',))
+    thread.start()
+    thread.join()
+    assert methods and 'fork' not in methods
+    assert outputs['thread'] == outputs['main']
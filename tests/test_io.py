@@ -0,0 +1,231 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from mamotif.io import (CHUNK_BYTES, RESULT_COLUMNS, read_bed_intervals,
+                        read_integration_manifest, read_manorm_values,
+                        read_motif_sites_number, split_table_rows,
+                        write_mamotif_pair_results, write_mamotif_results,
+                        write_union_regions)
+
+MOTIFSCAN_TEXT = (
+    "chr\tstart\tend\tMA0001.1,A\tMA0002.1,B\n"
+    "chr1\t101\t200\t0\t2\n"
+    "chr2\t1\t50\t300\t0\n"
+    "chr1\t301\t400\t1\t1\n")
+
+MANORM_TEXT = (
+    "chr\tstart\tend\tsummit\tM_value\tA_value\tP_value\tPeak_Group\n"
+    "chr1\t101\t200\t150\t1.5\t8.0\t0.01\tunique\n"
+    "chr2\t1\t50\t25\t-0.25\t7.0\t0.5\tcommon\n")
+
+
+def _write(path, text, compress=False):
+    if compress:
+        with gzip.open(path, 'wt') as fout:
+            fout.write(text)
+    else:
+        with open(path, 'w') as fout:
+            fout.write(text)
+    return str(path)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_read_motif_sites_number(tmp_path, compress):
+    path = _write(tmp_path / 'motif_sites_number.xls', MOTIFSCAN_TEXT,
+                  compress)
+    motifs, chroms, chrom_codes, starts, ends, counts = \
+        read_motif_sites_number(path, chunk_bytes=20)
+    assert motifs == ['MA0001.1,A', 'MA0002.1,B']
+    assert chroms == ['chr1', 'chr2']
+    assert chrom_codes.tolist() == [0, 1, 0]
+    assert starts.tolist() == [100, 0, 300]
+    assert ends.tolist() == [200, 50, 400]
+    assert counts.dtype == np.uint16
+    assert counts.tolist() == [[0, 2], [300, 0], [1, 1]]
+
+
+def test_read_motif_sites_number_invalid(tmp_path):
+    path = _write(tmp_path / 'motif_sites_number.xls',
+                  MOTIFSCAN_TEXT + "chr1\t501\t600\t1\tx\n")
+    with pytest.raises(ValueError, match="at line 5"):
+        read_motif_sites_number(path)
+    # blank lines are counted, also across chunks
+    path = _write(tmp_path / 'motif_sites_number.xls',
+                  MOTIFSCAN_TEXT + "\n\nchr1\t501\t600\t1\t1.5\n")
+    for chunk_bytes in (20, CHUNK_BYTES):
+        with pytest.raises(ValueError, match="at line 7"):
+            read_motif_sites_number(path, chunk_bytes=chunk_bytes)
+    # chunks of blank lines only are skipped
+    path = _write(tmp_path / 'motif_sites_number.xls',
+                  MOTIFSCAN_TEXT + "\n" * 50)
+    assert len(read_motif_sites_number(path, chunk_bytes=20)[3]) == 3
+    path = _write(tmp_path / 'motif_sites_number.xls',
+                  MOTIFSCAN_TEXT.replace('chr\t', 'chrom\t'))
+    with pytest.raises(ValueError, match="not a valid MotifScan"):
+        read_motif_sites_number(path)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_read_manorm_values(tmp_path, compress):
+    path = _write(tmp_path / 'A_MAvalues.xls', MANORM_TEXT, compress)
+    chroms, chrom_codes, starts, ends, m_values = read_manorm_values(path)
+    assert chroms == ['chr1', 'chr2']
+    assert chrom_codes.tolist() == [0, 1]
+    assert starts.tolist() == [100, 0]
+    assert ends.tolist() == [200, 50]
+    assert m_values.tolist() == [1.5, -0.25]
+
+
+def test_union_regions_and_split(tmp_path):
+    f_manorm1 = _write(tmp_path / 'A_MAvalues.xls', MANORM_TEXT)
+    f_manorm2 = _write(tmp_path / 'B_MAvalues.xls', (
+        "chr\tstart\tend\tsummit\tM_value\tA_value\tP_value\tPeak_Group\n"
+        "chr3\t1\t50\t25\t0.5\t7.0\t0.5\tunique\n"
+        "chr2\t1\t50\t25\t0.25\t7.0\t0.5\tcommon\n"), compress=True)
+    f_union = str(tmp_path / 'union_MAvalues.xls')
+    rows = write_union_regions(f_union, [f_manorm1, f_manorm2])
+    assert rows == [[0, 1], [2, 1]]
+    chroms, _, starts, _, m_values = read_manorm_values(f_union)
+    assert chroms == ['chr1', 'chr2', 'chr3']
+    assert m_values.tolist() == [1.5, -0.25, 0.5]
+
+    f_table = _write(tmp_path / 'table.xls',
+                     "header\nrow0\nrow1\nrow2\n")
+    outputs = [(str(tmp_path / 'out1.xls'), [0, 1]),
+               (str(tmp_path / 'out2.xls'), [2, 1])]
+    split_table_rows(f_table, outputs)
+    with open(outputs[0][0]) as fin:
+        assert fin.read() == "header\nrow0\nrow1\n"
+    with open(outputs[1][0]) as fin:
+        assert fin.read() == "header\nrow2\nrow1\n"
+    with pytest.raises(ValueError):
+        split_table_rows(f_table, [(str(tmp_path / 'out3.xls'), [3])])
+
+
+def test_read_integration_manifest(tmp_path):
+    path = _write(tmp_path / 'manifest.tsv',
+                  "# MAvalues\tmotif_sites_number\tnegative\tprefix\n"
+                  "A_MAvalues.xls\tA/motif_sites_number.xls\n"
+                  "\n"
+                  "/data/B_MAvalues.xls\tB.xls\tYes\tout/B\n")
+    assert read_integration_manifest(path) == [
+        (str(tmp_path / 'A_MAvalues.xls'),
+         str(tmp_path / 'A' / 'motif_sites_number.xls'), False, None),
+        ('/data/B_MAvalues.xls', str(tmp_path / 'B.xls'), True, 'out/B')]
+    path = _write(tmp_path / 'manifest.tsv', "A_MAvalues.xls\tA.xls\tmaybe\n")
+    with pytest.raises(ValueError, match="invalid negative value at line 1"):
+        read_integration_manifest(path)
+    path = _write(tmp_path / 'manifest.tsv', "A_MAvalues.xls\n")
+    with pytest.raises(ValueError, match="expect 2 to 4 columns"):
+        read_integration_manifest(path)
+
+
+def test_read_bed_intervals(tmp_path):
+    path = _write(tmp_path / 'a.bed', "track name=a\nchr1\t10\t20\tx\n"
+                                      "chr2 5 8\n", compress=True)
+    chroms, starts, ends = read_bed_intervals(path)
+    assert chroms == ['chr1', 'chr2']
+    assert starts.tolist() == [10, 5]
+    assert ends.tolist() == [20, 8]
+    path = _write(tmp_path / 'a.bed', "chr1\t10\n")
+    with pytest.raises(ValueError, match="invalid BED format at line 1"):
+        read_bed_intervals(path)
+
+
+def _results():
+    from mamotif.integration import MAmotifResults
+    return MAmotifResults(
+        ['m1', 'm2', 'm3'], n_pos=[3, 0, 5], mean_pos=[0.5, np.nan, 1.0],
+        std_pos=[0.1, np.nan, 0.2], n_neg=[7, 10, 5],
+        mean_neg=[0.0, 0.1, -0.5], std_neg=[0.3, 0.2, 0.1],
+        t_stat=[2.0, np.nan, 3.0], t_pval=[0.02, np.nan, 0.001],
+        t_padj=[0.04, np.nan, 0.002], r_stat=[1.5, np.nan, 2.5],
+        r_pval=[0.05, np.nan, 0.01], r_padj=[0.05, np.nan, 0.02],
+        padj=[0.05, np.nan, 0.02])
+
+
+def test_write_mamotif_results(tmp_path):
+    results = _results()
+    path = str(tmp_path / 'out.xls')
+    write_mamotif_results(path, results, 'benjamin')
+    with open(path) as fin:
+        lines = fin.read().splitlines()
+    assert lines[0].split('\t')[9] == \
+        "T-test P value By Benjamin correction"
+    assert len(lines[0].split('\t')) == 14
+    # sorted by the maximal padj, undefined p-values last
+    assert [line.split('\t')[0] for line in lines[1:]] == ['m3', 'm1', 'm2']
+    assert lines[1].split('\t')[1:4] == ['5', '1.0', '0.2']
+    assert lines[3].split('\t')[13] == 'nan'
+
+    # a list of results gives the same table
+    path_list = str(tmp_path / 'out_list.xls')
+    write_mamotif_results(path_list, list(results), 'benjamin')
+    with open(path_list) as fin:
+        assert fin.read().splitlines() == lines
+
+    path_gz = str(tmp_path / 'out.xls.gz')
+    results.t_perm_pval = np.array([0.1, np.nan, 0.01])
+    results.r_perm_pval = np.array([0.2, np.nan, 0.02])
+    write_mamotif_results(path_gz, results, 'benjamin', permutations=99)
+    with gzip.open(path_gz, 'rt') as fin:
+        lines_gz = fin.read().splitlines()
+    assert lines_gz[0].split('\t')[-1] == \
+        "RankSum-test P value (99 permutations)"
+    assert lines_gz[1].split('\t')[:14] == lines[1].split('\t')
+    assert lines_gz[1].split('\t')[14:] == ['0.01', '0.02']
+
+    # the dose-response columns are written before the permutation columns
+    results.dose_slope = np.array([0.5, np.nan, -0.1])
+    results.dose_stderr = np.array([0.1, np.nan, 0.2])
+    results.dose_pval = np.array([0.001, np.nan, 0.7])
+    write_mamotif_results(path, results, 'benjamin', permutations=99)
+    with open(path) as fin:
+        lines_dose = fin.read().splitlines()
+    assert lines_dose[0].split('\t')[14:18] == [
+        "Dose-response Slope", "Dose-response Std. Error",
+        "Dose-response P value (right-tailed)",
+        "T-test P value (99 permutations)"]
+    assert lines_dose[1].split('\t')[14:] == ['-0.1', '0.2', '0.7', '0.01',
+                                              '0.02']
+
+
+def test_write_mamotif_pair_results(tmp_path):
+    from mamotif.integration import MAmotifPairResults
+    results = _results()
+    pairs = MAmotifPairResults(
+        ['m1', 'm1', 'm2'], ['m2', 'm3', 'm3'],
+        **{field: getattr(results, field)
+           for field in MAmotifPairResults.FIELDS})
+    path = str(tmp_path / 'pairs.xls.gz')
+    write_mamotif_pair_results(path, pairs, 'benjamin')
+    with gzip.open(path, 'rt') as fin:
+        lines = fin.read().splitlines()
+    assert lines[0].split('\t')[:3] == ['Motif A', 'Motif B',
+                                        'Target Number']
+    assert len(lines[0].split('\t')) == 15
+    assert [line.split('\t')[:2] for line in lines[1:]] == \
+        [['m2', 'm3'], ['m1', 'm2'], ['m1', 'm3']]
+    # the same statistics columns as the single motif results
+    path_single = str(tmp_path / 'single.xls')
+    write_mamotif_results(path_single, results, 'benjamin')
+    with open(path_single) as fin:
+        single = fin.read().splitlines()
+    assert [line.split('\t')[2:] for line in lines] == \
+        [line.split('\t')[1:] for line in single]
+
+
+def test_write_mamotif_results_parquet(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'out.parquet')
+    write_mamotif_results(path, _results(), 'storey')
+    table = pq.read_table(path)
+    assert table.column_names == [name for _, name, _ in RESULT_COLUMNS]
+    assert table.column('motif').to_pylist() == ['m3', 'm1', 'm2']
+    assert table.column('target_number').to_pylist() == [5, 3, 0]
+    assert table.column('t_perm_pval').null_count == 3
+    metadata = table.schema.metadata
+    assert metadata[b'correction'] == b'storey'
+    assert metadata[b'permutations'] == b'0'
@@ -0,0 +1,52 @@
+import json
+import os
+import time
+
+from mamotif.integration import run_integration
+from mamotif.profile import StageProfiler
+
+from test_integration import MANORM_MATCHED
+from test_io import MOTIFSCAN_TEXT, _write
+
+
+def test_stage_profiler(tmp_path):
+    profiler = StageProfiler(cprofile_stage='work')
+    for _ in range(2):
+        with profiler.stage('work'):
+            sum(range(10000))
+            time.sleep(0.01)
+    with profiler.stage('idle'):
+        pass
+    report = profiler.report()
+    assert report['stages']['work']['calls'] == 2
+    assert report['stages']['work']['wall_time'] >= 0.02
+    assert report['stages']['idle']['cpu_time'] >= 0
+    assert report['stages']['idle']['peak_memory_mb'] > 0
+
+    path = profiler.write(str(tmp_path))
+    with open(path) as fin:
+        assert json.load(fin)['stages'].keys() == {'work', 'idle'}
+    assert os.path.isfile(tmp_path / 'mamotif_profile_work.prof')
+
+    profiler = StageProfiler(enabled=False)
+    with profiler.stage('work'):
+        pass
+    assert profiler.stages == {}
+
+
+def test_run_integration_profile(tmp_path):
+    f_manorm = _write(tmp_path / 'A_MAvalues.xls', MANORM_MATCHED)
+    f_motifscan = _write(tmp_path / 'motif_sites_number.xls', MOTIFSCAN_TEXT)
+    profiler = StageProfiler()
+    run_integration(f_manorm, f_motifscan, output_dir=str(tmp_path),
+                    permutations=10, seed=0, profiler=profiler)
+    assert list(profiler.stages) == ['strata', 'parse', 'match', 'classify',
+                                     'test', 'permutations', 'write']
+
+    # the regions are loaded from the cache in later runs
+    for _ in range(2):
+        profiler = StageProfiler()
+        run_integration(f_manorm, f_motifscan, output_dir=str(tmp_path),
+                        cache_dir=str(tmp_path / 'cache'), profiler=profiler)
+    assert list(profiler.stages) == ['strata', 'cache', 'classify', 'test',
+                                     'write']
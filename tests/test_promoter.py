@@ -0,0 +1,40 @@
+import numpy as np
+
+from mamotif.promoter import PromoterIndex
+from mamotif.region import RegionTable
+
+GENES_TEXT = (
+    "0\tNM_1\tchr1\t+\t10000\t20000\t10000\t20000\t1\t10000,\t20000,\t0\tA\n"
+    "0\tNM_2\tchr1\t-\t3000\t14500\t3000\t14500\t1\t3000,\t14500,\t0\tB\n"
+    "0\tNM_3\tchr2\t-\t100\t50000\t100\t50000\t1\t100,\t50000,\t0\tC\n")
+
+
+def _regions(chroms, codes, starts, ends):
+    n = len(starts)
+    return RegionTable([], chroms, np.array(codes, dtype=np.int32),
+                       np.array(starts), np.array(ends),
+                       np.zeros((n, 0), dtype=bool), np.zeros(n))
+
+
+def test_promoter_index(tmp_path):
+    path = tmp_path / 'genes.txt'
+    path.write_text(GENES_TEXT)
+    index = PromoterIndex.from_gene_file(str(path), upstream=4000,
+                                         downstream=2000)
+    # promoters [6000, 12000) and [12500, 18500) of chr1 are disjoint,
+    # [48000, 54000) of chr2 ([47000, 54000) with downstream 3000)
+    assert index.chroms == ['chr1', 'chr2']
+    assert len(index) == 3
+    index = PromoterIndex.from_gene_file(str(path), upstream=4000,
+                                         downstream=3000)
+    assert len(index) == 2  # [6000, 13000) and [11500, 18500) are merged
+
+    index.save(str(tmp_path / 'promoters.npz'))
+    index = PromoterIndex.load(str(tmp_path / 'promoters.npz'))
+    regions = _regions(['chr1', 'chr2', 'chrX'], [0, 0, 0, 0, 1, 1, 2],
+                       [0, 5000, 13000, 18500, 40000, 53999, 10000],
+                       [6000, 6001, 13001, 20000, 47000, 60000, 12000])
+    assert index.classify(regions).tolist() == [
+        False, True, True, False, False, True, False]
+    empty = PromoterIndex.from_tss([], [], [])
+    assert not empty.classify(regions).any()
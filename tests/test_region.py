@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from mamotif.region import (MamotifRegion, PackedPresence, RegionTable,
+                            SparsePresence, match_manorm_regions)
+
+
+def _region_table(regions):
+    return RegionTable.from_regions(['motif'], regions)
+
+
+def test_region_table():
+    regions = [MamotifRegion('chr2', 0, 100, n_sites=[1], m_value=0.5),
+               MamotifRegion('chr1', 200, 300, n_sites=[0])]
+    table = _region_table(regions)
+    assert len(table) == 2
+    assert table.chroms == ['chr2', 'chr1']
+    assert table.presence.tolist() == [[True], [False]]
+    assert np.isnan(table.m_values[1])
+    region = table.region(0)
+    assert (region.chrom, region.start, region.end) == ('chr2', 0, 100)
+    assert region.m_value == 0.5
+    with pytest.raises(ValueError):
+        RegionTable(motifs=['a', 'b'], chroms=['chr1'], chrom_codes=[0],
+                    starts=[0], ends=[100], presence=[[True]])
+
+
+def test_chrom_indices():
+    regions = [MamotifRegion(chrom, 0, 100, n_sites=[0])
+               for chrom in ['chr2', 'chr1', 'chr2', 'chrM', 'chr1', 'chr2']]
+    table = _region_table(regions)
+    table.chroms.append('chrY')  # without regions
+    indices = {chrom: idx.tolist() for chrom, idx in table.chrom_indices()}
+    assert indices == {'chr2': [0, 2, 5], 'chr1': [1, 4], 'chrM': [3],
+                       'chrY': []}
+
+
+def test_match_manorm_regions(caplog):
+    manorm_regions = _region_table([
+        MamotifRegion('chr1', 0, 100, n_sites=[0], m_value=1.0),
+        MamotifRegion('chr1', 200, 300, n_sites=[0], m_value=-1.0),
+        MamotifRegion('chr1', 200, 300, n_sites=[0], m_value=5.0),
+        MamotifRegion('chr2', 0, 100, n_sites=[0], m_value=0.5)])
+    regions = _region_table([MamotifRegion('chr2', 0, 100, n_sites=[1]),
+                             MamotifRegion('chr1', 200, 300, n_sites=[0]),
+                             MamotifRegion('chr1', 0, 100, n_sites=[2])])
+    match_manorm_regions(regions, manorm_regions)
+    assert regions.m_values.tolist() == [0.5, -1.0, 1.0]
+    assert "1 duplicated MAnorm regions" in caplog.text
+
+
+def test_match_manorm_regions_unmatched():
+    manorm_regions = _region_table(
+        [MamotifRegion('chr1', 0, 100, n_sites=[0], m_value=1.0)])
+    regions = _region_table([MamotifRegion('chr1', 0, 100, n_sites=[1]),
+                             MamotifRegion('chr1', 0, 101, n_sites=[1]),
+                             MamotifRegion('chr3', 0, 100, n_sites=[1])])
+    with pytest.raises(ValueError, match="for 2 MotifScan regions"):
+        match_manorm_regions(regions, manorm_regions)
+
+
+def test_packed_presence(tmp_path):
+    rng = np.random.RandomState(0)
+    presence = rng.rand(50, 21) < 0.3
+    for packed in (PackedPresence.from_dense(presence, block_size=7),
+                   PackedPresence.from_dense(
+                       presence, path=str(tmp_path / 'bits.npy'))):
+        assert packed.shape == (50, 21)
+        assert packed.bits.shape == (50, 3)
+        assert np.array_equal(packed.to_dense(), presence)
+        assert np.array_equal(packed.column_block(3, 13), presence[:, 3:13])
+        assert np.array_equal(packed[4], presence[4])
+    packed = PackedPresence.load(str(tmp_path / 'bits.npy'), 21)
+    assert isinstance(packed.bits, np.memmap)
+    assert np.array_equal(packed.to_dense(), presence)
+    with pytest.raises(ValueError):
+        PackedPresence(packed.bits, 30)
+
+
+def test_sparse_presence(tmp_path):
+    rng = np.random.RandomState(0)
+    counts = (rng.rand(50, 21) < 0.1) * rng.randint(1, 4, size=(50, 21))
+    presence = counts > 0
+    for sparse in (SparsePresence(counts),
+                   SparsePresence.from_dense(presence, block_size=7),
+                   SparsePresence.from_dense(
+                       PackedPresence.from_dense(presence), block_size=7)):
+        assert sparse.shape == (50, 21)
+        assert sparse.nnz == presence.sum()
+        assert np.array_equal(sparse.to_dense(), presence)
+        assert np.array_equal(sparse.column_block(3, 13), presence[:, 3:13])
+        assert np.array_equal(sparse[4], presence[4])
+        assert np.array_equal(sparse.take([5, 2]).to_dense(),
+                              presence[:, [5, 2]])
+        assert np.allclose(sparse.transpose_dot(np.arange(50)),
+                           presence.T @ np.arange(50))
+    packed = sparse.to_packed(path=str(tmp_path / 'bits.npy'))
+    assert np.array_equal(packed.bits, PackedPresence.from_dense(
+        presence).bits)
+    sparse.save(str(tmp_path / 'presence.npz'))
+    loaded = SparsePresence.load(str(tmp_path / 'presence.npz'))
+    assert np.array_equal(loaded.to_dense(), presence)
+    assert SparsePresence.from_dense(np.zeros((0, 3), dtype=bool)).shape \
+        == (0, 3)
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from mamotif.profile import StageProfiler
+from mamotif.scheduler import StageScheduler
+
+
+def test_stage_scheduler():
+    scheduler = StageScheduler()
+    started = threading.Barrier(2, timeout=5)
+
+    def _branch(results, value):
+        started.wait()  # both branches run concurrently
+        return results['root'] + value
+
+    scheduler.add('root', lambda results: 1)
+    scheduler.add('a', lambda results: _branch(results, 10), deps=['root'])
+    scheduler.add('b', lambda results: _branch(results, 20), deps=['root'])
+    scheduler.add('merge', lambda results: (time.sleep(0.01),
+                                            results['a'] + results['b'])[1],
+                  deps=['a', 'b'])
+    results = scheduler.run()
+    assert results == {'root': 1, 'a': 11, 'b': 21, 'merge': 32}
+    path = [stage.name for stage in scheduler.critical_path()]
+    assert path[0] == 'root' and path[-1] == 'merge'
+
+
+def test_stage_scheduler_failure():
+    scheduler = StageScheduler()
+
+    def _fail(results):
+        raise RuntimeError("stage failed")
+
+    scheduler.add('root', _fail)
+    scheduler.add('child', lambda results: 1, deps=['root'])
+    with pytest.raises(RuntimeError, match="stage failed"):
+        scheduler.run()
+    assert 'child' not in scheduler.results
+    with pytest.raises(ValueError, match="unknown dependency"):
+        scheduler.add('orphan', lambda results: 1, deps=['missing'])
+
+
+def test_stage_scheduler_profiler():
+    profiler = StageProfiler()
+    scheduler = StageScheduler(profiler=profiler)
+    scheduler.add('root', lambda results: 1)
+    scheduler.add('child', lambda results: results['root'] + 1,
+                  deps=['root'])
+    assert scheduler.run() == {'root': 1, 'child': 2}
+    assert set(profiler.stages) == {'root', 'child'}
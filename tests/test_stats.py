@@ -0,0 +1,226 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from scipy import sparse, stats
+
+from mamotif.region import PackedPresence, SparsePresence
+from mamotif.stats import (dose_response, group_moments, grouped_statistics,
+                           mamotif_ranksum_test, mamotif_t_test,
+                           pair_statistics, permutation_counts, presence_dot,
+                           rank_with_ties, ranksum_test, welch_t_test)
+
+
+@pytest.fixture(scope='module')
+def motif_data():
+    rng = np.random.RandomState(0)
+    n_regions, n_motifs = 300, 20
+    m_values = rng.normal(size=n_regions)
+    presence = rng.rand(n_regions, n_motifs) < 0.2
+    presence[:, 0] = False  # no target region
+    presence[:, 1] = True  # no non-target region
+    presence[:, 2] = False
+    presence[0, 2] = True  # single target region
+    return presence, m_values
+
+
+def test_presence_dot(motif_data):
+    presence, m_values = motif_data
+    expected = presence.astype(float).T @ m_values
+    assert np.allclose(presence_dot(presence, m_values), expected)
+    assert np.allclose(presence_dot(presence, m_values, block_size=3),
+                       expected)
+    packed = PackedPresence.from_dense(presence)
+    assert np.allclose(presence_dot(packed, m_values), expected)
+    assert np.allclose(presence_dot(packed, m_values, block_size=3),
+                       expected)
+    assert np.allclose(presence_dot(SparsePresence(presence), m_values),
+                       expected)
+
+
+def test_welch_t_test(motif_data):
+    presence, m_values = motif_data
+    n_pos, mean_pos, var_pos, n_neg, mean_neg, var_neg = group_moments(
+        presence, m_values)
+    t_stats, t_pvals = welch_t_test(n_pos, mean_pos, var_pos, n_neg,
+                                    mean_neg, var_neg)
+    for idx in range(presence.shape[1]):
+        mask = presence[:, idx]
+        assert n_pos[idx] == mask.sum()
+        assert n_neg[idx] == (~mask).sum()
+        if 2 <= n_pos[idx]:
+            assert np.isclose(mean_pos[idx], m_values[mask].mean())
+            assert np.isclose(var_pos[idx], m_values[mask].var())
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            t_stat, t_pval = mamotif_t_test(m_values[mask], m_values[~mask])
+        assert np.isclose(t_stats[idx], t_stat, equal_nan=True)
+        assert np.isclose(t_pvals[idx], t_pval, equal_nan=True)
+
+
+def test_ranksum_test(motif_data):
+    presence, m_values = motif_data
+    m_values = np.round(m_values, 1)  # introduce ties
+    ranks, tie_sum = rank_with_ties(m_values)
+    n_pos = presence.sum(axis=0)
+    rank_sums = presence_dot(presence, ranks)
+    z_stats, p_values = ranksum_test(n_pos, rank_sums, len(m_values))
+    for idx in range(presence.shape[1]):
+        mask = presence[:, idx]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            z_stat, p_value = mamotif_ranksum_test(m_values[mask],
+                                                   m_values[~mask])
+        assert np.isclose(z_stats[idx], z_stat, equal_nan=True)
+        assert np.isclose(p_values[idx], p_value, equal_nan=True)
+
+    # tie-corrected variance agrees with the Mann-Whitney U test
+    z_stats, p_values = ranksum_test(n_pos, rank_sums, len(m_values),
+                                     tie_sum=tie_sum)
+    for idx in range(3, presence.shape[1]):
+        mask = presence[:, idx]
+        _, p_value = stats.mannwhitneyu(m_values[mask], m_values[~mask],
+                                        use_continuity=False,
+                                        alternative='greater')
+        assert np.isclose(p_values[idx], p_value)
+
+
+def test_permutation_counts(motif_data):
+    presence, m_values = motif_data
+    mask = np.arange(len(m_values)) % 3 > 0
+    for mask_ in [None, mask]:
+        t_counts, r_counts = permutation_counts(
+            presence, m_values, 50, seed=1, mask=mask_, batch_size=7)
+        selected = np.ones(len(m_values), dtype=bool) if mask_ is None \
+            else mask_
+        values = m_values[selected]
+        rng = np.random.default_rng(1)
+        expected_t = np.zeros(presence.shape[1], dtype=int)
+        expected_r = np.zeros(presence.shape[1], dtype=int)
+        t_obs = welch_t_test(*group_moments(presence[selected], values))[0]
+        ranks = stats.rankdata(values)
+        r_obs = presence[selected].T @ ranks
+        for _ in range(50):
+            permuted = values[rng.permutation(len(values))]
+            t_perm = welch_t_test(*group_moments(presence[selected],
+                                                 permuted))[0]
+            with np.errstate(invalid='ignore'):
+                expected_t += t_perm >= t_obs - 1e-8
+            expected_r += presence[selected].T @ stats.rankdata(
+                permuted) >= r_obs - 1e-6
+        n_pos = presence[selected].sum(axis=0)
+        expected_r[(n_pos == 0) | (n_pos == len(values))] = 0
+        assert np.array_equal(t_counts, expected_t)
+        assert np.array_equal(r_counts, expected_r)
+        assert t_counts[0] == t_counts[1] == t_counts[2] == 0
+
+
+def test_permutation_counts_reproducible(motif_data):
+    presence, m_values = motif_data
+    packed = PackedPresence.from_dense(presence)
+    counts = permutation_counts(presence, m_values, 30, seed=5)
+    for other in [permutation_counts(presence, m_values, 30, seed=5,
+                                     batch_size=4),
+                  permutation_counts(packed, m_values, 30, seed=5),
+                  permutation_counts(SparsePresence(presence), m_values, 30,
+                                     seed=5)]:
+        assert np.array_equal(counts[0], other[0])
+        assert np.array_equal(counts[1], other[1])
+
+
+@pytest.mark.parametrize('presence_type', [PackedPresence, SparsePresence])
+def test_grouped_statistics(motif_data, presence_type):
+    presence, m_values = motif_data
+    mask = np.arange(len(m_values)) % 3 > 0
+    masks = [None, mask, ~mask]
+    for mask_, statistics in zip(masks, grouped_statistics(
+            presence_type.from_dense(presence), m_values, masks)):
+        selected = np.ones(len(m_values), dtype=bool) if mask_ is None \
+            else mask_
+        for value, expected in zip(statistics[:6], group_moments(
+                presence, m_values, mask=mask_)):
+            assert np.allclose(value, expected, equal_nan=True)
+        ranks, tie_sum = rank_with_ties(m_values[selected])
+        assert np.allclose(statistics[6], presence[selected].T @ ranks)
+        assert statistics[7] == selected.sum()
+        assert statistics[8] == tie_sum
+
+
+@pytest.mark.parametrize('presence_type',
+                         [np.asarray, PackedPresence.from_dense,
+                          SparsePresence.from_dense])
+def test_pair_statistics(motif_data, presence_type):
+    presence, m_values = motif_data
+    mask = np.arange(len(m_values)) % 3 > 0
+    data = presence_type(presence)
+    # the first motifs of the pairs in two ranges, small column blocks
+    parts = [pair_statistics(data, m_values, start, end, mask=mask,
+                             min_support=3, block_size=8)
+             for start, end in [(0, 8), (8, 20)]]
+    idx_a = np.concatenate([part[0] for part in parts])
+    idx_b = np.concatenate([part[1] for part in parts])
+    selected = presence[mask]
+    counts = selected.T.astype(int) @ selected
+    expected = [(i, j) for i in range(20) for j in range(i + 1, 20)
+                if counts[i, j] >= 3]
+    assert sorted(zip(idx_a.tolist(), idx_b.tolist())) == expected
+
+    ranks, tie_sum = rank_with_ties(m_values[mask])
+    for part in parts:
+        for idx, (i, j) in enumerate(zip(part[0], part[1])):
+            target = selected[:, i] & selected[:, j]
+            pos, neg = m_values[mask][target], m_values[mask][~target]
+            statistics = part[2]
+            assert statistics[0][idx] == len(pos)
+            assert statistics[1][idx] == pytest.approx(pos.mean())
+            assert statistics[2][idx] == pytest.approx(pos.var())
+            assert statistics[3][idx] == len(neg)
+            assert statistics[4][idx] == pytest.approx(neg.mean())
+            assert statistics[5][idx] == pytest.approx(neg.var())
+            assert statistics[6][idx] == pytest.approx(ranks[target].sum())
+        assert part[2][7:] == (mask.sum(), tie_sum)
+
+
+@pytest.mark.parametrize('transform', ['count', 'log1p'])
+def test_dose_response(transform):
+    rng = np.random.RandomState(0)
+    site_counts = rng.poisson(0.5, size=(300, 6))
+    site_counts[:, 4] = site_counts[:, 4] > 0  # constant among targets
+    m_values = rng.normal(size=300) + site_counts[:, 0]
+    mask = np.arange(300) % 3 > 0
+    masks = [None, mask]
+    results = dose_response(
+        site_counts, m_values, masks,
+        grouped_statistics(site_counts > 0, m_values, masks),
+        transform=transform, block_size=4)
+    for mask_, (slope, stderr, p_right) in zip(masks, results):
+        selected = np.ones(300, dtype=bool) if mask_ is None else mask_
+        for idx in range(6):
+            doses = site_counts[selected, idx].astype(float)
+            if transform == 'log1p':
+                doses = np.log1p(doses)
+            design = np.column_stack([np.ones(len(doses)), doses > 0, doses])
+            if np.linalg.matrix_rank(design) < 3:
+                assert np.isnan(slope[idx]) and np.isnan(p_right[idx])
+                continue
+            y = m_values[selected]
+            beta = np.linalg.lstsq(design, y, rcond=None)[0]
+            residuals = y - design @ beta
+            df = len(y) - 3
+            cov = np.linalg.inv(design.T @ design) * (
+                    residuals @ residuals / df)
+            assert slope[idx] == pytest.approx(beta[2])
+            assert stderr[idx] == pytest.approx(np.sqrt(cov[2, 2]))
+            assert p_right[idx] == pytest.approx(
+                stats.t.sf(beta[2] / np.sqrt(cov[2, 2]), df))
+    assert results[0][2][0] < 0.05
+    # sparse site numbers give the same fit
+    for subset_results, expected in zip(dose_response(
+            sparse.csc_matrix(site_counts), m_values, masks,
+            grouped_statistics(site_counts > 0, m_values, masks),
+            transform=transform), results):
+        for value, expected_value in zip(subset_results, expected):
+            assert np.allclose(value, expected_value, equal_nan=True)
+    with pytest.raises(ValueError, match="invalid dose-response transform"):
+        dose_response(site_counts, m_values, masks, [], transform='log')
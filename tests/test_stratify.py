@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from mamotif.promoter import IntervalIndex, PromoterIndex, TssIndex
+from mamotif.stratify import (Stratifier, parse_annotation, parse_tss_bins,
+                              tss_bin_names)
+
+from test_promoter import GENES_TEXT, _regions
+
+
+def test_parse_options(tmp_path):
+    assert parse_tss_bins('1000,5000,50000') == [1000, 5000, 50000]
+    for text in ['', '1000,500', '0,1000', '1kb']:
+        with pytest.raises(ValueError):
+            parse_tss_bins(text)
+    assert tss_bin_names([1000, 5000, 1500]) == [
+        'tss_0-1kb', 'tss_1kb-5kb', 'tss_5kb-1500bp', 'tss_gt1500bp']
+    assert parse_annotation('enhancer=/data/a.bed') == \
+        ('enhancer', '/data/a.bed')
+    assert parse_annotation('/data/cpg_islands.bed.gz') == \
+        ('cpg_islands', '/data/cpg_islands.bed.gz')
+
+
+def test_stratifier(tmp_path):
+    path = tmp_path / 'genes.txt'
+    path.write_text(GENES_TEXT)
+    # TSSs: chr1 10000 (+) and 14500 (-), chr2 50000 (-)
+    tss = TssIndex.from_gene_file(str(path))
+    regions = _regions(['chr1', 'chr2', 'chrX'], [0, 0, 0, 1, 1, 2],
+                       [9000, 10500, 20000, 100, 49000, 0],
+                       [10001, 14000, 20500, 200, 49900, 100])
+    assert tss.distances(regions).tolist() == [
+        0, 500, 5500, 49801, 101, np.inf]
+
+    enhancers = IntervalIndex.from_intervals(['chr2', 'chr1'], [0, 10500],
+                                             [150, 11000])
+    promoters = PromoterIndex.from_gene_file(str(path))
+    stratifier = Stratifier(promoters=promoters, tss=tss,
+                            tss_bins=[1000, 5000],
+                            annotations=[('enhancer', enhancers)])
+    subsets = stratifier.subsets(regions)
+    assert [name for name, _ in subsets] == [
+        'all', 'promoter', 'distal', 'tss_0-1kb', 'tss_1kb-5kb', 'tss_gt5kb',
+        'enhancer']
+    masks = dict(subsets)
+    assert masks['all'] is None
+    assert masks['promoter'].tolist() == [True, True, False, False, True,
+                                          False]
+    assert masks['tss_0-1kb'].tolist() == [True, True, False, False, True,
+                                           False]
+    assert masks['tss_gt5kb'].tolist() == [False, False, True, True, False,
+                                           True]
+    assert masks['enhancer'].tolist() == [False, True, False, True, False,
+                                          False]
+    with pytest.raises(ValueError, match="duplicated stratum name"):
+        Stratifier(annotations=[('promoter', enhancers)])